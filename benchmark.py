@@ -0,0 +1,478 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+import utils
+
+
+def synthetic_embeddings(n, n_clusters=100, noise=0.3, noise_ratio=0.1, dim=512, seed=0):
+    """
+    生成归一化的合成人脸特征
+
+    n_clusters 个随机方向作为簇中心，成员为中心加高斯扰动（noise 越大簇越松散），
+    另有 noise_ratio 比例的点为随机方向（陌生人）。返回 (features, 真实标签)。
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((n_clusters, dim)).astype(np.float32)
+    centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+    n_noise = int(n * noise_ratio)
+    labels = np.concatenate([rng.integers(0, n_clusters, n - n_noise), np.full(n_noise, -1)])
+    features = rng.standard_normal((n, dim)).astype(np.float32) * (noise / np.sqrt(dim))
+    members = labels >= 0
+    features[members] += centers[labels[members]]
+    features[~members] = rng.standard_normal((n_noise, dim)).astype(np.float32)
+    features /= np.linalg.norm(features, axis=1, keepdims=True)
+    order = rng.permutation(n)
+    return features[order], labels[order]
+
+
+def synthetic_snapshots(image_dir, n, size=(112, 112), seed=0):
+    """在 image_dir 下生成 n 张合成抓拍 JPEG（随机底色和椭圆），返回路径列表"""
+    rng = np.random.default_rng(seed)
+    os.makedirs(image_dir, exist_ok=True)
+    paths = []
+    for i in range(n):
+        image = np.empty((size[1], size[0], 3), dtype=np.uint8)
+        image[:] = rng.integers(0, 256, 3)
+        center = (size[0] // 2, size[1] // 2)
+        axes = (size[0] // 3, size[1] * 2 // 5)
+        cv2.ellipse(image, center, axes, 0, 0, 360, rng.integers(0, 256, 3).tolist(), -1)
+        noise = rng.integers(0, 32, image.shape, dtype=np.uint8)
+        image = cv2.add(image, noise)
+        path = os.path.join(image_dir, f'{20240101000000 + i}_{i:06d}_FACE_SNAP.jpg')
+        cv2.imwrite(path, image, [cv2.IMWRITE_JPEG_QUALITY, 90])
+        paths.append(path)
+    return paths
+
+
+class BenchmarkRecorder:
+    """收集每个阶段的计时结果，输出表格、缩放曲线和 JSON"""
+
+    def __init__(self):
+        self.results = []
+
+    def add(self, stage, n, seconds, variant='', peak_mb=None, **extra):
+        result = {'stage': stage, 'variant': variant, 'n': n, 'seconds': round(seconds, 6),
+                  'items_per_sec': round(n / seconds, 2) if seconds > 0 else None,
+                  'peak_mb': round(peak_mb, 2) if peak_mb is not None else None}
+        result.update(extra)
+        self.results.append(result)
+        name = f'{stage}[{variant}]' if variant else stage
+        memory = f'  峰值 {peak_mb:.1f} MB' if peak_mb is not None else ''
+        if extra.get('rss_mb') is not None:
+            memory += f'  进程RSS {extra["rss_mb"]:.1f} MB'
+        print(f'{name:<28} N={n:<8} {seconds:10.4f} s  {result["items_per_sec"] or 0:12.1f} 个/秒{memory}')
+
+    def skip(self, stage, reason, variant=''):
+        self.results.append({'stage': stage, 'variant': variant, 'skipped': reason})
+        print(f'{stage}[{variant}] 跳过: {reason}' if variant else f'{stage} 跳过: {reason}')
+
+    def scaling(self):
+        """
+        对每个阶段拟合 log(耗时) ~ k * log(N) 的斜率 k
+
+        k 约为 1 表示线性，约为 2 表示平方级增长，用于发现随 N 退化的阶段。
+        """
+        curves = {}
+        for result in self.results:
+            if 'skipped' in result or result['seconds'] <= 0:
+                continue
+            name = f"{result['stage']}[{result['variant']}]" if result['variant'] else result['stage']
+            curves.setdefault(name, []).append((result['n'], result['seconds'], result['peak_mb']))
+        summary = {}
+        for name, points in curves.items():
+            points.sort()
+            entry = {'n': [p[0] for p in points], 'seconds': [p[1] for p in points],
+                     'peak_mb': [p[2] for p in points]}
+            ns = np.array(entry['n'], dtype=np.float64)
+            if len(set(entry['n'])) >= 2:
+                entry['time_exponent'] = round(float(np.polyfit(np.log(ns), np.log(entry['seconds']), 1)[0]), 3)
+                if all(p is not None and p > 0 for p in entry['peak_mb']):
+                    entry['memory_exponent'] = round(
+                        float(np.polyfit(np.log(ns), np.log(entry['peak_mb']), 1)[0]), 3)
+            summary[name] = entry
+        return summary
+
+    def save(self, output_path, args):
+        payload = {
+            'created_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'cpu_count': os.cpu_count(),
+            'args': vars(args),
+            'results': self.results,
+            'scaling': self.scaling(),
+        }
+        os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+        with open(output_path, 'w', encoding='utf-8') as f:
+            json.dump(payload, f, ensure_ascii=False, indent=2)
+        return payload
+
+
+def _measure(fn, repeat=3, setup=None):
+    """
+    先预热执行一次（模块导入、BLAS 线程池、磁盘缓存等一次性开销不计入耗时），预热时用
+    tracemalloc 记录 Python/numpy 分配的峰值内存；再计时执行 repeat 次取中位数。
+    setup 返回 fn 的参数元组，每次执行前调用且不计时，用于重建有状态的输入。
+
+    返回 (最后一次的结果, 耗时中位数, 峰值内存 MB)
+    """
+    args = setup() if setup is not None else ()
+    tracemalloc.start()
+    try:
+        fn(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    times = []
+    for _ in range(max(1, repeat)):
+        args = setup() if setup is not None else ()
+        with utils.Timer(verbose=False) as timer:
+            result = fn(*args)
+        times.append(timer.elapsed)
+    return result, float(np.median(times)), peak / 1024 / 1024
+
+
+def bench_clustering(recorder, features, engines, eps, min_samples, work_dir, logger, repeat=3):
+    """各聚类引擎的耗时和峰值内存；incremental / knn 只计入最后 10% 新点的增量更新"""
+    from sklearn.metrics import adjusted_rand_score
+
+    from face_cluster_dbscan import dbscan_labels
+    from incremental_cluster import IncrementalClusterer
+    from knn_graph import KnnGraphClusterer
+
+    n = len(features)
+    reference = None
+    for engine in engines:
+        try:
+            if engine in ('incremental', 'knn'):
+                n_base = n - max(1, n // 10)
+
+                def setup(engine=engine, n_base=n_base):
+                    # 每次计时都从只含前 90% 点的新状态开始
+                    state_path = os.path.join(tempfile.mkdtemp(dir=work_dir), f'{engine}_state_{n}.npz')
+                    if engine == 'knn':
+                        clusterer = KnnGraphClusterer(state_path, threshold=1.0 - eps, min_cluster_size=min_samples,
+                                                      engine='faiss', logger=logger)
+                    else:
+                        clusterer = IncrementalClusterer(state_path, eps=eps, min_samples=min_samples,
+                                                         engine='faiss', logger=logger)
+                    clusterer.update(features[:n_base])
+                    return (clusterer,)
+
+                labels, seconds, peak_mb = _measure(lambda clusterer: clusterer.update(features), repeat, setup)
+                recorder.add('cluster', n, seconds, variant=engine, peak_mb=peak_mb, inserted=n - n_base)
+            else:
+                labels, seconds, peak_mb = _measure(
+                    lambda: dbscan_labels(features, eps=eps, min_samples=min_samples, engine=engine, logger=logger),
+                    repeat)
+                n_clusters = len(set(labels.tolist())) - (1 if -1 in labels else 0)
+                # 与第一个引擎的结果比较，不同引擎的标签应当一致
+                agreement = None
+                if reference is None:
+                    reference = labels
+                else:
+                    agreement = round(float(adjusted_rand_score(reference, labels)), 4)
+                recorder.add('cluster', n, seconds, variant=engine, peak_mb=peak_mb, clusters=n_clusters,
+                             ari_vs_first=agreement)
+        except (ImportError, MemoryError) as e:
+            recorder.skip('cluster', f'{type(e).__name__}: {e}', variant=engine)
+
+
+def _start_ftp_server(root):
+    """在本地启动一个临时 FTP 服务（pyftpdlib），返回 (server, port)"""
+    from pyftpdlib.authorizers import DummyAuthorizer
+    from pyftpdlib.handlers import FTPHandler
+    from pyftpdlib.servers import ThreadedFTPServer
+
+    # pyftpdlib 的 logger 没有 handler 时会自行配置为输出 INFO 日志
+    ftp_logger = logging.getLogger('pyftpdlib')
+    ftp_logger.setLevel(logging.WARNING)
+    if not ftp_logger.handlers:
+        ftp_logger.addHandler(logging.NullHandler())
+    authorizer = DummyAuthorizer()
+    authorizer.add_user('bench', 'bench', root, perm='elr')
+    handler = type('BenchHandler', (FTPHandler,), {'authorizer': authorizer})
+    server = ThreadedFTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, name='bench-ftp', daemon=True).start()
+    return server, server.address[1]
+
+
+def bench_ftp(recorder, image_dir, work_dir, workers, logger, repeat=3):
+    """对本地 FTP 服务计时：目录列举，以及 disk / memory 两种接收方式的下载"""
+    try:
+        server, port = _start_ftp_server(image_dir)
+    except ImportError:
+        recorder.skip('ftp', '未安装 pyftpdlib')
+        return
+    from ftp_download import FTPConnectionPool, RemoteListingCursor, download_new_images_from_ftp, \
+        list_remote_files
+    from manifest import ALL_STATUSES, DOWNLOADED, ProcessingManifest
+
+    n = len([f for f in os.listdir(image_dir) if '_FACE_SNAP' in f])
+    try:
+        pool = FTPConnectionPool('127.0.0.1', 'bench', 'bench', '/', port=port, size=workers, logger=logger)
+        ftp = pool.acquire()
+        _, seconds, _ = _measure(lambda: list_remote_files(ftp, RemoteListingCursor(None), logger=logger), repeat)
+        pool.release(ftp)
+        recorder.add('ftp_list', n, seconds)
+
+        def setup():
+            # 每次下载使用新的本地目录和空的处理清单
+            run_dir = tempfile.mkdtemp(dir=work_dir)
+            processed = ProcessingManifest(os.path.join(run_dir, 'manifest.db')).view(ALL_STATUSES, DOWNLOADED)
+            return os.path.join(run_dir, 'images'), processed
+
+        for ingest_mode in ('disk', 'memory'):
+            def download(local_dir, processed, ingest_mode=ingest_mode):
+                try:
+                    return download_new_images_from_ftp(
+                        '127.0.0.1', 'bench', 'bench', '/', local_dir, processed, logger,
+                        retry_delay=0, pool=pool, ingest_mode=ingest_mode, persist_images=False,
+                        on_downloaded=(lambda path, data: None) if ingest_mode == 'memory' else None)
+                finally:
+                    processed.manifest.close()
+
+            downloaded, seconds, _ = _measure(download, repeat, setup)
+            recorder.add('ftp_download', len(downloaded), seconds, variant=f'{ingest_mode}x{workers}')
+        pool.close()
+    finally:
+        server.close_all()
+
+
+def bench_decode(recorder, paths, repeat=3):
+    """从磁盘读取并解码，以及只解码内存中的字节"""
+    from image_loader import PrefetchLoader
+
+    blobs = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            blobs.append(f.read())
+    variants = (
+        ('imread', lambda: [cv2.imread(path) for path in paths]),
+        ('imdecode', lambda: [cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+                              for data in blobs]),
+        ('prefetch', lambda: list(PrefetchLoader(paths, batch_size=32, num_workers=4))),
+    )
+    for variant, fn in variants:
+        _, seconds, _ = _measure(fn, repeat)
+        recorder.add('decode', len(paths), seconds, variant=variant)
+
+
+# 冷启动测量：在子进程中导入模块，输出导入耗时和进程峰值内存
+# Linux 上 ru_maxrss 会从 fork 出子进程的父进程继承，优先读取 exec 之后的 VmHWM
+_STARTUP_PROBE = (
+    'import json, time\n'
+    'start = time.perf_counter()\n'
+    '{statement}\n'
+    'seconds = time.perf_counter() - start\n'
+    'rss = None\n'
+    'try:\n'
+    '    with open("/proc/self/status") as f:\n'
+    '        rss = next(int(l.split()[1]) * 1024 for l in f if l.startswith("VmHWM:"))\n'
+    'except (OSError, StopIteration):\n'
+    '    from metrics import peak_rss_bytes\n'
+    '    rss = peak_rss_bytes()\n'
+    'print(json.dumps({{"seconds": seconds, "rss": rss}}))\n'
+)
+
+# (名称, 导入语句)：torch 为去掉前的依赖，用于对比
+STARTUP_TARGETS = (
+    ('interpreter', 'pass'),
+    ('onnxruntime', 'import onnxruntime'),
+    ('torch', 'import torch'),
+    ('face_features', 'import face_features'),
+)
+
+
+def bench_startup(recorder, repeat=3):
+    """
+    各模块在新进程中的导入耗时和峰值常驻内存（每个多进程提取的工作进程都要付出这部分开销）
+
+    第一次启动只用于预热磁盘缓存，取之后 repeat 次的中位数。
+    """
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    for name, statement in STARTUP_TARGETS:
+        probes = []
+        for _ in range(max(1, repeat) + 1):
+            proc = subprocess.run([sys.executable, '-c', _STARTUP_PROBE.format(statement=statement)],
+                                  cwd=repo_dir, capture_output=True, text=True)
+            if proc.returncode != 0:
+                break
+            probes.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+        if proc.returncode != 0:
+            lines = proc.stderr.strip().splitlines()
+            recorder.skip('startup', lines[-1] if lines else f'退出码 {proc.returncode}', variant=name)
+            continue
+        probes = probes[1:]
+        rss = [p['rss'] for p in probes if p['rss'] is not None]
+        rss_mb = float(np.median(rss)) / 1024 / 1024 if rss else None
+        recorder.add('startup', 1, float(np.median([p['seconds'] for p in probes])), variant=name,
+                     rss_mb=round(rss_mb, 1) if rss_mb is not None else None)
+
+
+def bench_extraction(recorder, paths, config_path, batch_size, logger, repeat=3):
+    """
+    检测+识别耗时（需要 insightface 和模型文件）
+
+    合成图像中没有真实人脸，detect 模式主要反映检测模型的耗时；
+    direct 模式跳过检测，反映识别模型的批量推理耗时。
+    """
+    try:
+        import main
+        from face_features import FaceExtractor
+        fa_config = dict(main.load_config(config_path)['FaceAnalysis'])
+        extractor = FaceExtractor(fa_config, logger)
+    except Exception as e:
+        recorder.skip('extract', f'{type(e).__name__}: {e}')
+        return
+
+    images = [cv2.imread(path) for path in paths]
+    for snap_mode in ('detect', 'direct'):
+        extractor.reload_if_changed(dict(fa_config, snap_mode=snap_mode))
+
+        def extract():
+            n_faces = 0
+            for start in range(0, len(images), batch_size):
+                features, _, _, _, _ = extractor.extract_batch(images[start:start + batch_size],
+                                                            paths[start:start + batch_size])
+                n_faces += len(features)
+            return n_faces
+
+        n_faces, seconds, _ = _measure(extract, repeat)
+        recorder.add('extract', len(paths), seconds, variant=snap_mode, faces=n_faces)
+
+
+def bench_report(recorder, paths, n_clusters, work_dir, logger, repeat=3):
+    """单页报告与分页报告（首次生成、以及无变化时的增量重建）"""
+    from visualize_clusters_by_dbscan import generate_paged_report, generate_report
+
+    n = len(paths)
+    rng = np.random.default_rng(0)
+    labels_path = os.path.join(work_dir, f'labels_report_{n}.npy')
+    np.save(labels_path, rng.integers(-1, max(1, n_clusters), n))
+
+    _, seconds, _ = _measure(lambda: generate_report(os.path.join(work_dir, f'report_{n}.html'), labels_path, paths),
+                             repeat)
+    recorder.add('report', n, seconds, variant='single')
+
+    report_dir = os.path.join(work_dir, f'report_{n}')
+    thumb_dir = os.path.join(work_dir, f'thumbs_{n}')
+
+    def paged():
+        generate_paged_report(report_dir, labels_path, paths, thumb_dir, logger=logger)
+
+    def clear():
+        # 冷启动：没有缩略图缓存和已生成的页面
+        shutil.rmtree(report_dir, ignore_errors=True)
+        shutil.rmtree(thumb_dir, ignore_errors=True)
+        return ()
+
+    _, seconds, _ = _measure(paged, repeat, setup=clear)
+    recorder.add('report', n, seconds, variant='paged_cold')
+    _, seconds, _ = _measure(paged, repeat)
+    recorder.add('report', n, seconds, variant='paged_warm')
+
+
+def load_results(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def compare_results(current, previous, previous_path):
+    """与之前的结果逐项比较耗时，比值 > 1 表示变慢"""
+    baseline = {(r['stage'], r['variant'], r['n']): r['seconds'] for r in previous['results'] if 'seconds' in r}
+    print(f'\n与 {previous_path} 比较（当前/之前）:')
+    for result in current['results']:
+        key = (result['stage'], result['variant'], result.get('n'))
+        if 'seconds' in result and baseline.get(key):
+            ratio = result['seconds'] / baseline[key]
+            flag = '  <-- 变慢' if ratio > 1.2 else ''
+            name = f'{key[0]}[{key[1]}]' if key[1] else key[0]
+            print(f'{name:<28} N={key[2]:<8} x{ratio:6.2f}{flag}')
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description='各阶段性能基准测试（合成数据）')
+    parser.add_argument('--sizes', default='1000,5000,20000', help='聚类阶段的特征数量 N，逗号分隔')
+    parser.add_argument('--image-sizes', default='200,1000', help='图像相关阶段的图片数量，逗号分隔')
+    parser.add_argument('--clusters', type=int, default=100, help='合成特征的簇数量')
+    parser.add_argument('--noise', type=float, default=0.3, help='簇内扰动强度')
+    parser.add_argument('--noise-ratio', type=float, default=0.1, help='陌生人（随机点）比例')
+    parser.add_argument('--engines', default='sklearn,faiss,incremental,knn', help='参与比较的聚类引擎')
+    parser.add_argument('--eps', type=float, default=0.5)
+    parser.add_argument('--min-samples', type=int, default=2)
+    parser.add_argument('--stages', default='startup,ftp,decode,extract,cluster,report', help='要运行的阶段')
+    parser.add_argument('--workers', type=int, default=4, help='FTP 并行连接数')
+    parser.add_argument('--batch-size', type=int, default=32, help='特征提取批量大小')
+    parser.add_argument('--config', default='config.ini', help='特征提取使用的配置文件')
+    parser.add_argument('--output', default='files/benchmark.json', help='JSON 结果文件')
+    parser.add_argument('--compare', help='与之前的 JSON 结果文件比较（在写入本次结果之前读取，可与 --output 相同）')
+    parser.add_argument('--repeat', type=int, default=3, help='每项预热一次后计时的次数，取中位数')
+    parser.add_argument('--keep', action='store_true', help='保留临时工作目录')
+    args = parser.parse_args()
+    # 先读取之前的结果，--compare 与 --output 为同一文件时不会与本次结果自己比较
+    previous = load_results(args.compare) if args.compare else None
+
+    stages = set(args.stages.split(','))
+    work_dir = tempfile.mkdtemp(prefix='face-cluster-bench-')
+    utils.LOG_FILE = os.path.join(work_dir, 'benchmark.log')
+    logger = utils.setup_logger('benchmark')
+    # 各模块的 info 日志会影响计时，只保留警告和错误
+    logger.setLevel(logging.WARNING)
+    recorder = BenchmarkRecorder()
+
+    try:
+        if 'startup' in stages:
+            bench_startup(recorder, args.repeat)
+        for n in [int(s) for s in args.image_sizes.split(',') if s]:
+            if not stages & {'ftp', 'decode', 'extract', 'report'}:
+                break
+            image_dir = os.path.join(work_dir, f'images_{n}')
+            paths = synthetic_snapshots(image_dir, n)
+            if 'ftp' in stages:
+                bench_ftp(recorder, image_dir, work_dir, args.workers, logger, args.repeat)
+            if 'decode' in stages:
+                bench_decode(recorder, paths, args.repeat)
+            if 'extract' in stages:
+                bench_extraction(recorder, paths, args.config, args.batch_size, logger, args.repeat)
+            if 'report' in stages:
+                bench_report(recorder, paths, args.clusters, work_dir, logger, args.repeat)
+
+        if 'cluster' in stages:
+            engines = args.engines.split(',')
+            for n in [int(s) for s in args.sizes.split(',') if s]:
+                features, _ = synthetic_embeddings(n, args.clusters, args.noise, args.noise_ratio)
+                bench_clustering(recorder, features, engines, args.eps, args.min_samples, work_dir, logger,
+                                 args.repeat)
+
+        payload = recorder.save(args.output, args)
+        print('\n缩放指数（耗时 ∝ N^k）:')
+        for name, curve in payload['scaling'].items():
+            if 'time_exponent' in curve:
+                memory = f"  内存 k={curve['memory_exponent']}" if 'memory_exponent' in curve else ''
+                print(f"{name:<28} k={curve['time_exponent']}{memory}")
+        print(f'\n结果已保存到 {args.output}')
+        if previous is not None:
+            compare_results(payload, previous, args.compare)
+    finally:
+        if args.keep:
+            print(f'临时工作目录: {work_dir}')
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main_cli()
@@ -0,0 +1,104 @@
+import os
+
+import numpy as np
+
+import manifest
+
+
+class CheckpointWriter:
+    """
+    分块提交提取结果
+
+    人脸特征在内存中累积到 checkpoint_every 条（或累积的图片数达到该值）后
+    写入特征存储，写入成功后才在处理清单中标记这一块的图片。内存占用与积压
+    规模无关；中途崩溃时未提交块中的图片仍是未处理状态，重启后从最后一次
+    提交处继续提取。
+    """
+
+    def __init__(self, feature_store, processed_files_set, logger, checkpoint_every=1024, dedup=None):
+        self.feature_store = feature_store
+        self.processed_files_set = processed_files_set
+        self.logger = logger
+        self.checkpoint_every = max(1, checkpoint_every)
+        self.dedup = dedup
+        self.committed = 0
+        self._reset()
+
+    def _reset(self):
+        self.features = []
+        self.face_paths = []
+        self.no_face_paths = []
+        self.failed_paths = []
+        self.duplicate_paths = []
+        self.rejected = []
+        self.n_images = 0
+
+    def skip_committed(self, image_paths):
+        """
+        返回 image_paths 中尚未提交的图片
+
+        特征存储最后两块中已有人脸、但清单中未标记的图片（写入特征后、标记前
+        崩溃）直接补记为已提取。
+        """
+        if not image_paths or self.feature_store.count == 0:
+            return image_paths
+        tail = self.feature_store.tail_paths(2 * self.checkpoint_every)
+        committed = {os.path.basename(p.split('#')[0]) for p in tail}
+        recovered = [p for p in image_paths if os.path.basename(p) in committed]
+        if not recovered:
+            return image_paths
+        self.processed_files_set.mark_many([os.path.basename(p) for p in recovered], manifest.EMBEDDED)
+        self.logger.info(f"{len(recovered)} 张图片的特征已在上次提交中写入，补记为已提取")
+        recovered = set(recovered)
+        return [p for p in image_paths if p not in recovered]
+
+    def add(self, features, face_paths, no_face_paths, failed_paths, rejected):
+        """加入一批提取结果（FaceExtractor.extract_batch 的返回值），达到阈值时提交"""
+        duplicate_paths = []
+        if self.dedup is not None:
+            # 连拍去重：重复人脸只记录映射，不写入特征存储
+            features, face_paths, duplicate_paths = self.dedup.filter(features, face_paths)
+        if face_paths:
+            self.features.append(features)
+            self.face_paths.extend(face_paths)
+        self.no_face_paths.extend(no_face_paths)
+        self.failed_paths.extend(failed_paths)
+        self.duplicate_paths.extend(duplicate_paths)
+        self.rejected.extend(rejected)
+        self.n_images += len(no_face_paths) + len(failed_paths) + len(rejected) + \
+            len({p.split('#')[0] for p in face_paths + duplicate_paths})
+        if len(self.face_paths) >= self.checkpoint_every or self.n_images >= self.checkpoint_every:
+            self.flush()
+
+    def flush(self):
+        """提交当前块：先写入特征存储，再标记清单"""
+        if self.face_paths:
+            self.feature_store.append(np.concatenate(self.features, axis=0), self.face_paths)
+            self.committed += len(self.face_paths)
+            self.logger.info(f"检查点：已提交 {len(self.face_paths)} 条特征，本轮累计 {self.committed} 条")
+        if self.dedup is not None:
+            self.dedup.commit()
+        mark_processed(self.processed_files_set, self.face_paths, self.no_face_paths, self.logger,
+                       self.failed_paths, self.duplicate_paths, self.rejected)
+        self._reset()
+
+
+def mark_processed(processed_files_set, face_paths, no_face_paths, logger, failed_paths=(), duplicate_paths=(),
+                   rejected=()):
+    """在处理清单中记录提取结果（失败的图片在达到重试上限前会再次处理）"""
+    for img_path in no_face_paths:
+        logger.info(f"未在 {img_path} 中检测到人脸")
+    processed_files_set.mark_many([os.path.basename(p) for p in no_face_paths], manifest.NO_FACE)
+    embedded = dict.fromkeys(os.path.basename(p.split('#')[0]) for p in face_paths)
+    processed_files_set.mark_many(embedded, manifest.EMBEDDED)
+    # 人脸全部为连拍重复的图片
+    processed_files_set.mark_many([name for name in dict.fromkeys(os.path.basename(p.split('#')[0])
+                                                                   for p in duplicate_paths)
+                                   if name not in embedded], manifest.DUPLICATE)
+    # 人脸全部未通过质量过滤的图片，记录拒绝原因
+    for img_path, reason in rejected:
+        name = os.path.basename(img_path)
+        if name not in embedded:
+            processed_files_set.mark_many([name], manifest.REJECTED, reason=reason)
+    processed_files_set.mark_many([os.path.basename(p) for p in failed_paths], manifest.FAILED,
+                                  reason='读取或提取失败')
@@ -0,0 +1,262 @@
+import argparse
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+import numpy as np
+
+from feature_store import dequantize
+
+
+def _load_prototype_state(prototype_path, medoids_per_cluster, n_points):
+    """读取上一轮的簇累加和与标签，无法增量更新（旧格式、参数变化、点数减少）时返回 None"""
+    if not os.path.exists(prototype_path):
+        return None
+    data = np.load(prototype_path)
+    if 'sums' not in data.files or int(data['medoids_per_cluster']) != medoids_per_cluster \
+            or len(data['labels']) > n_points:
+        return None
+    return data['labels'], data['clusters'], data['sums'], data['medoid_rows']
+
+
+def _nearest_members(features, labels, rows, slot, centroids, k, chunk_size):
+    """rows 中每个簇与中心最相似的 k 个成员（逐块合并候选，保留每簇前 k 个）"""
+    best_slots = np.empty(0, dtype=np.int64)
+    best_sims = np.empty(0, dtype=np.float32)
+    best_rows = np.empty(0, dtype=np.int64)
+    for start in range(0, len(rows), chunk_size):
+        chunk_rows = rows[start:start + chunk_size]
+        chunk = dequantize(features[chunk_rows])
+        slots = slot[labels[chunk_rows]]
+        sims = np.einsum('ij,ij->i', chunk, centroids[slots])
+        best_slots = np.concatenate([best_slots, slots])
+        best_sims = np.concatenate([best_sims, sims])
+        best_rows = np.concatenate([best_rows, chunk_rows])
+        order = np.lexsort((-best_sims, best_slots))
+        best_slots, best_sims, best_rows = best_slots[order], best_sims[order], best_rows[order]
+        group_start = np.searchsorted(best_slots, best_slots, side='left')
+        keep = np.arange(len(best_slots)) - group_start < k
+        best_slots, best_sims, best_rows = best_slots[keep], best_sims[keep], best_rows[keep]
+    return best_rows
+
+
+def build_prototypes(features, labels, prototype_path, medoids_per_cluster=0, chunk_size=65536):
+    """
+    构建簇原型索引：每个簇的归一化中心，以及可选的若干个最接近中心的成员
+
+    features 可以是特征存储的 memmap（任意存储类型），按块读取，不会整体载入内存。
+    原型文件中同时保存每个簇的特征累加和与本轮标签，下一轮只读取标签变化的点和
+    新增的点来更新累加和，代表成员也只为受影响的簇重新挑选；标签没有变化时不重写
+    文件。返回簇数量。
+    """
+    labels = np.asarray(labels)
+    dim = features.shape[1]
+    state = _load_prototype_state(prototype_path, medoids_per_cluster, len(labels))
+    if state is None:
+        prev_labels = np.empty(0, dtype=np.int64)
+        prev_clusters = np.empty(0, dtype=np.int64)
+        prev_sums = np.empty((0, dim), dtype=np.float64)
+        medoid_rows = np.empty(0, dtype=np.int64)
+    else:
+        prev_labels, prev_clusters, prev_sums, medoid_rows = state
+
+    n_prev = len(prev_labels)
+    moved = np.concatenate([np.flatnonzero(labels[:n_prev] != prev_labels), np.arange(n_prev, len(labels))])
+    if state is not None and len(moved) == 0:
+        return len(prev_clusters)
+    old_labels = np.full(len(moved), -1, dtype=np.int64)
+    old_labels[moved < n_prev] = prev_labels[moved[moved < n_prev]]
+    new_labels = labels[moved]
+
+    # 在上一轮累加和的基础上减去移出的点、加上移入的点
+    cluster_ids = np.union1d(prev_clusters, new_labels[new_labels >= 0]).astype(np.int64)
+    slot = np.full(int(cluster_ids.max(initial=-1)) + 1, -1, dtype=np.int64)
+    slot[cluster_ids] = np.arange(len(cluster_ids))
+    sums = np.zeros((len(cluster_ids), dim), dtype=np.float64)
+    sums[slot[prev_clusters]] = prev_sums
+    for start in range(0, len(moved), chunk_size):
+        chunk = dequantize(features[moved[start:start + chunk_size]])
+        old, new = old_labels[start:start + chunk_size], new_labels[start:start + chunk_size]
+        np.subtract.at(sums, slot[old[old >= 0]], chunk[old >= 0])
+        np.add.at(sums, slot[new[new >= 0]], chunk[new >= 0])
+    sizes = np.bincount(slot[labels[labels >= 0]], minlength=len(cluster_ids))
+    kept = sizes > 0
+    cluster_ids, sums, sizes = cluster_ids[kept], sums[kept], sizes[kept]
+    slot[:] = -1
+    slot[cluster_ids] = np.arange(len(cluster_ids))
+    centroids = (sums / np.linalg.norm(sums, axis=1, keepdims=True)).astype(np.float32)
+    vectors = [centroids]
+    owners = [cluster_ids]
+
+    if medoids_per_cluster > 0:
+        # 成员没有变化的簇沿用上一轮的代表成员，其余簇在全部成员中重新挑选
+        affected = np.union1d(old_labels[old_labels >= 0], new_labels[new_labels >= 0])
+        medoid_rows = medoid_rows[~np.isin(prev_labels[medoid_rows], affected)]
+        candidates = np.flatnonzero(np.isin(labels, affected))
+        medoid_rows = np.sort(np.concatenate([
+            medoid_rows,
+            _nearest_members(features, labels, candidates, slot, centroids, medoids_per_cluster, chunk_size)
+        ]))
+        vectors.append(dequantize(features[medoid_rows]))
+        owners.append(labels[medoid_rows])
+
+    os.makedirs(os.path.dirname(prototype_path) or '.', exist_ok=True)
+    tmp_path = prototype_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, vectors=np.concatenate(vectors), cluster_ids=np.concatenate(owners), sizes=sizes,
+                 clusters=cluster_ids, sums=sums, labels=labels, medoid_rows=medoid_rows,
+                 medoids_per_cluster=medoids_per_cluster)
+    os.replace(tmp_path, prototype_path)
+    return len(cluster_ids)
+
+
+class ClusterQuery:
+    """
+    "这是谁？"查询：把人脸特征与簇原型比对，返回最相似的簇或陌生人
+
+    原型文件更新后自动重新加载。
+    """
+
+    def __init__(self, prototype_path, threshold=0.5):
+        self.prototype_path = prototype_path
+        self.threshold = threshold
+        # (原型向量, 原型所属簇, 簇大小)，整体替换以保证并发查询读到一致的数据
+        self._index = None
+        self._mtime = None
+        self._lock = threading.Lock()
+
+    def _reload_if_changed(self):
+        if not os.path.exists(self.prototype_path):
+            return
+        mtime = os.path.getmtime(self.prototype_path)
+        if mtime == self._mtime:
+            return
+        with self._lock:
+            data = np.load(self.prototype_path)
+            self._index = (data['vectors'], data['cluster_ids'],
+                           dict(zip(data['clusters'].tolist(), data['sizes'].tolist())))
+            self._mtime = mtime
+
+    def query(self, embeddings):
+        """embeddings: (N, dim) 已归一化特征，返回每个特征的查询结果"""
+        self._reload_if_changed()
+        embeddings = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+        if self._index is None or len(self._index[0]) == 0:
+            return [{'cluster': -1, 'similarity': None, 'cluster_size': 0} for _ in embeddings]
+        vectors, cluster_ids, sizes = self._index
+        sims = embeddings @ vectors.T
+        best = np.argmax(sims, axis=1)
+        results = []
+        for i, j in enumerate(best):
+            similarity = float(sims[i, j])
+            cluster = int(cluster_ids[j]) if similarity >= self.threshold else -1
+            results.append({
+                'cluster': cluster,
+                'similarity': round(similarity, 4),
+                'cluster_size': int(sizes.get(cluster, 0)),
+            })
+        return results
+
+    def query_image(self, extractor, image, name='query'):
+        """用常驻提取器提取图像中所有人脸的特征并查询"""
+        features, face_paths, _, failed, _ = extractor.extract_batch([image], [name])
+        if failed:
+            raise ValueError("图像无法处理")
+        results = self.query(features) if len(features) else []
+        for result, face_path in zip(results, face_paths):
+            result['face'] = face_path
+        return results
+
+
+def start_query_server(query, extractor, host, port, logger):
+    """
+    在后台线程启动本地查询服务
+
+    POST /query  请求体为图像字节（jpg/png），返回每张人脸的查询结果
+    GET  /health 健康检查
+    """
+
+    class QueryHandler(BaseHTTPRequestHandler):
+        def _send_json(self, status, payload):
+            body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == '/health':
+                self._send_json(200, {'status': 'ok'})
+            else:
+                self._send_json(404, {'error': 'not found'})
+
+        def do_POST(self):
+            if self.path != '/query':
+                self._send_json(404, {'error': 'not found'})
+                return
+            data = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+            if image is None:
+                self._send_json(400, {'error': '无法解码图像'})
+                return
+            try:
+                self._send_json(200, {'faces': query.query_image(extractor, image)})
+            except Exception as e:
+                logger.error(f"查询出错: {e}")
+                self._send_json(500, {'error': str(e)})
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), QueryHandler)
+    thread = threading.Thread(target=server.serve_forever, name='query-server', daemon=True)
+    thread.start()
+    logger.info(f"查询服务已启动: http://{host}:{server.server_address[1]}/query")
+    return server
+
+
+def query_threshold(config):
+    """未配置阈值时与聚类保持一致：相似度 >= 1 - eps"""
+    threshold = config.get('Query', 'threshold', fallback='')
+    return float(threshold) if threshold else 1.0 - float(config['Clustering']['eps'])
+
+
+if __name__ == '__main__':
+    import main
+    import utils
+    from face_features import FaceExtractor
+
+    parser = argparse.ArgumentParser(description='查询人脸属于哪个簇')
+    parser.add_argument('--config', default='config.ini')
+    parser.add_argument('--image', help='待查询的图像')
+    parser.add_argument('--embedding', help='待查询的特征 (.npy)')
+    parser.add_argument('--serve', action='store_true', help='启动本地HTTP查询服务')
+    args = parser.parse_args()
+
+    config = main.load_config(args.config)
+    utils.LOG_FILE = config['Paths']['log_file']
+    logger = utils.setup_logger('cluster_query')
+    query = ClusterQuery(config.get('Query', 'prototype_path', fallback='files/prototypes.npz'),
+                         query_threshold(config))
+
+    if args.embedding:
+        embedding = np.load(args.embedding)
+        embedding = embedding / np.linalg.norm(embedding, axis=-1, keepdims=True)
+        print(json.dumps(query.query(embedding), ensure_ascii=False, indent=2))
+    else:
+        extractor = FaceExtractor(config['FaceAnalysis'], logger)
+        if args.image:
+            image = cv2.imread(args.image)
+            if image is None:
+                raise SystemExit(f"无法读取图像: {args.image}")
+            print(json.dumps(query.query_image(extractor, image, args.image), ensure_ascii=False, indent=2))
+        if args.serve:
+            server = start_query_server(query, extractor, config.get('Query', 'host', fallback='127.0.0.1'),
+                                        config.getint('Query', 'port', fallback=0), logger)
+            try:
+                threading.Event().wait()
+            except KeyboardInterrupt:
+                server.shutdown()
@@ -0,0 +1,111 @@
+import os
+import re
+import time
+from collections import deque
+from datetime import datetime
+
+import numpy as np
+
+# 抓拍文件名中的拍摄时间，如 20240101123045
+_TIMESTAMP_RE = re.compile(r'(20\d{12})')
+
+
+def snapshot_time(img_path):
+    """
+    抓拍时间（秒）：优先取文件名中的 14 位时间戳，其次为文件修改时间，
+    文件尚未落盘（内存直通模式）时取当前时间
+    """
+    match = _TIMESTAMP_RE.search(os.path.basename(img_path))
+    if match:
+        try:
+            return datetime.strptime(match.group(1), '%Y%m%d%H%M%S').timestamp()
+        except ValueError:
+            pass
+    try:
+        return os.path.getmtime(img_path.split('#')[0])
+    except OSError:
+        return time.time()
+
+
+def sort_by_snapshot_time(image_paths):
+    """按抓拍时间排序（目录遍历顺序是任意的），同一时间按路径排序"""
+    return sorted(image_paths, key=lambda p: (snapshot_time(p), p))
+
+
+class BurstDeduplicator:
+    """
+    连拍去重：同一个人在几秒内的多张几乎相同的抓拍只保留第一张作为代表
+
+    新人脸与时间窗口 window_sec 内的代表比较特征相似度，>= threshold 时视为
+    重复，不写入特征存储，只在处理清单中记录 重复 -> 代表 的映射（报告中据此
+    显示代表的重复次数）；否则成为新的代表。窗口只保存在内存中。
+
+    窗口按已处理的最新抓拍时间淘汰，调用方需按抓拍时间顺序送入人脸（见
+    sort_by_snapshot_time）。映射先暂存，代表写入特征存储后由 commit 写入清单，
+    崩溃时清单中不会出现指向不存在的代表的映射。
+    """
+
+    def __init__(self, processing_manifest, threshold=0.92, window_sec=10, logger=None):
+        self.manifest = processing_manifest
+        self.threshold = threshold
+        self.window_sec = window_sec
+        self.logger = logger
+        # 窗口内的代表: (抓拍时间, 人脸路径, 特征)
+        self.recent = deque()
+        self.newest = float('-inf')
+        # 尚未写入清单的 (重复人脸, 代表人脸, 相似度)
+        self.pending = []
+
+    def _evict(self):
+        while self.recent and self.recent[0][0] < self.newest - self.window_sec:
+            self.recent.popleft()
+
+    def filter(self, features, face_paths):
+        """
+        返回 (代表特征, 代表路径, 重复路径)，代表保持原有顺序
+
+        按抓拍时间顺序处理，同一批内的重复也会被合并；同一张图片中的
+        多张人脸不互相比较。
+        """
+        if not face_paths:
+            return features, face_paths, []
+        times = [snapshot_time(p) for p in face_paths]
+        keep = np.zeros(len(face_paths), dtype=bool)
+        duplicates = []
+        for i in sorted(range(len(face_paths)), key=lambda i: times[i]):
+            self.newest = max(self.newest, times[i])
+            self._evict()
+            source = face_paths[i].split('#')[0]
+            candidates = [entry for entry in self.recent
+                          if abs(entry[0] - times[i]) <= self.window_sec and entry[1].split('#')[0] != source]
+            if candidates:
+                sims = np.stack([entry[2] for entry in candidates]) @ features[i]
+                best = int(np.argmax(sims))
+                if sims[best] >= self.threshold:
+                    duplicates.append((face_paths[i], candidates[best][1], float(sims[best])))
+                    continue
+            keep[i] = True
+            self.recent.append((times[i], face_paths[i], np.array(features[i], dtype=np.float32)))
+
+        if duplicates:
+            self.pending.extend(duplicates)
+            if self.logger is not None:
+                self.logger.info(f"连拍去重: {len(face_paths)} 张人脸中 {len(duplicates)} 张为重复")
+        kept_paths = [p for p, k in zip(face_paths, keep) if k]
+        return features[keep], kept_paths, [d[0] for d in duplicates]
+
+    def commit(self):
+        """代表人脸写入特征存储之后调用，把暂存的 重复 -> 代表 映射写入清单"""
+        if self.pending:
+            self.manifest.mark_duplicates(self.pending)
+            self.pending = []
+
+
+def open_deduplicator(config, processing_manifest, logger):
+    """根据 [Dedup] 配置创建去重器，未启用时返回 None"""
+    if not config.getboolean('Dedup', 'enabled', fallback=False):
+        return None
+    return BurstDeduplicator(processing_manifest,
+                             threshold=config.getfloat('Dedup', 'threshold', fallback=0.92),
+                             window_sec=config.getfloat('Dedup', 'window_sec', fallback=10),
+                             logger=logger)
@@ -1,18 +1,93 @@
 import numpy as np
+from scipy import sparse
 from sklearn.cluster import DBSCAN
 
+from feature_store import dequantize
 
-def face_cluster(feature_save_path,label_file_path,logger):
-    # 加载特征向量（假设 float32）
-    features = np.fromfile(feature_save_path, dtype=np.float32)
-    features = features.reshape(-1, 512)
 
-    # 再次归一化（确保特征是单位向量）
-    features = features / np.linalg.norm(features, axis=1, keepdims=True)
+def inner_product_index(dim, dtype='float32', train_sample=None):
+    """
+    按特征存储类型创建 FAISS 内积索引
 
-    # 聚类（使用余弦距离）
-    clustering = DBSCAN(eps=0.5, min_samples=2, metric='cosine').fit(features)
-    labels = clustering.labels_
+    float32 使用精确的 IndexFlatIP；float16 / int8 使用标量量化索引，索引内
+    以 2 / 1 字节每分量保存。标量量化的平铺索引不支持 range_search，因此用
+    只有一个倒排列表的 IVF 索引（等价于对紧凑编码做暴力扫描），用 train_sample
+    训练量化的取值范围。
+    """
+    import faiss
+
+    dtype = np.dtype(dtype)
+    if dtype == np.float32:
+        return faiss.IndexFlatIP(dim)
+    qtype = faiss.ScalarQuantizer.QT_fp16 if dtype == np.float16 else faiss.ScalarQuantizer.QT_8bit_uniform
+    index = faiss.IndexIVFScalarQuantizer(faiss.IndexFlatIP(dim), dim, 1, qtype, faiss.METRIC_INNER_PRODUCT)
+    index.train(np.ascontiguousarray(dequantize(train_sample)))
+    return index
+
+
+def add_to_index(index, features, chunk_size=65536):
+    """按块转换为 float32 后加入索引，不整体展开紧凑格式的特征"""
+    for start in range(0, len(features), chunk_size):
+        index.add(np.ascontiguousarray(dequantize(features[start:start + chunk_size])))
+
+
+def radius_neighbor_graph(features, eps, batch_size=4096):
+    """
+    用 FAISS 内积索引构建余弦距离 <= eps 的稀疏近邻图
+
+    特征已归一化，余弦距离 = 1 - 内积，因此对内积做 range_search 即可，
+    不需要计算全量两两距离。返回 CSR 格式的距离矩阵（含自身）。
+    features 可以是 float16 / int8 的紧凑格式，此时使用对应的标量量化索引。
+    """
+    n, dim = features.shape
+    index = inner_product_index(dim, features.dtype, features[:65536])
+    add_to_index(index, features)
+
+    # range_search 对内积返回严格大于阈值的结果，留一点余量使其与 sklearn 的 <= eps 一致
+    threshold = 1.0 - eps - 1e-6
+    indptr = [np.zeros(1, dtype=np.int64)]
+    indices = []
+    data = []
+    offset = 0
+    for start in range(0, n, batch_size):
+        queries = np.ascontiguousarray(dequantize(features[start:start + batch_size]))
+        lims, sims, ids = index.range_search(queries, threshold)
+        indptr.append(lims[1:].astype(np.int64) + offset)
+        offset += int(lims[-1])
+        indices.append(ids)
+        data.append(np.clip(1.0 - sims, 0.0, None))
+
+    return sparse.csr_matrix(
+        (np.concatenate(data), np.concatenate(indices), np.concatenate(indptr)),
+        shape=(n, n)
+    )
+
+
+def dbscan_labels(features, eps=0.5, min_samples=2, metric='cosine', engine='sklearn', logger=None):
+    """按配置的引擎执行 DBSCAN，返回标签数组"""
+    if engine == 'faiss':
+        if metric == 'cosine':
+            graph = radius_neighbor_graph(features, eps)
+            return DBSCAN(eps=eps, min_samples=min_samples, metric='precomputed').fit(graph).labels_
+        if logger is not None:
+            logger.warning(f"faiss 引擎只支持 cosine 距离，metric={metric} 时改用 sklearn")
+    return DBSCAN(eps=eps, min_samples=min_samples, metric=metric).fit(dequantize(features)).labels_
+
+
+def face_cluster(feature_store,label_file_path,logger,eps=0.5,min_samples=2,metric='cosine',engine='sklearn',
+                 clusterer=None):
+    # 通过 memmap 零拷贝映射特征（写入特征存储时已归一化）
+    features = feature_store.features()
+    if len(features) == 0:
+        logger.info("特征存储为空，跳过聚类")
+        return
+
+    # 聚类（使用余弦距离）；传入增量聚类器或 kNN 图聚类器时只处理新增的点，簇编号保持稳定
+    if clusterer is not None:
+        labels = clusterer.update(features)
+    else:
+        labels = dbscan_labels(features, eps=eps, min_samples=min_samples, metric=metric, engine=engine,
+                               logger=logger)
 
     # 输出聚类结果
     n_clusters = len(set(labels)) - (1 if -1 in labels else 0)
@@ -23,3 +98,4 @@ def face_cluster(feature_save_path,label_file_path,logger):
     # 保存聚类结果
     np.save(label_file_path, labels)
     logger.info(f"聚类标签已保存，数量: {len(labels)}")
+    return labels
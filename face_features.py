@@ -1,118 +1,517 @@
+import json
+import multiprocessing
 import os
+import threading
+import time
 
 import cv2
 import numpy as np
-import torch
+import onnxruntime
 from insightface.app import FaceAnalysis
-from torch.utils.data import Dataset, DataLoader
+from insightface.utils import face_align
 
+import utils
+from checkpoint import CheckpointWriter, mark_processed
+from dedup import sort_by_snapshot_time
+from face_quality import QualityGate
+from image_loader import PrefetchLoader
+from utils import is_face_snap
 
-# 创建数据集类定义
-class FaceDataset(Dataset):
-    def __init__(self, image_dir):
-        self.image_dir = image_dir
-        self.image_paths = []
 
-        # 获取所有图片路径
-        for root, _, files in os.walk(image_dir):
-            for file in files:
-                if file.lower().endswith(('.png', '.jpg', '.jpeg')) and '_FACE_SNAP' in file:
-                    self.image_paths.append(os.path.join(root, file))
+def discover_new_images(image_dir, processed_files_set):
+    """只按文件名过滤出未处理的抓拍图片，不做任何图像读取"""
+    new_paths = []
+    for root, _, files in os.walk(image_dir):
+        new_files = processed_files_set.filter_new(f for f in files if is_face_snap(f))
+        new_paths.extend(os.path.join(root, f) for f in new_files)
+    return new_paths
+
+
+class DirectoryCursor:
+    """
+    持久化的目录扫描游标
+
+    记录每个目录上次扫描时的 mtime、子目录和尚未处理完的文件。目录 mtime
+    未变化说明没有新增文件，直接复用记录而不再列目录，发现新文件的开销只与
+    变化的目录有关。
+    """
+
+    # mtime 距扫描时刻过近的目录不信任游标（文件系统时间戳精度有限）
+    SETTLE_NS = 2 * 10 ** 9
+
+    def __init__(self, cursor_file):
+        self.cursor_file = cursor_file
+        self.state = {}
+        if os.path.exists(cursor_file):
+            with open(cursor_file, encoding='utf-8') as f:
+                self.state = json.load(f)
+        self.scanned = {}
+
+    def scan(self, image_dir, processed_files_set):
+        """返回未处理的抓拍图片路径"""
+        now_ns = time.time_ns()
+        self.scanned = {}
+        new_paths = []
+        stack = [image_dir]
+        while stack:
+            dir_path = stack.pop()
+            try:
+                mtime_ns = os.stat(dir_path).st_mtime_ns
+            except FileNotFoundError:
+                continue
+            entry = self.state.get(dir_path)
+            if entry is not None and entry['mtime'] == mtime_ns and now_ns - mtime_ns > self.SETTLE_NS:
+                subdirs, files = entry['subdirs'], entry['files']
+            else:
+                subdirs, files = [], []
+                with os.scandir(dir_path) as it:
+                    for e in it:
+                        if e.is_dir(follow_symlinks=False):
+                            subdirs.append(e.path)
+                        elif is_face_snap(e.name):
+                            files.append(e.name)
+            files = processed_files_set.filter_new(files)
+            self.scanned[dir_path] = {'mtime': mtime_ns, 'subdirs': subdirs, 'files': files}
+            new_paths.extend(os.path.join(dir_path, f) for f in files)
+            stack.extend(subdirs)
+        return new_paths
+
+    def save(self, processed_files_set):
+        """保存游标，只保留处理后仍未完成的文件以便下次重试"""
+        for entry in self.scanned.values():
+            entry['files'] = processed_files_set.filter_new(entry['files'])
+        os.makedirs(os.path.dirname(self.cursor_file) or '.', exist_ok=True)
+        tmp_path = self.cursor_file + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.scanned, f)
+        os.replace(tmp_path, self.cursor_file)
+        self.state = self.scanned
+
+
+def parse_size(value):
+    """解析 '640,640' 或 '640' 形式的尺寸配置"""
+    parts = [int(v) for v in str(value).replace('x', ',').split(',') if v.strip()]
+    return (parts[0], parts[0]) if len(parts) == 1 else (parts[0], parts[1])
+
+
+def square_resize(image, size):
+    """把人脸小图居中补边成正方形后缩放到 size x size"""
+    h, w = image.shape[:2]
+    side = max(h, w)
+    top = (side - h) // 2
+    left = (side - w) // 2
+    image = cv2.copyMakeBorder(image, top, side - h - top, left, side - w - left, cv2.BORDER_CONSTANT, value=0)
+    return cv2.resize(image, (size, size), interpolation=cv2.INTER_AREA if side > size else cv2.INTER_LINEAR)
+
+
+class FaceExtractor:
+    """
+    常驻的人脸特征提取器
+
+    模型只在创建时加载一次并预热，之后跨轮询周期复用；
+    [FaceAnalysis] 中与模型相关的配置发生变化时自动重新加载。
+    查询服务线程与主循环共用同一个提取器，重新加载和推理在同一把锁下进行。
+    """
+
+    # 变化时需要重新加载模型的配置项
+    MODEL_KEYS = ('model_name', 'model_root', 'det_size', 'intra_op_threads', 'inter_op_threads')
+
+    def __init__(self, fa_config, logger):
+        self.logger = logger
+        self.app = None
+        self.ctx_id = -1
+        self.model_settings = None
+        self.snap_mode = 'detect'
+        self._lock = threading.Lock()
+        self.reload_if_changed(fa_config)
+
+    def reload_if_changed(self, fa_config):
+        """配置中模型相关项变化时重新加载模型，返回是否发生了重新加载"""
+        with self._lock:
+            # 抓拍小图处理方式和质量阈值不影响模型本身，直接更新
+            self.snap_mode = fa_config.get('snap_mode', 'detect')
+            self.quality = QualityGate(fa_config)
+            settings = {key: fa_config.get(key) for key in self.MODEL_KEYS}
+            if settings == self.model_settings:
+                return False
+            if self.model_settings is not None:
+                self.logger.info(f"检测到 [FaceAnalysis] 配置变更，重新加载模型: {settings}")
+            self._load(settings)
+            self.model_settings = settings
+            return True
+
+    def _load(self, settings):
+        # 使用检测和识别模型，如果有GPU则使用GPU
+        self.ctx_id = select_ctx_id()
+        self.logger.info(f"使用设备: {'cuda:0' if self.ctx_id >= 0 else 'cpu'}")
+        # 批量路径只用到检测和识别模型，不加载关键点/性别年龄模型
+        app = FaceAnalysis(name=settings['model_name'], root=settings['model_root'],
+                           allowed_modules=['detection', 'recognition'])
+        self.det_size = parse_size(settings['det_size'] or '640,640')
+        app.prepare(ctx_id=self.ctx_id, det_size=self.det_size)
+        intra_op_threads = int(settings.get('intra_op_threads') or 0)
+        inter_op_threads = int(settings.get('inter_op_threads') or 0)
+        if intra_op_threads or inter_op_threads:
+            tune_sessions(app, intra_op_threads, inter_op_threads)
+            self.logger.info(f"ONNX 线程数: intra_op={intra_op_threads or '默认'}, inter_op={inter_op_threads or '默认'}")
+        self.app = app
+        self.det_model = app.det_model
+        self.rec_model = app.models['recognition']
+        self.warmup()
+
+    def warmup(self):
+        """用空白图像跑一次推理，提前完成ONNX会话的初始化和内存分配"""
+        self.det_model.detect(np.zeros((self.det_size[1], self.det_size[0], 3), dtype=np.uint8),
+                              max_num=0, metric='default')
+        self.rec_model.get_feat([np.zeros((112, 112, 3), dtype=np.uint8)])
+        self.logger.info("模型加载并预热完成")
+
+    def extract_batch(self, images, img_paths):
+        """
+        批量提取人脸特征
+
+        逐张检测并对齐人脸，经质量过滤后，把整批112x112对齐人脸堆叠为一个NCHW张量，
+        只调用一次识别模型。snap_mode 为 direct 时，抓拍人脸小图跳过检测，
+        直接补成正方形并缩放后送入识别模型。
+
+        返回: (features, face_paths, no_face_paths, failed_paths, rejected)
+        features -- 归一化后的特征数组 (N, 512)，与 face_paths 一一对应
+        rejected -- [(图片路径, 拒绝原因)]，图片中有人脸未通过质量过滤
+        """
+        with self._lock:
+            return self._extract_batch(images, img_paths)
+
+    def _extract_batch(self, images, img_paths):
+        crops = []
+        face_paths = []
+        no_face_paths = []
+        failed_paths = []
+        rejected = []
+        input_size = self.rec_model.input_size[0]
+
+        for image, img_path in zip(images, img_paths):
+            if image is None:
+                self.logger.error(f"无法读取图像: {img_path}")
+                failed_paths.append(img_path)
+                continue
+            try:
+                if self.snap_mode == 'direct' and '_FACE_SNAP' in os.path.basename(img_path):
+                    crop = square_resize(image, input_size)
+                    reason = self.quality.check_size(image) or self.quality.check_crop(crop)
+                    if reason is not None:
+                        rejected.append((img_path, reason))
+                        continue
+                    crops.append(crop)
+                    face_paths.append(img_path)
+                    continue
+                bboxes, kpss = self.det_model.detect(image, max_num=0, metric='default')
+                if kpss is None or len(kpss) == 0:
+                    no_face_paths.append(img_path)
+                    continue
+                reasons = []
+                for j, (bbox, kps) in enumerate(zip(bboxes, kpss)):
+                    # 先做不需要对齐的检查，通过后再对齐并检查模糊度
+                    reason = self.quality.check_detection(bbox, kps)
+                    if reason is None:
+                        crop = face_align.norm_crop(image, landmark=kps, image_size=input_size)
+                        reason = self.quality.check_crop(crop)
+                    if reason is not None:
+                        reasons.append(f"face{j}: {reason}" if len(kpss) > 1 else reason)
+                        continue
+                    crops.append(crop)
+                    # 如果一张图片有多个人脸，为路径添加后缀
+                    face_paths.append(f"{img_path}#face{j}" if len(kpss) > 1 else img_path)
+                if reasons:
+                    rejected.append((img_path, '; '.join(reasons)))
+            except Exception as e:
+                self.logger.error(f"处理 {img_path} 时出错: {e}")
+                failed_paths.append(img_path)
+
+        if rejected:
+            self.logger.info(f"质量过滤: {len(rejected)} 张图片中有人脸未通过")
+        if not crops:
+            return np.empty((0, 512), dtype=np.float32), [], no_face_paths, failed_paths, rejected
+
+        # 整批对齐人脸一次性送入识别模型
+        try:
+            features = self.rec_model.get_feat(crops).astype(np.float32)
+        except Exception as e:
+            self.logger.error(f"批量识别推理出错: {e}")
+            failed_paths.extend(dict.fromkeys(p.split('#')[0] for p in face_paths))
+            return np.empty((0, 512), dtype=np.float32), [], no_face_paths, failed_paths, rejected
+        features /= np.linalg.norm(features, axis=1, keepdims=True)
+        return features, face_paths, no_face_paths, failed_paths, rejected
+
+
+def select_ctx_id():
+    """按 ONNX Runtime 可用的执行提供程序选择设备：有 CUDA 时为 GPU 0，否则为 CPU (-1)"""
+    return 0 if 'CUDAExecutionProvider' in onnxruntime.get_available_providers() else -1
+
+
+def tune_sessions(app, intra_op_threads=0, inter_op_threads=0):
+    """
+    按指定线程数重建 FaceAnalysis 中各模型的 ONNX Runtime 会话
 
-    def __len__(self):
-        return len(self.image_paths)
+    insightface 创建会话时不接受 SessionOptions，这里沿用原会话的 providers 重新创建，
+    多个进程同时推理时避免每个会话都占满全部核心。
+    """
+    options = onnxruntime.SessionOptions()
+    if intra_op_threads:
+        options.intra_op_num_threads = intra_op_threads
+    if inter_op_threads:
+        options.inter_op_num_threads = inter_op_threads
+    for model in app.models.values():
+        model.session = onnxruntime.InferenceSession(model.model_file, sess_options=options,
+                                                     providers=model.session.get_providers())
 
-    def __getitem__(self, idx):
-        img_path = self.image_paths[idx]
-        # 使用OpenCV读取图像，因为InsightFace使用BGR格式
-        image = cv2.imread(img_path)
-        if image is None:
-            # 如果图像无法读取，返回一个空数组和路径
-            return np.zeros((3, 112, 112)), img_path
-        return image, img_path
 
+# 工作进程中的常驻提取器，以及模型加载失败时的错误信息
+_worker_extractor = None
+_worker_error = None
 
-# 主函数，包含所有处理逻辑
-def custom_collate_fn(batch):
-    # 分离图像和路径
-    images = [item[0] for item in batch]
-    paths = [item[1] for item in batch]
-    # 不将图像堆叠成张量，而是保持为列表
-    return images, paths
 
+def _init_worker(fa_config, log_queue):
+    global _worker_extractor, _worker_error
+    # 每个进程只用 ONNX 会话自己的线程，避免 OpenCV 线程池再额外抢占核心
+    cv2.setNumThreads(1)
+    logger = utils.setup_worker_logger(f'extract-worker-{os.getpid()}', log_queue)
+    # 初始化函数抛出异常时进程池会不断重建工作进程，因此记录错误，在执行任务时再抛出
+    try:
+        _worker_extractor = FaceExtractor(fa_config, logger)
+    except Exception as e:
+        _worker_error = f"{type(e).__name__}: {e}"
 
-def process_images_incrementally(image_dir, feature_save_path, processed_files_set, path_list_file,config,logger):
+
+def _check_worker(_=None):
+    if _worker_error is not None:
+        raise RuntimeError(f"特征提取进程加载模型失败: {_worker_error}")
+
+
+def _extract_paths_in_worker(img_paths):
+    _check_worker()
+    images = [cv2.imread(path) for path in img_paths]
+    return _worker_extractor.extract_batch(images, img_paths)
+
+
+def _extract_images_in_worker(args):
+    _check_worker()
+    images, img_paths = args
+    return _worker_extractor.extract_batch(images, img_paths)
+
+
+def merge_results(results):
+    """按顺序合并多个 extract_batch 的结果"""
+    features, face_paths, no_face_paths, failed_paths, rejected = [], [], [], [], []
+    for batch_features, batch_face_paths, batch_no_face_paths, batch_failed_paths, batch_rejected in results:
+        if len(batch_features):
+            features.append(batch_features)
+        face_paths.extend(batch_face_paths)
+        no_face_paths.extend(batch_no_face_paths)
+        failed_paths.extend(batch_failed_paths)
+        rejected.extend(batch_rejected)
+    features = np.concatenate(features) if features else np.empty((0, 512), dtype=np.float32)
+    return features, face_paths, no_face_paths, failed_paths, rejected
+
+
+class ParallelExtractor:
+    """
+    多进程特征提取：每个工作进程持有自己的 FaceAnalysis / ONNX Runtime 会话
+
+    工作进程以 spawn 方式启动，模型各自加载一次并跨轮次复用。未配置
+    intra_op_threads 时按 CPU 核数 / 进程数分配每个会话的线程数，避免过度订阅。
+    结果按提交顺序合并，写入特征存储的顺序与单进程一致。工作进程的日志经队列
+    交给主进程输出，只有主进程写日志文件。重启进程池与 extract_batch 在同一把锁下
+    进行，查询服务线程不会用到正在关闭的进程池。
+    """
+
+    # 变化时需要重启工作进程的配置项
+    POOL_KEYS = FaceExtractor.MODEL_KEYS + QualityGate.KEYS + ('snap_mode', 'num_procs')
+
+    def __init__(self, fa_config, logger):
+        self.logger = logger
+        self.pool = None
+        self.num_procs = 1
+        self.pool_settings = None
+        self.log_listener = None
+        self._lock = threading.Lock()
+        self.reload_if_changed(fa_config)
+
+    def reload_if_changed(self, fa_config):
+        """配置变化时重启工作进程，返回是否发生了重启"""
+        with self._lock:
+            return self._restart_if_changed(fa_config)
+
+    def _restart_if_changed(self, fa_config):
+        settings = {key: fa_config.get(key) for key in self.POOL_KEYS}
+        if settings == self.pool_settings:
+            return False
+        if self.pool_settings is not None:
+            self.logger.info(f"检测到 [FaceAnalysis] 配置变更，重启特征提取进程: {settings}")
+        self.close()
+        self.num_procs = max(1, int(settings['num_procs'] or 1))
+        worker_config = dict(fa_config)
+        if not int(worker_config.get('intra_op_threads') or 0):
+            worker_config['intra_op_threads'] = str(max(1, (os.cpu_count() or 1) // self.num_procs))
+        if not int(worker_config.get('inter_op_threads') or 0):
+            worker_config['inter_op_threads'] = '1'
+        context = multiprocessing.get_context('spawn')
+        log_queue = context.Queue()
+        self.log_listener = utils.start_log_listener(log_queue, self.logger)
+        self.pool = context.Pool(self.num_procs, initializer=_init_worker, initargs=(worker_config, log_queue))
+        try:
+            # 等待各进程加载完模型，加载失败时在这里报错
+            self.pool.map(_check_worker, range(self.num_procs), chunksize=1)
+        except Exception:
+            self.close()
+            raise
+        self.pool_settings = settings
+        self.logger.info(f"已启动 {self.num_procs} 个特征提取进程，每个 ONNX 会话 "
+                         f"intra_op_threads={worker_config['intra_op_threads']}")
+        return True
+
+    def extract_paths(self, img_paths, batch_size):
+        """
+        按 batch_size 分片交给工作进程（工作进程自行读取图像），
+        按提交顺序逐批返回 extract_batch 的结果
+        """
+        batches = [img_paths[i:i + batch_size] for i in range(0, len(img_paths), batch_size)]
+        return self.pool.imap(_extract_paths_in_worker, batches)
+
+    def extract_batch(self, images, img_paths):
+        """与 FaceExtractor.extract_batch 相同的接口，一批图像拆分给各工作进程并行处理"""
+        shard_size = max(1, -(-len(images) // self.num_procs))
+        shards = [(images[i:i + shard_size], img_paths[i:i + shard_size])
+                  for i in range(0, len(images), shard_size)]
+        with self._lock:
+            return merge_results(self.pool.map(_extract_images_in_worker, shards))
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        if self.log_listener is not None:
+            self.log_listener.stop()
+            self.log_listener = None
+
+
+def decode_image(data):
+    """把内存中的图像字节解码为BGR图像，无法解码时返回None"""
+    return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+
+class StreamEmbedder:
+    """
+    内存直通的特征提取：接收下载线程送来的图像字节，凑满一批后解码送入提取器，
+    结果直接写入特征存储，原图不经过磁盘读取
+
+    解码和提取在持锁的批处理中串行执行，seconds 累计这部分耗时、failures 累计
+    失败的图片数，供指标把它们计入 extract 阶段而不是下载阶段。
+    """
+
+    def __init__(self, extractor, feature_store, processed_files_set, batch_size, logger, dedup=None):
+        self.extractor = extractor
+        self.dedup = dedup
+        self.feature_store = feature_store
+        self.processed_files_set = processed_files_set
+        self.batch_size = batch_size
+        self.logger = logger
+        self.blobs = []
+        self.paths = []
+        self.new_faces = 0
+        self.seconds = 0.0
+        self.failures = 0
+        self._lock = threading.Lock()
+
+    def add_bytes(self, img_path, data):
+        """下载回调：img_path 为原图的本地路径（可能尚未或不会落盘）"""
+        with self._lock:
+            self.blobs.append(data)
+            self.paths.append(img_path)
+            if len(self.paths) >= self.batch_size:
+                self._flush_locked()
+
+    def flush(self):
+        """处理剩余的图像，返回本轮新增的人脸数"""
+        with self._lock:
+            self._flush_locked()
+            new_faces, self.new_faces = self.new_faces, 0
+        return new_faces
+
+    def _flush_locked(self):
+        if not self.paths:
+            return
+        start = time.perf_counter()
+        try:
+            self._embed_locked()
+        finally:
+            self.seconds += time.perf_counter() - start
+
+    def _embed_locked(self):
+        blobs, paths = self.blobs, self.paths
+        self.blobs, self.paths = [], []
+        images = [decode_image(data) for data in blobs]
+        features, face_paths, no_face_paths, failed_paths, rejected = self.extractor.extract_batch(images, paths)
+        duplicate_paths = []
+        if self.dedup is not None:
+            features, face_paths, duplicate_paths = self.dedup.filter(features, face_paths)
+        # 特征写入后再标记清单，中途崩溃时这批图片会重新提取
+        if face_paths:
+            self.feature_store.append(features, face_paths)
+            self.new_faces += len(face_paths)
+        if self.dedup is not None:
+            self.dedup.commit()
+        self.failures += len(failed_paths)
+        mark_processed(self.processed_files_set, face_paths, no_face_paths, self.logger, failed_paths,
+                       duplicate_paths, rejected)
+
+
+def process_images_incrementally(image_dir, feature_store, processed_files_set, config, logger, extractor=None,
+                                 dedup=None):
     # 获取FaceAnalysis配置
-    model_name = config['FaceAnalysis']['model_name']
     batch_size = int(config['FaceAnalysis']['batch_size'])
-    model_root = config['FaceAnalysis']['model_root']
     num_workers = int(config['FaceAnalysis']['num_workers'])
 
     """  增量特征提取，并合并到主特征  """
-    device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
-    logger.info(f"使用设备: {device}")
-    # 使用检测和识别模型，如果有GPU则使用GPU
-    ctx_id = 0 if torch.cuda.is_available() else -1
-    app = FaceAnalysis(name=model_name, root=model_root)
-    app.prepare(ctx_id=ctx_id, det_size=(640, 640))
-
-    new_dataset = FaceDataset(image_dir)
-    # 创建数据加载器
-    dataloader = DataLoader(new_dataset, batch_size=batch_size, shuffle=False, num_workers=num_workers,
-                            pin_memory=True, collate_fn=custom_collate_fn)
-
-    new_features = []
-    new_paths = []
+    # 未传入常驻提取器时临时创建一个（每次调用都会重新加载模型）
+    if extractor is None:
+        extractor = FaceExtractor(config['FaceAnalysis'], logger)
 
-    for images, img_paths in dataloader:
-        for image, img_path in zip(images, img_paths):
-            try:
-                fname = os.path.basename(img_path)
-                if fname in processed_files_set:
-                    continue
+    # 先按文件名过滤出新文件，再构建数据集，已处理的图片不会被读取
+    cursor_file = config['Paths'].get('scan_cursor_file', '')
+    cursor = DirectoryCursor(cursor_file) if cursor_file else None
+    if cursor is not None:
+        image_paths = cursor.scan(image_dir, processed_files_set)
+    else:
+        image_paths = discover_new_images(image_dir, processed_files_set)
+    writer = CheckpointWriter(feature_store, processed_files_set, logger,
+                              checkpoint_every=config['FaceAnalysis'].getint('checkpoint_every', fallback=1024),
+                              dedup=dedup)
+    # 上次在写入特征后、标记清单前中断的图片，人脸已在特征存储中，不再重复提取
+    image_paths = writer.skip_committed(image_paths)
+    if dedup is not None:
+        # 连拍去重的时间窗口要求按抓拍时间顺序处理
+        image_paths = sort_by_snapshot_time(image_paths)
+    logger.info(f"发现 {len(image_paths)} 张待处理图片")
+    if not image_paths:
+        if cursor is not None:
+            cursor.save(processed_files_set)
+        return 0
 
-                # 确保image是numpy数组
-                if isinstance(image, torch.Tensor):
-                    image = image.numpy()
-                # 检测人脸
-                faces = app.get(image)
-                if len(faces) == 0:
-                    logger.info(f"未在 {img_path} 中检测到人脸")
-                    processed_files_set.add(fname)
-                    continue
-                # 对每个检测到的人脸提取特征
-                for j, face in enumerate(faces):
-                    # 获取人脸特征向量
-                    face_embedding = face.embedding
-                    if face_embedding is not None:
-                        # 存储特征和路径（对于多个人脸，我们在路径后添加索引）
-                        new_features.append(face_embedding)
-                        if len(faces) > 1:
-                            # 如果一张图片有多个人脸，为路径添加后缀
-                            face_path = f"{img_path}#face{j}"
-                        else:
-                            face_path = img_path
-                        new_paths.append(face_path)
-                        processed_files_set.add(fname)
+    if isinstance(extractor, ParallelExtractor):
+        # 多进程模式：工作进程各自读取图像并推理，结果按顺序返回
+        results = extractor.extract_paths(image_paths, batch_size)
+    else:
+        # 预取加载器：线程池解码，推理当前批时后续批次已在读取；batch_size 即每次识别推理的批大小
+        loader = PrefetchLoader(image_paths, batch_size=batch_size, num_workers=num_workers)
+        results = (extractor.extract_batch(images, img_paths) for images, img_paths in loader)
 
-            except Exception as e:
-                logger.error(f"处理 {img_path} 时出错: {e}")
-
-    if new_features:
-        features_array = np.array(new_features, dtype=np.float32)
-        features_array = features_array / np.linalg.norm(features_array, axis=1, keepdims=True)
-        mode = 'wb'
-        if os.path.exists(feature_save_path):
-            mode = 'ab'
-        os.makedirs(os.path.dirname(feature_save_path), exist_ok=True)
-        with open(feature_save_path, mode) as f:
-            f.write(features_array.tobytes())
-        logger.info(f"标签已保存到 {feature_save_path}")
-
-        mode = 'w'
-        if os.path.exists(path_list_file):
-            mode = 'a'
-        with open(path_list_file, mode) as f:
-            for path in new_paths:
-                f.write(path + '\n')
-        logger.info(f"图片路径已保存到 {path_list_file}")
+    # 结果按块提交：内存中最多保留 checkpoint_every 条特征
+    for result in results:
+        writer.add(*result)
+    writer.flush()
+    logger.info(f"本轮共追加 {writer.committed} 条特征到 {feature_store.store_dir}，共 {feature_store.count} 条")
+
+    if cursor is not None:
+        cursor.save(processed_files_set)
+    return writer.committed
@@ -0,0 +1,70 @@
+import cv2
+import numpy as np
+
+
+def estimate_pose(kps):
+    """
+    由检测模型的5点关键点（左眼、右眼、鼻尖、左嘴角、右嘴角）粗略估计偏航角和俯仰角（度）
+
+    偏航：鼻尖相对双眼中点的水平偏移 / 半眼距；俯仰：鼻尖在眼睛与嘴巴之间的
+    相对高度偏离正脸时的位置。只用于过滤大角度侧脸，不是精确的姿态估计。
+    """
+    kps = np.asarray(kps, dtype=np.float32)
+    eye_mid = (kps[0] + kps[1]) / 2
+    mouth_mid = (kps[3] + kps[4]) / 2
+    half_eye_dist = max(float(np.linalg.norm(kps[1] - kps[0])) / 2, 1e-6)
+    yaw = np.degrees(np.arcsin(np.clip((kps[2, 0] - eye_mid[0]) / half_eye_dist, -1, 1)))
+    face_height = max(float(mouth_mid[1] - eye_mid[1]), 1e-6)
+    pitch = np.degrees(np.arcsin(np.clip(((kps[2, 1] - eye_mid[1]) / face_height - 0.5) * 2, -1, 1)))
+    return float(yaw), float(pitch)
+
+
+def blur_score(image):
+    """拉普拉斯方差，越小越模糊"""
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    return float(cv2.Laplacian(gray, cv2.CV_64F).var())
+
+
+class QualityGate:
+    """
+    识别前的人脸质量过滤
+
+    检测框尺寸、检测置信度、对齐后人脸的拉普拉斯方差（模糊度）、5点关键点估计的
+    偏航/俯仰角，任一项不达标即拒绝，不送入识别模型。阈值为0的项不检查。
+    """
+
+    KEYS = ('min_face_size', 'min_det_score', 'min_blur', 'max_yaw', 'max_pitch')
+
+    def __init__(self, fa_config):
+        self.min_face_size, self.min_det_score, self.min_blur, self.max_yaw, self.max_pitch = \
+            (float(fa_config.get(key) or 0) for key in self.KEYS)
+
+    def check_detection(self, bbox, kps):
+        """检查检测结果（bbox 为 x1, y1, x2, y2, score），返回拒绝原因，通过时返回 None"""
+        size = min(bbox[2] - bbox[0], bbox[3] - bbox[1])
+        if self.min_face_size and size < self.min_face_size:
+            return f"size {size:.0f} < {self.min_face_size:g}"
+        if self.min_det_score and bbox[4] < self.min_det_score:
+            return f"det_score {bbox[4]:.2f} < {self.min_det_score:g}"
+        if self.max_yaw or self.max_pitch:
+            yaw, pitch = estimate_pose(kps)
+            if self.max_yaw and abs(yaw) > self.max_yaw:
+                return f"yaw {yaw:.0f} > {self.max_yaw:g}"
+            if self.max_pitch and abs(pitch) > self.max_pitch:
+                return f"pitch {pitch:.0f} > {self.max_pitch:g}"
+        return None
+
+    def check_size(self, image):
+        """direct 模式下整张抓拍小图即人脸，只检查尺寸"""
+        size = min(image.shape[:2])
+        if self.min_face_size and size < self.min_face_size:
+            return f"size {size} < {self.min_face_size:g}"
+        return None
+
+    def check_crop(self, crop):
+        """检查对齐后的人脸，返回拒绝原因，通过时返回 None"""
+        if self.min_blur:
+            score = blur_score(crop)
+            if score < self.min_blur:
+                return f"blur {score:.1f} < {self.min_blur:g}"
+        return None
@@ -0,0 +1,296 @@
+import argparse
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+# 存储格式版本
+FORMAT_VERSION = 1
+
+HEADER_FILE = 'header.json'
+DATA_FILE = 'features.bin'
+PATHS_FILE = 'paths.txt'
+
+# 支持的特征存储类型：float32 每条 2KB，float16 1KB，int8 512B
+DTYPES = ('float32', 'float16', 'int8')
+# int8 标量量化：q = round(x * INT8_SCALE)，归一化特征的各分量都在 [-1, 1] 内，不会溢出
+INT8_SCALE = 127.0
+
+
+def quantize(features, dtype):
+    """把 float32 特征转换为存储类型"""
+    features = np.asarray(features, dtype=np.float32)
+    if np.dtype(dtype) == np.int8:
+        return np.clip(np.rint(features * INT8_SCALE), -127, 127).astype(np.int8)
+    return features.astype(dtype, copy=False)
+
+
+def dequantize(features):
+    """把任意存储类型的特征（含 memmap 切片）转换为 float32"""
+    features = np.asarray(features)
+    if features.dtype == np.int8:
+        return features.astype(np.float32) / INT8_SCALE
+    return features.astype(np.float32, copy=False)
+
+
+def _fsync_write(path, mode, data):
+    with open(path, mode) as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+class FeatureStore:
+    """
+    版本化的特征存储
+
+    目录结构:
+    header.json  -- 头信息（格式版本、维度、dtype、条数、模型名、路径文件字节数）
+    features.bin -- 按行追加的特征向量
+    paths.txt    -- 与特征逐行对应的图片路径
+
+    每次 append 先追加数据并落盘，最后原子替换 header.json 作为提交点；
+    header 之外的尾部数据视为未提交，打开时截断，崩溃不会导致特征和路径错位。
+    读取通过 np.memmap 零拷贝映射已提交的部分。
+
+    dtype 为 float16 / int8 时以紧凑格式存储，features() 返回紧凑格式的 memmap，
+    需要 float32 时用 dequantize 按块转换。
+    """
+
+    def __init__(self, store_dir, dim=512, dtype='float32', model_name=''):
+        if dtype not in DTYPES:
+            raise ValueError(f"不支持的特征存储类型: {dtype}，可选 {DTYPES}")
+        self.store_dir = store_dir
+        self.header_path = os.path.join(store_dir, HEADER_FILE)
+        self.data_path = os.path.join(store_dir, DATA_FILE)
+        self.paths_path = os.path.join(store_dir, PATHS_FILE)
+        self._paths_cache = None
+
+        os.makedirs(store_dir, exist_ok=True)
+        if os.path.exists(self.header_path):
+            with open(self.header_path, encoding='utf-8') as f:
+                self.header = json.load(f)
+            if self.header.get('version') != FORMAT_VERSION:
+                raise ValueError(f"不支持的特征存储版本: {self.header.get('version')}")
+        else:
+            self.header = {
+                'version': FORMAT_VERSION,
+                'dim': dim,
+                'dtype': dtype,
+                'count': 0,
+                'paths_bytes': 0,
+                'model_name': model_name,
+                'commits': 0,
+                'updated_at': time.time(),
+            }
+            _fsync_write(self.data_path, 'wb', b'')
+            _fsync_write(self.paths_path, 'wb', b'')
+            self._commit_header()
+        self._recover()
+
+    @property
+    def dim(self):
+        return self.header['dim']
+
+    @property
+    def dtype(self):
+        return np.dtype(self.header['dtype'])
+
+    @property
+    def count(self):
+        return self.header['count']
+
+    @property
+    def model_name(self):
+        return self.header['model_name']
+
+    def __len__(self):
+        return self.count
+
+    def _row_bytes(self):
+        return self.dim * self.dtype.itemsize
+
+    def _recover(self):
+        """截断上次崩溃遗留的未提交尾部数据"""
+        for path, size in ((self.data_path, self.count * self._row_bytes()),
+                           (self.paths_path, self.header['paths_bytes'])):
+            if not os.path.exists(path):
+                raise IOError(f"特征存储文件缺失: {path}")
+            if os.path.getsize(path) > size:
+                with open(path, 'r+b') as f:
+                    f.truncate(size)
+            elif os.path.getsize(path) < size:
+                raise IOError(f"特征存储文件不完整: {path}")
+
+    def _commit_header(self):
+        self.header['updated_at'] = time.time()
+        tmp_path = self.header_path + '.tmp'
+        _fsync_write(tmp_path, 'w', json.dumps(self.header, ensure_ascii=False, indent=2))
+        os.replace(tmp_path, self.header_path)
+
+    def append(self, features, paths):
+        """追加一段特征和对应路径，全部写入后才提交"""
+        features = np.ascontiguousarray(quantize(features, self.dtype))
+        if features.ndim != 2 or features.shape[1] != self.dim:
+            raise ValueError(f"特征维度不匹配: {features.shape}，期望 (N, {self.dim})")
+        if len(features) != len(paths):
+            raise ValueError(f"特征数量 {len(features)} 与路径数量 {len(paths)} 不一致")
+        if len(features) == 0:
+            return
+
+        paths_data = ''.join(p + '\n' for p in paths).encode('utf-8')
+        _fsync_write(self.data_path, 'ab', features.tobytes())
+        _fsync_write(self.paths_path, 'ab', paths_data)
+
+        self.header['count'] += len(features)
+        self.header['paths_bytes'] += len(paths_data)
+        self.header['commits'] += 1
+        self._commit_header()
+        if self._paths_cache is not None:
+            self._paths_cache.extend(paths)
+
+    def features(self):
+        """以只读 memmap 方式返回全部已提交特征 (count, dim)，类型为存储类型"""
+        if self.count == 0:
+            return np.empty((0, self.dim), dtype=self.dtype)
+        return np.memmap(self.data_path, dtype=self.dtype, mode='r', shape=(self.count, self.dim))
+
+    def paths(self):
+        """返回全部已提交的图片路径"""
+        if self._paths_cache is None:
+            with open(self.paths_path, 'rb') as f:
+                data = f.read(self.header['paths_bytes'])
+            self._paths_cache = data.decode('utf-8').splitlines()
+        return self._paths_cache
+
+    def tail_paths(self, n, block_size=65536):
+        """返回最后 n 条已提交的路径，只从路径文件的提交位置向前按块读取，不载入全部历史"""
+        if n <= 0 or self.count == 0:
+            return []
+        if self._paths_cache is not None:
+            return self._paths_cache[-n:]
+        pos = self.header['paths_bytes']
+        data = b''
+        with open(self.paths_path, 'rb') as f:
+            # 多读到一个换行符，保证最前面的一行是完整的
+            while pos > 0 and data.count(b'\n') <= n:
+                step = min(block_size, pos)
+                pos -= step
+                f.seek(pos)
+                data = f.read(step) + data
+        lines = data.split(b'\n')[:-1]
+        if pos > 0:
+            lines = lines[1:]
+        return [line.decode('utf-8') for line in lines[-n:]]
+
+    def import_legacy(self, feature_save_path, path_list_file, logger):
+        """把旧版 face_features.bin + face_paths.txt 导入空的特征存储"""
+        if self.count > 0 or not (os.path.exists(feature_save_path) and os.path.exists(path_list_file)):
+            return
+        features = np.fromfile(feature_save_path, dtype=np.float32).reshape(-1, self.dim)
+        with open(path_list_file) as f:
+            paths = [line.strip() for line in f]
+        if len(features) != len(paths):
+            logger.warning(f"旧特征文件条数 {len(features)} 与路径条数 {len(paths)} 不一致，按较小者导入")
+            n = min(len(features), len(paths))
+            features, paths = features[:n], paths[:n]
+        features = features / np.linalg.norm(features, axis=1, keepdims=True)
+        self.append(features, paths)
+        logger.info(f"已将旧特征文件导入特征存储，共 {len(paths)} 条")
+
+
+def open_feature_store(config, logger):
+    """根据配置打开特征存储，首次使用时导入旧版特征文件"""
+    dtype = config['Paths'].get('feature_dtype', 'float32')
+    store = FeatureStore(config.get('Paths', 'feature_store_dir', fallback='files/feature_store'), dtype=dtype,
+                         model_name=config['FaceAnalysis']['model_name'])
+    if store.model_name != config['FaceAnalysis']['model_name']:
+        logger.warning(f"特征存储使用的模型 {store.model_name} 与当前配置 "
+                       f"{config['FaceAnalysis']['model_name']} 不一致，特征不可比较")
+    if store.dtype != np.dtype(dtype):
+        logger.warning(f"特征存储类型为 {store.dtype}，与配置的 {dtype} 不一致，继续使用 {store.dtype}；"
+                       f"可执行 python feature_store.py --convert {dtype} 转换")
+    store.import_legacy(config['Paths']['feature_save_path'], config['Paths']['path_list_file'], logger)
+    return store
+
+
+def convert_store(store_dir, dtype, logger, chunk_size=65536):
+    """把特征存储按块转换为另一种存储类型，写完后整体替换原目录"""
+    source = FeatureStore(store_dir)
+    tmp_dir = os.path.normpath(store_dir) + '.converting'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    target = FeatureStore(tmp_dir, dim=source.dim, dtype=dtype, model_name=source.model_name)
+    features, paths = source.features(), source.paths()
+    for start in range(0, source.count, chunk_size):
+        target.append(dequantize(features[start:start + chunk_size]), paths[start:start + chunk_size])
+    del features
+
+    old_dir = os.path.normpath(store_dir) + '.old'
+    os.replace(store_dir, old_dir)
+    os.replace(tmp_dir, store_dir)
+    shutil.rmtree(old_dir)
+    logger.info(f"特征存储已由 {source.dtype} 转换为 {dtype}，共 {target.count} 条")
+
+
+def check_label_agreement(store, dtypes, eps, min_samples, engine, logger, limit=0):
+    """
+    对比紧凑存储类型与 float32 的聚类结果
+
+    以存储中的特征（float32 视图）聚类作为基准，再把特征量化为各 dtype，
+    直接用紧凑格式聚类（faiss 引擎下使用对应的标量量化索引），
+    返回每种类型的 ARI、标签完全一致比例、噪声判定一致比例和每条特征的字节数。
+    """
+    from sklearn.metrics import adjusted_rand_score
+
+    from face_cluster_dbscan import dbscan_labels
+
+    features = store.features()
+    if limit:
+        features = features[-limit:]
+    reference = dequantize(features)
+    start = time.perf_counter()
+    base_labels = dbscan_labels(reference, eps=eps, min_samples=min_samples, engine=engine, logger=logger)
+    report = {'float32': {'seconds': round(time.perf_counter() - start, 3), 'bytes_per_face': reference.shape[1] * 4,
+                          'clusters': int(base_labels.max()) + 1 if len(base_labels) else 0}}
+    for dtype in dtypes:
+        compact = quantize(reference, dtype)
+        start = time.perf_counter()
+        labels = dbscan_labels(compact, eps=eps, min_samples=min_samples, engine=engine, logger=logger)
+        report[dtype] = {
+            'seconds': round(time.perf_counter() - start, 3),
+            'bytes_per_face': compact.shape[1] * compact.dtype.itemsize,
+            'clusters': int(labels.max()) + 1 if len(labels) else 0,
+            'ari': round(float(adjusted_rand_score(base_labels, labels)), 6),
+            'same_label': round(float(np.mean(labels == base_labels)), 6),
+            'same_noise': round(float(np.mean((labels == -1) == (base_labels == -1))), 6),
+        }
+    return report
+
+
+if __name__ == '__main__':
+    import main
+    import utils
+
+    parser = argparse.ArgumentParser(description='特征存储维护：类型转换与量化精度检查')
+    parser.add_argument('--config', default='config.ini')
+    parser.add_argument('--convert', choices=DTYPES, help='把特征存储转换为指定类型')
+    parser.add_argument('--check', help='逗号分隔的类型（如 float16,int8），报告与 float32 聚类的标签一致性')
+    parser.add_argument('--limit', type=int, default=0, help='只检查最近的 N 条特征')
+    args = parser.parse_args()
+
+    config = main.load_config(args.config)
+    utils.LOG_FILE = config['Paths']['log_file']
+    logger = utils.setup_logger('feature_store')
+    store_dir = config.get('Paths', 'feature_store_dir', fallback='files/feature_store')
+
+    if args.check:
+        report = check_label_agreement(FeatureStore(store_dir), args.check.split(','),
+                                       eps=float(config['Clustering']['eps']),
+                                       min_samples=int(config['Clustering']['min_samples']),
+                                       engine=config['Clustering'].get('engine', 'sklearn'),
+                                       logger=logger, limit=args.limit)
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.convert:
+        convert_store(store_dir, args.convert, logger)
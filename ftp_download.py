@@ -1,16 +1,283 @@
 import ftplib
+import io
+import json
+import logging
 import os
+import queue
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from ftplib import FTP
 from socket import timeout
 
 import utils
 
 
+class FTPConnectionPool:
+    """
+    FTP连接池
+
+    连接在多轮下载之间保持复用（keep-alive），空闲超过 keepalive_sec 的连接
+    取出时先用 NOOP 探活，失效则重新建立。每个连接都带有登录信息，
+    reconnect_ftp 可以据此重连。
+    """
+
+    def __init__(self, host, user, password, remote_dir, port=21, size=4, timeout_sec=60, keepalive_sec=30,
+                 logger=None):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.remote_dir = remote_dir
+        self.size = max(1, size)
+        self.timeout_sec = timeout_sec
+        self.keepalive_sec = keepalive_sec
+        self.logger = logger
+        # (连接, 放回时间)
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+
+    def _connect(self):
+        ftp = FTP(timeout=self.timeout_sec)
+        ftp.connect(self.host, self.port)
+        ftp.login(self.user, self.password)
+        ftp.set_pasv(True)  # 启用被动模式
+        ftp.cwd(self.remote_dir)
+        # 记录登录信息，供 reconnect_ftp 使用
+        ftp.user = self.user
+        ftp.passwd = self.password
+        ftp.remote_dir = self.remote_dir
+        return ftp
+
+    def acquire(self):
+        """取出一个可用连接，连接数未达上限时新建，否则等待其他线程归还"""
+        while True:
+            try:
+                ftp, released_at = self._idle.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    can_create = self._created < self.size
+                    if can_create:
+                        self._created += 1
+                if can_create:
+                    try:
+                        ftp = self._connect()
+                    except Exception:
+                        with self._lock:
+                            self._created -= 1
+                        raise
+                    self.logger.info('成功连接到FTP服务器: %s', self.host)
+                    return ftp
+                ftp, released_at = self._idle.get()
+
+            if time.time() - released_at < self.keepalive_sec:
+                return ftp
+            try:
+                ftp.voidcmd('NOOP')
+                return ftp
+            except Exception:
+                self.discard(ftp)
+
+    def release(self, ftp, broken=False):
+        """归还连接；broken 为 True 时关闭并丢弃"""
+        if broken:
+            self.discard(ftp)
+        else:
+            self._idle.put((ftp, time.time()))
+
+    def discard(self, ftp):
+        _close_ftp(ftp)
+        with self._lock:
+            self._created -= 1
+
+    def close(self):
+        """关闭所有空闲连接"""
+        while True:
+            try:
+                ftp, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self.discard(ftp)
+        self.logger.info('已断开FTP连接')
+
+
+def _close_ftp(ftp):
+    try:
+        ftp.quit()
+    except:
+        try:
+            ftp.close()
+        except:
+            pass
+
+
+class RemoteEntry:
+    """远程文件条目：相对 remote_dir 的路径、所在分区、大小和修改时间（NLST 时后两者为 None）"""
+    __slots__ = ('path', 'name', 'partition', 'size', 'modify')
+
+    def __init__(self, path, partition='', size=None, modify=None):
+        self.path = path
+        self.name = path.rsplit('/', 1)[-1]
+        self.partition = partition
+        self.size = size
+        self.modify = modify
+
+    def to_dict(self):
+        return {'path': self.path, 'partition': self.partition, 'size': self.size, 'modify': self.modify}
+
+
+class RemoteListingCursor:
+    """
+    远程目录增量发现游标
+
+    每个分区（按日期划分的子目录，不分区时为 ''）记录一个高水位：最大修改时间
+    以及该时间点上已完成的文件名。只有修改时间超过高水位的文件才视为新文件；
+    分区模式下只列出最新的分区、它之前的一个分区以及之后新出现的分区。下载失败的文件记入
+    pending，下一轮直接重试而不必重新列目录。
+    """
+
+    def __init__(self, cursor_file=None):
+        self.cursor_file = cursor_file
+        self.state = {'partitions': {}, 'pending': {}}
+        if cursor_file and os.path.exists(cursor_file):
+            with open(cursor_file, encoding='utf-8') as f:
+                self.state = json.load(f)
+        self._lock = threading.Lock()
+
+    def partitions_to_list(self, partitions):
+        """
+        已知的最新分区可能仍在写入，需要重新列出；它之前的一个分区也保持打开，
+        跨零点时前一天最后几秒的抓拍可能晚于新分区的第一个文件才写入。更早的分区已经封闭
+        """
+        partitions = sorted(partitions)
+        latest = max(self.state['partitions'], default=None)
+        if latest is None:
+            return partitions
+        earlier = [p for p in partitions if p < latest]
+        return earlier[-1:] + [p for p in partitions if p >= latest]
+
+    def is_new(self, entry):
+        if entry.modify is None:
+            return True
+        mark = self.state['partitions'].get(entry.partition)
+        if mark is None or entry.modify > mark['modify']:
+            return True
+        return entry.modify == mark['modify'] and entry.name not in mark['names']
+
+    def pending_entries(self):
+        return [RemoteEntry(**d) for d in self.state['pending'].values()]
+
+    def done(self, entry):
+        with self._lock:
+            self.state['pending'].pop(entry.path, None)
+            if entry.modify is None:
+                return
+            mark = self.state['partitions'].setdefault(entry.partition, {'modify': '', 'names': []})
+            if entry.modify > mark['modify']:
+                mark['modify'] = entry.modify
+                mark['names'] = [entry.name]
+            elif entry.modify == mark['modify'] and entry.name not in mark['names']:
+                mark['names'].append(entry.name)
+
+    def failed(self, entry):
+        with self._lock:
+            if entry.modify is not None:
+                self.state['pending'][entry.path] = entry.to_dict()
+
+    def defer(self, entry):
+        """
+        已交给下游但尚未确认的文件（内存模式）：与失败相同留在 pending 中，
+        下一轮列目录时按处理清单中的状态决定推进游标还是重新下载
+        """
+        self.failed(entry)
+
+    def save(self):
+        if not self.cursor_file:
+            return
+        os.makedirs(os.path.dirname(self.cursor_file) or '.', exist_ok=True)
+        tmp_path = self.cursor_file + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f, ensure_ascii=False)
+        os.replace(tmp_path, self.cursor_file)
+
+
+def _list_dir(ftp, path, logger):
+    """
+    用 MLSD 列目录，返回 (文件列表[(name, size, modify)], 子目录列表)
+    服务器不支持 MLSD 时退回 NLST（无大小和修改时间），没有扩展名的条目
+    尝试 CWD 进入以判断是否为子目录
+    """
+    try:
+        files, dirs = [], []
+        for name, facts in ftp.mlsd(path, facts=['type', 'size', 'modify']):
+            kind = facts.get('type', '')
+            if kind == 'dir':
+                dirs.append(name)
+            elif kind == 'file':
+                size = facts.get('size')
+                files.append((name, int(size) if size is not None else None, facts.get('modify')))
+        return files, dirs
+    except ftplib.error_perm as e:
+        logger.warning('服务器不支持 MLSD (%s)，退回 NLST', str(e).strip())
+        names = ftp.nlst(path) if path else ftp.nlst()
+        files, dirs = [], []
+        for name in (n.rsplit('/', 1)[-1] for n in names):
+            if '.' not in name and _is_remote_dir(ftp, f'{path}/{name}' if path else name):
+                dirs.append(name)
+            else:
+                files.append((name, None, None))
+        return files, dirs
+
+
+def _is_remote_dir(ftp, path):
+    """能 CWD 进入即为目录，随后切回原工作目录"""
+    cwd = ftp.pwd()
+    try:
+        ftp.cwd(path)
+    except ftplib.error_perm:
+        return False
+    ftp.cwd(cwd)
+    return True
+
+
+def list_remote_files(ftp, cursor, partitioned=False, logger=None):
+    """
+    增量列出 remote_dir 下的新抓拍文件
+
+    partitioned 为 True 时 remote_dir 下是按日期命名的子目录，只列出游标中
+    最新的分区及之后的新分区。返回 RemoteEntry 列表（含上一轮失败待重试的文件）。
+    """
+    entries = []
+    files = None
+    if partitioned:
+        files, partitions = _list_dir(ftp, '', logger)
+        if not partitions and files:
+            logger.error("remote_dir 下没有找到日期分区子目录，按未分区目录列举")
+            partitioned = False
+    if partitioned:
+        for partition in cursor.partitions_to_list(partitions):
+            files, _ = _list_dir(ftp, partition, logger)
+            entries.extend(RemoteEntry(f'{partition}/{name}', partition, size, modify)
+                           for name, size, modify in files)
+    else:
+        if files is None:
+            files, _ = _list_dir(ftp, '', logger)
+        entries.extend(RemoteEntry(name, '', size, modify) for name, size, modify in files)
+
+    new_entries = {e.path: e for e in entries if '_FACE_SNAP' in e.name and cursor.is_new(e)}
+    for entry in cursor.pending_entries():
+        new_entries.setdefault(entry.path, entry)
+    return list(new_entries.values())
+
+
 # 初始化日志
-def download_new_images_from_ftp(ftp_host, ftp_user, ftp_pass, remote_dir, local_dir, processed_files, logger,max_retries=3,retry_delay=10, timeout_sec=60):
+def download_new_images_from_ftp(ftp_host, ftp_user, ftp_pass, remote_dir, local_dir, processed_files, logger,max_retries=3,retry_delay=10, timeout_sec=60,
+                                 on_downloaded=None, should_stop=None, ftp_port=21, pool=None, workers=1,
+                                 cursor_file=None, partitioned=False, ingest_mode='disk', persist_images=True,
+                                 in_flight=None):
     """
-    从FTP下载新图片文件（带重试和断点续传）
+    从FTP下载新图片文件（带重试和断点续传），多个连接并行下载
 
     参数:
     ftp_host -- FTP主机地址
@@ -18,71 +285,161 @@ def download_new_images_from_ftp(ftp_host, ftp_user, ftp_pass, remote_dir, local
     ftp_pass -- FTP密码
     remote_dir -- 远程目录
     local_dir -- 本地保存目录
-    processed_files -- 已处理文件集合
+    processed_files -- 处理清单视图（manifest.ManifestView），下载成功后标记为已下载
     max_retries -- 最大重试次数 (默认3)
     retry_delay -- 重试延迟(秒) (默认10)
     timeout_sec -- 超时时间(秒) (默认60)
+    on_downloaded -- 每个文件下载成功后的回调，参数为本地路径 (流水线模式下直接送入特征提取)
+    should_stop -- 返回True时停止下载剩余文件
+    ftp_port -- FTP端口 (默认21)
+    pool -- 跨轮次复用的 FTPConnectionPool；为None时本轮临时创建并在结束时关闭
+    workers -- 临时连接池的并行连接数 (默认1)
+    cursor_file -- 远程增量发现游标文件，为None时每轮都全量列目录
+    partitioned -- remote_dir 下是否为按日期划分的子目录
+    ingest_mode -- disk=写入本地后再读取；memory=直接在内存中接收文件字节，
+                   通过 on_downloaded(本地路径, 字节) 交给特征提取
+    persist_images -- memory 模式下是否在后台线程把原图异步写入 local_dir
+    in_flight -- 已交给提取阶段、尚未写入清单的文件名集合（流水线队列中的文件），本轮跳过
+
+    memory 模式下下载成功的文件不标记为已下载，游标也不推进：只有提取阶段把它写入
+    清单（已提取/无人脸/失败等）后，下一轮才确认完成；进程在提取前退出时会重新下载。
 
     返回: 成功下载的文件列表
     """
     downloaded_files = []
-    ftp = None
+    new_files = []
+    total_bytes = 0
+    start_time = time.time()
+    own_pool = pool is None
+    if own_pool:
+        pool = FTPConnectionPool(ftp_host, ftp_user, ftp_pass, remote_dir, port=ftp_port, size=workers,
+                                 timeout_sec=timeout_sec, logger=logger)
+    result_lock = threading.Lock()
+    cursor = RemoteListingCursor(cursor_file)
+    memory_mode = ingest_mode == 'memory'
+    # 内存模式下原图落盘在单独的线程中异步进行，不阻塞下载和提取
+    persist_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='persist') \
+        if memory_mode and persist_images else None
+
+    def download_one(entry):
+        # 任何异常（取连接时 421 连接数过多等）都把文件留在游标的 pending 中，
+        # 否则同一轮其他文件推进高水位后它再也不会被列出
+        try:
+            fetch_one(entry)
+        except Exception as e:
+            cursor.failed(entry)
+            logger.error('下载失败: %s - %s', entry.name, str(e))
+
+    def fetch_one(entry):
+        nonlocal total_bytes
+        if should_stop is not None and should_stop():
+            cursor.failed(entry)
+            return
+        fname = entry.name
+        local_path = os.path.join(local_dir, fname)
+        ftp = pool.acquire()
+        success = False
+        data = None
+        try:
+            if memory_mode:
+                data, ftp = fetch_file_with_retry(
+                    ftp, entry.path,
+                    max_retries=max_retries,
+                    retry_delay=retry_delay,
+                    timeout_sec=timeout_sec,
+                    logger=logger,
+                    remote_size=entry.size
+                )
+                success = data is not None
+            else:
+                success, ftp = download_file_with_retry(
+                    ftp, entry.path, local_path,
+                    max_retries=max_retries,
+                    retry_delay=retry_delay,
+                    timeout_sec=timeout_sec,
+                    logger=logger,
+                    remote_size=entry.size
+                )
+        finally:
+            pool.release(ftp, broken=not success)
 
-    try:
-        # 创建FTP连接
-        ftp = FTP(ftp_host, timeout=timeout_sec)
-        ftp.login(ftp_user, ftp_pass)
-        ftp.set_pasv(True)  # 启用被动模式
-        ftp.cwd(remote_dir)
-        logger.info('成功连接到FTP服务器: %s', ftp_host)
+        if success:
+            with result_lock:
+                downloaded_files.append(fname)
+                total_bytes += len(data) if memory_mode else os.path.getsize(local_path)
+            if memory_mode:
+                cursor.defer(entry)
+            else:
+                cursor.done(entry)
+                processed_files.add(fname)
+            logger.info('成功下载: %s', fname)
+            if persist_executor is not None:
+                persist_executor.submit(_persist_file, local_path, data, logger)
+            if on_downloaded is not None:
+                if memory_mode:
+                    on_downloaded(local_path, data)
+                else:
+                    on_downloaded(local_path)
+        else:
+            cursor.failed(entry)
+            logger.error('下载失败: %s', fname)
 
-        # 获取文件列表
-        filenames = ftp.nlst()
-        new_files = [f for f in filenames if '_FACE_SNAP' in f and f not in processed_files]
+    try:
+        # 增量获取文件列表（MLSD 同时给出大小，省去逐个 SIZE 请求）
+        ftp = pool.acquire()
+        try:
+            entries = list_remote_files(ftp, cursor, partitioned=partitioned, logger=logger)
+        except Exception:
+            pool.release(ftp, broken=True)
+            raise
+        pool.release(ftp)
+        unknown = set(processed_files.filter_new(entry.name for entry in entries))
+        new_files = []
+        for entry in entries:
+            if in_flight is not None and entry.name in in_flight:
+                cursor.defer(entry)
+            elif entry.name in unknown:
+                new_files.append(entry)
+            else:
+                cursor.done(entry)
         logger.info('发现 %d 个新文件需要下载', len(new_files))
 
         if not new_files:
+            cursor.save()
             return []
 
         # 确保本地目录存在
         os.makedirs(local_dir, exist_ok=True)
 
-        # 下载每个文件
-        for fname in new_files:
-            local_path = os.path.join(local_dir, fname)
-            success = download_file_with_retry(
-                ftp, fname, local_path,
-                max_retries=max_retries,
-                retry_delay=retry_delay,
-                timeout_sec=timeout_sec
-            )
-
-            if success:
-                downloaded_files.append(fname)
-                processed_files.add(fname)
-                logger.info('成功下载: %s', fname)
-            else:
-                logger.error('下载失败: %s', fname)
+        # 多个连接并行下载
+        with ThreadPoolExecutor(max_workers=pool.size, thread_name_prefix='ftp') as executor:
+            for future in [executor.submit(download_one, entry) for entry in new_files]:
+                try:
+                    future.result()
+                except Exception as e:
+                    logger.error('下载出错: %s', str(e), exc_info=True)
+        if should_stop is not None and should_stop():
+            logger.info('收到停止信号，停止下载剩余文件')
+        cursor.save()
 
     except Exception as e:
         logger.error('FTP操作失败: %s', str(e), exc_info=True)
     finally:
-        # 确保关闭FTP连接
-        if ftp:
-            try:
-                ftp.quit()
-            except:
-                try:
-                    ftp.close()
-                except:
-                    pass
-            logger.info('已断开FTP连接')
-
-    logger.info('下载完成: %d/%d 个文件成功下载', len(downloaded_files), len(new_files))
+        # 临时连接池在本轮结束时关闭，常驻连接池保持连接供下一轮复用
+        if own_pool:
+            pool.close()
+        if persist_executor is not None:
+            persist_executor.shutdown(wait=True)
+
+    elapsed = max(time.time() - start_time, 1e-6)
+    logger.info('下载完成: %d/%d 个文件成功下载，共 %.2f MB，耗时 %.1f 秒，吞吐 %.2f MB/s (%.1f 个/秒)',
+                len(downloaded_files), len(new_files), total_bytes / 1024 / 1024, elapsed,
+                total_bytes / 1024 / 1024 / elapsed, len(downloaded_files) / elapsed)
     return downloaded_files
 
 
-def download_file_with_retry(ftp, remote_file, local_path, max_retries=3, retry_delay=10, timeout_sec=60):
+def download_file_with_retry(ftp, remote_file, local_path, max_retries=3, retry_delay=10, timeout_sec=60, logger=None,
+                             remote_size=None):
     """
     带重试机制的单个文件下载（支持断点续传）
 
@@ -93,9 +450,12 @@ def download_file_with_retry(ftp, remote_file, local_path, max_retries=3, retry_
     max_retries -- 最大重试次数
     retry_delay -- 重试延迟(秒)
     timeout_sec -- 超时时间(秒)
+    logger -- 日志对象
+    remote_size -- 已知的远程文件大小（来自 MLSD），提供时不再发送 SIZE 请求
 
-    返回: 是否下载成功
+    返回: (是否下载成功, FTP连接对象)，重试期间重连过时返回的是新连接
     """
+    logger = logger or logging.getLogger('main')
     attempts = 0
     start_pos = 0
 
@@ -104,8 +464,9 @@ def download_file_with_retry(ftp, remote_file, local_path, max_retries=3, retry_
         local_size = os.path.getsize(local_path)
         try:
             # 获取远程文件大小
-            ftp.sendcmd("TYPE I")  # 切换到二进制模式
-            remote_size = ftp.size(remote_file)
+            if remote_size is None:
+                ftp.sendcmd("TYPE I")  # 切换到二进制模式
+                remote_size = ftp.size(remote_file)
 
             # 如果本地文件较小，尝试续传
             if 0 < local_size < remote_size:
@@ -144,16 +505,21 @@ def download_file_with_retry(ftp, remote_file, local_path, max_retries=3, retry_
 
             # 验证下载
             final_size = os.path.getsize(local_path)
-            try:
-                remote_size = ftp.size(remote_file)
-                if remote_size is not None and final_size != remote_size:
+            if remote_size is not None:
+                if final_size != remote_size:
                     raise IOError(f"文件大小不匹配: 本地 {final_size} != 远程 {remote_size}")
-            except:
-                pass  # 无法验证大小
+            else:
+                try:
+                    remote_size = ftp.size(remote_file)
+                    if remote_size is not None and final_size != remote_size:
+                        raise IOError(f"文件大小不匹配: 本地 {final_size} != 远程 {remote_size}")
+                except:
+                    pass  # 无法验证大小
 
-            return True
+            return True, ftp
 
-        except (timeout, TimeoutError, ftplib.error_temp, ftplib.all_errors) as e:
+        # ftplib.all_errors 本身是元组（已包含 OSError），需要展开，嵌套元组在匹配异常时会抛 TypeError
+        except (timeout, *ftplib.all_errors) as e:
             # 处理超时和临时错误
             logger.warning('下载错误 (尝试 %d/%d): %s - %s', attempts, max_retries, remote_file, str(e))
 
@@ -167,7 +533,7 @@ def download_file_with_retry(ftp, remote_file, local_path, max_retries=3, retry_
 
                 # 尝试重新连接
                 try:
-                    ftp = reconnect_ftp(ftp)
+                    ftp = reconnect_ftp(ftp, logger=logger)
                 except Exception as e:
                     logger.error('重新连接失败: %s', str(e))
 
@@ -184,17 +550,75 @@ def download_file_with_retry(ftp, remote_file, local_path, max_retries=3, retry_
         except:
             pass
 
-    return False
+    return False, ftp
 
 
-def reconnect_ftp(ftp):
-    """重新建立FTP连接"""
+def fetch_file_with_retry(ftp, remote_file, max_retries=3, retry_delay=10, timeout_sec=60, logger=None,
+                          remote_size=None):
+    """
+    带重试机制的单个文件内存下载：retrbinary 的数据块直接收进内存缓冲区，不落盘
+
+    参数同 download_file_with_retry
+
+    返回: (文件字节，失败时为None, FTP连接对象)
+    """
+    logger = logger or logging.getLogger('main')
+    attempts = 0
+    buffer = io.BytesIO()
+
+    while attempts < max_retries:
+        attempts += 1
+        try:
+            ftp.sock.settimeout(timeout_sec)
+            # 从已接收的位置续传
+            ftp.retrbinary('RETR ' + remote_file, buffer.write, rest=buffer.tell() or None, blocksize=32768)
+            data = buffer.getvalue()
+            if remote_size is not None and len(data) != remote_size:
+                raise IOError(f"文件大小不匹配: 接收 {len(data)} != 远程 {remote_size}")
+            return data, ftp
+
+        except (timeout, *ftplib.all_errors) as e:
+            logger.warning('下载错误 (尝试 %d/%d): %s - %s', attempts, max_retries, remote_file, str(e))
+            if remote_size is not None and buffer.tell() >= remote_size:
+                # 数据有误，丢弃后重新下载
+                buffer = io.BytesIO()
+            if attempts < max_retries:
+                logger.info('等待 %d 秒后重试...', retry_delay)
+                time.sleep(retry_delay)
+                try:
+                    ftp = reconnect_ftp(ftp, logger=logger)
+                except Exception as e:
+                    logger.error('重新连接失败: %s', str(e))
+
+        except Exception as e:
+            logger.error('下载失败: %s - %s', remote_file, str(e), exc_info=True)
+            break
+
+    return None, ftp
+
+
+def _persist_file(local_path, data, logger):
+    """把内存中的原图写入本地（先写临时文件再改名，避免留下不完整的文件）"""
+    try:
+        tmp_path = local_path + '.part'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, local_path)
+    except Exception as e:
+        logger.error('保存原图失败: %s - %s', local_path, str(e))
+
+
+def reconnect_ftp(ftp, logger=None):
+    """重新建立FTP连接（登录信息由 FTPConnectionPool 记录在连接对象上）"""
+    logger = logger or logging.getLogger('main')
     try:
         # 获取原始连接参数
         host = ftp.host
+        port = ftp.port
         user = ftp.user
         passwd = ftp.passwd
         timeout = ftp.timeout
+        remote_dir = getattr(ftp, 'remote_dir', None)
 
         # 关闭旧连接
         try:
@@ -206,16 +630,17 @@ def reconnect_ftp(ftp):
                 pass
 
         # 创建新连接
-        new_ftp = FTP(host, timeout=timeout)
+        new_ftp = FTP(timeout=timeout)
+        new_ftp.connect(host, port)
         new_ftp.login(user, passwd)
         new_ftp.set_pasv(True)
+        new_ftp.user = user
+        new_ftp.passwd = passwd
+        new_ftp.remote_dir = remote_dir
 
         # 恢复原始工作目录
-        try:
-            if hasattr(ftp, 'pwd'):
-                new_ftp.cwd(ftp.pwd())
-        except:
-            pass
+        if remote_dir:
+            new_ftp.cwd(remote_dir)
 
         logger.info('FTP连接已重新建立')
         return new_ftp
@@ -233,14 +658,16 @@ if __name__ == "__main__":
     REMOTE_DIR = '/photos'
     LOCAL_DIR = './downloaded'
 
-    # 初始化已处理文件集合
-    processed_files = set()
+    # 初始化处理清单
+    from manifest import ALL_STATUSES, DOWNLOADED, ProcessingManifest
+    processed_files = ProcessingManifest('./manifest.db').view(ALL_STATUSES, DOWNLOADED)
 
     # 运行下载
     try:
         downloaded = download_new_images_from_ftp(
             FTP_HOST, FTP_USER, FTP_PASS,
             REMOTE_DIR, LOCAL_DIR, processed_files,
+            logger=utils.setup_logger('ftp_download'),
             max_retries=3,
             retry_delay=15,
             timeout_sec=90
@@ -0,0 +1,59 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+
+
+def read_image(img_path):
+    """使用OpenCV读取图像（BGR，与InsightFace一致），无法读取时返回None，由提取阶段记录为失败"""
+    try:
+        return cv2.imread(img_path)
+    except Exception:
+        return None
+
+
+class PrefetchLoader:
+    """
+    预取解码加载器，按原顺序产出 (images, paths) 批次
+
+    线程池并行读取和解码图像（OpenCV 解码时释放 GIL），提前提交后续
+    prefetch 批，推理当前批时下一批已在解码。在途的批次数有上限，内存占用
+    与待处理图片总数无关。num_workers 为 0 时在当前线程中顺序读取。
+    """
+
+    def __init__(self, image_paths, batch_size=4, num_workers=2, prefetch=2, read_fn=read_image):
+        self.image_paths = list(image_paths)
+        self.batch_size = max(1, batch_size)
+        self.num_workers = num_workers
+        self.prefetch = max(1, prefetch)
+        self.read_fn = read_fn
+
+    def __len__(self):
+        return (len(self.image_paths) + self.batch_size - 1) // self.batch_size
+
+    def _batches(self):
+        for start in range(0, len(self.image_paths), self.batch_size):
+            yield self.image_paths[start:start + self.batch_size]
+
+    def __iter__(self):
+        if self.num_workers <= 0:
+            for paths in self._batches():
+                yield [self.read_fn(p) for p in paths], paths
+            return
+
+        batches = self._batches()
+        with ThreadPoolExecutor(max_workers=self.num_workers, thread_name_prefix='decode') as pool:
+            # 在途批次：(路径, 对应的读取任务)
+            pending = deque()
+
+            def submit_next():
+                paths = next(batches, None)
+                if paths is not None:
+                    pending.append((paths, [pool.submit(self.read_fn, p) for p in paths]))
+
+            for _ in range(self.prefetch + 1):
+                submit_next()
+            while pending:
+                paths, futures = pending.popleft()
+                submit_next()
+                yield [f.result() for f in futures], paths
@@ -0,0 +1,308 @@
+import os
+
+import numpy as np
+from scipy import sparse
+from sklearn.cluster import DBSCAN
+
+from face_cluster_dbscan import add_to_index, inner_product_index
+from feature_store import dequantize
+
+
+class NeighborIndex:
+    """
+    余弦距离半径近邻查询（特征已归一化，余弦距离 = 1 - 内积）
+
+    engine 为 faiss 时使用常驻的 FAISS 内积索引（float16 / int8 特征使用标量量化索引），
+    每轮只追加新向量；否则对特征分块做矩阵乘法。
+    """
+
+    def __init__(self, dim, engine='faiss', block_size=65536):
+        self.engine = engine
+        self.block_size = block_size
+        self.features = np.empty((0, dim), dtype=np.float32)
+        self.index = None
+
+    def __len__(self):
+        return len(self.features)
+
+    def sync(self, features):
+        """追加 features 中索引尚未包含的行"""
+        n_old = len(self.features)
+        if self.engine == 'faiss' and len(features) > n_old:
+            if self.index is None:
+                # 标量量化索引用首批特征训练取值范围
+                self.index = inner_product_index(features.shape[1], features.dtype, features[:65536])
+            add_to_index(self.index, features[n_old:])
+        self.features = features
+
+    def search(self, queries, eps):
+        """返回 (lims, ids, dists)：第 i 个查询的近邻为 ids[lims[i]:lims[i+1]]，含自身"""
+        queries = np.ascontiguousarray(dequantize(queries))
+        # 与 sklearn 的 <= eps 保持一致，留一点浮点余量
+        threshold = 1.0 - eps - 1e-6
+        if self.index is not None:
+            lims, sims, ids = self.index.range_search(queries, threshold)
+            return lims.astype(np.int64), ids.astype(np.int64), np.clip(1.0 - sims, 0.0, None)
+
+        qis, ids, dists = [], [], []
+        for start in range(0, len(self.features), self.block_size):
+            block = dequantize(self.features[start:start + self.block_size])
+            sims = queries @ block.T
+            qi, bj = np.nonzero(sims > threshold)
+            qis.append(qi)
+            ids.append(bj.astype(np.int64) + start)
+            dists.append(np.clip(1.0 - sims[qi, bj], 0.0, None))
+        qis = np.concatenate(qis) if qis else np.empty(0, dtype=np.int64)
+        order = np.argsort(qis, kind='stable')
+        ids = np.concatenate(ids)[order] if ids else np.empty(0, dtype=np.int64)
+        dists = np.concatenate(dists)[order] if dists else np.empty(0, dtype=np.float32)
+        lims = np.zeros(len(queries) + 1, dtype=np.int64)
+        lims[1:] = np.cumsum(np.bincount(qis, minlength=len(queries)))
+        return lims, ids, dists
+
+    def search_knn(self, queries, k):
+        """返回 (sims, ids)：每个查询内积最大的 k 个近邻（含自身），不足 k 个时 id 为 -1"""
+        queries = np.ascontiguousarray(dequantize(queries))
+        if self.index is not None:
+            sims, ids = self.index.search(queries, k)
+            return sims, ids.astype(np.int64)
+
+        best_sims = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        best_ids = np.full((len(queries), k), -1, dtype=np.int64)
+        for start in range(0, len(self.features), self.block_size):
+            block = dequantize(self.features[start:start + self.block_size])
+            sims = np.concatenate([best_sims, queries @ block.T], axis=1)
+            ids = np.concatenate([best_ids, np.broadcast_to(np.arange(start, start + len(block)),
+                                                            (len(queries), len(block)))], axis=1)
+            top = np.argpartition(-sims, k - 1, axis=1)[:, :k] if sims.shape[1] > k else \
+                np.broadcast_to(np.arange(sims.shape[1]), (len(queries), sims.shape[1]))
+            best_sims = np.take_along_axis(sims, top, axis=1)
+            best_ids = np.take_along_axis(ids, top, axis=1)
+        order = np.argsort(-best_sims, axis=1)
+        best_sims = np.take_along_axis(best_sims, order, axis=1)
+        best_ids = np.take_along_axis(best_ids, order, axis=1)
+        best_ids[~np.isfinite(best_sims)] = -1
+        return best_sims, best_ids
+
+
+def remap_to_previous(labels, previous):
+    """
+    重新聚类后按重叠最多的原则沿用旧簇编号，新出现的簇从旧的最大编号之后分配
+
+    labels 的前 len(previous) 个点与 previous 一一对应，-1 为噪声。
+    """
+    if previous is None or len(previous) == 0:
+        return labels
+    n = min(len(previous), len(labels))
+    mapping = {}
+    used = set()
+    pairs, overlap = np.unique(np.stack([labels[:n], previous[:n]]), axis=1, return_counts=True)
+    for idx in np.argsort(-overlap):
+        new_id, old_id = int(pairs[0, idx]), int(pairs[1, idx])
+        if new_id < 0 or old_id < 0 or new_id in mapping or old_id in used:
+            continue
+        mapping[new_id] = old_id
+        used.add(old_id)
+    next_id = int(previous.max()) + 1 if len(previous) else 0
+    remapped = labels.copy()
+    for new_id in np.unique(labels):
+        if new_id < 0:
+            continue
+        if new_id not in mapping:
+            mapping[new_id] = next_id
+            next_id += 1
+        remapped[labels == new_id] = mapping[new_id]
+    return remapped
+
+
+class _UnionFind:
+    def __init__(self):
+        self.parent = {}
+
+    def find(self, x):
+        parent = self.parent
+        parent.setdefault(x, x)
+        root = x
+        while parent[root] != root:
+            root = parent[root]
+        while parent[x] != root:
+            parent[x], x = root, parent[x]
+        return root
+
+    def union(self, a, b):
+        ra, rb = self.find(a), self.find(b)
+        if ra != rb:
+            self.parent[ra] = rb
+
+
+class IncrementalClusterer:
+    """
+    增量 DBSCAN，簇编号跨轮次保持稳定
+
+    持久化每个点的簇标签和 eps 邻域计数（核心点 = 计数 >= min_samples）。
+    每轮只对新点以及因新点变成核心点的旧点做邻域查询：
+    - 新的核心点与相邻核心点连通，连到已有簇时沿用其编号，连到多个簇时
+      合并为其中最小的编号，否则分配新编号；
+    - 新核心点邻域内的噪声点成为边界点，新的非核心点归入相邻核心点的簇。
+    聚类参数变化或状态与特征存储不一致时全量重建，并尽量沿用旧编号。
+    """
+
+    def __init__(self, state_path, eps=0.5, min_samples=2, engine='faiss', logger=None):
+        self.state_path = state_path
+        self.eps = eps
+        self.min_samples = min_samples
+        self.engine = engine
+        self.logger = logger
+        self.index = None
+        self.labels = np.empty(0, dtype=np.int64)
+        self.counts = np.empty(0, dtype=np.int32)
+        self.next_id = 0
+        # 参数变化导致重建时，用于沿用旧簇编号
+        self._previous_labels = None
+        self._load_state()
+
+    def _load_state(self):
+        if not os.path.exists(self.state_path):
+            return
+        state = np.load(self.state_path)
+        if float(state['eps']) != self.eps or int(state['min_samples']) != self.min_samples:
+            self.logger.info("聚类参数已变化，下一轮将全量重建")
+            self._previous_labels = state['labels']
+            return
+        self.labels = state['labels']
+        self.counts = state['counts']
+        self.next_id = int(state['next_id'])
+
+    def _save_state(self):
+        os.makedirs(os.path.dirname(self.state_path) or '.', exist_ok=True)
+        tmp_path = self.state_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, labels=self.labels, counts=self.counts, next_id=self.next_id,
+                     eps=self.eps, min_samples=self.min_samples)
+        os.replace(tmp_path, self.state_path)
+
+    def update(self, features):
+        """把新增特征并入聚类，返回全部点的标签"""
+        n_total = len(features)
+        if self.index is None:
+            self.index = NeighborIndex(features.shape[1], engine=self.engine)
+        self.index.sync(features)
+
+        n_old = len(self.labels)
+        if n_old > n_total or (n_old == 0 and n_total > 0):
+            self._rebuild(features)
+        elif n_total > n_old:
+            self._insert(features, n_old)
+        else:
+            return self.labels
+        self._save_state()
+        return self.labels
+
+    def _rebuild(self, features):
+        """全量重建：对所有点做一次邻域查询，构建稀疏距离图后执行 DBSCAN"""
+        n = len(features)
+        self.logger.info(f"全量重建聚类，共 {n} 个点")
+        lims_list, ids_list, dists_list = [np.zeros(1, dtype=np.int64)], [], []
+        offset = 0
+        for start in range(0, n, 4096):
+            lims, ids, dists = self.index.search(features[start:start + 4096], self.eps)
+            lims_list.append(lims[1:] + offset)
+            offset += int(lims[-1])
+            ids_list.append(ids)
+            dists_list.append(dists)
+        graph = sparse.csr_matrix(
+            (np.concatenate(dists_list), np.concatenate(ids_list), np.concatenate(lims_list)),
+            shape=(n, n)
+        )
+        labels = DBSCAN(eps=self.eps, min_samples=self.min_samples, metric='precomputed').fit(graph).labels_
+        self.counts = np.diff(graph.indptr).astype(np.int32)
+        self.labels = self._remap_to_previous(labels.astype(np.int64))
+        self.next_id = int(self.labels.max()) + 1 if len(self.labels) else 0
+
+    def _remap_to_previous(self, labels):
+        """全量重建后按重叠最多的原则沿用旧簇编号"""
+        remapped = remap_to_previous(labels, self._previous_labels)
+        self._previous_labels = None
+        return remapped
+
+    def _neighbors(self, features, points):
+        lims, ids, _ = self.index.search(features[points], self.eps)
+        return {int(p): ids[lims[i]:lims[i + 1]] for i, p in enumerate(points)}
+
+    def _insert(self, features, n_old):
+        n_total = len(features)
+        min_samples = self.min_samples
+        new_points = np.arange(n_old, n_total)
+
+        # 1. 新点邻域查询，并更新旧点的邻域计数
+        neighbors = self._neighbors(features, new_points)
+        was_core = self.counts >= min_samples
+        counts = np.concatenate([self.counts, np.zeros(len(new_points), dtype=np.int32)])
+        for p in new_points:
+            counts[p] = len(neighbors[p])
+            old = neighbors[p][neighbors[p] < n_old]
+            np.add.at(counts, old, 1)
+        labels = np.concatenate([self.labels, np.full(len(new_points), -1, dtype=np.int64)])
+        is_core = counts >= min_samples
+
+        # 2. 因新点而成为核心点的旧点也需要查询邻域
+        promoted = np.nonzero(is_core[:n_old] & ~was_core)[0]
+        if len(promoted):
+            neighbors.update(self._neighbors(features, promoted))
+
+        # 3. 新核心点与相邻核心点连通，旧核心点连到其所在的簇
+        uf = _UnionFind()
+        new_cores = [p for p in neighbors if is_core[p]]
+        for p in new_cores:
+            uf.find(p)
+            for j in neighbors[p]:
+                j = int(j)
+                if not is_core[j]:
+                    continue
+                uf.union(p, j)
+                if j < n_old and was_core[j]:
+                    uf.union(j, ('cluster', int(labels[j])))
+
+        components = {}
+        for p in new_cores:
+            components.setdefault(uf.find(p), []).append(p)
+        existing = {}
+        for key in list(uf.parent):
+            if isinstance(key, tuple):
+                existing.setdefault(uf.find(key), set()).add(key[1])
+
+        merges = {}
+        created = 0
+        for root, members in components.items():
+            cluster_ids = existing.get(root)
+            if cluster_ids:
+                target = min(cluster_ids)
+                for cid in cluster_ids:
+                    if cid != target:
+                        merges[cid] = target
+            else:
+                target = self.next_id
+                self.next_id += 1
+                created += 1
+            labels[members] = target
+
+        # 4. 合并簇：旧编号统一改为保留的编号
+        if merges:
+            merged = np.array(list(merges))
+            mask = np.isin(labels, merged)
+            labels[mask] = np.array([merges[int(cid)] for cid in labels[mask]], dtype=np.int64)
+            self.logger.info(f"簇合并: {merges}")
+
+        # 5. 边界点：新核心点邻域内的噪声点、以及与核心点相邻的新非核心点
+        for p in new_cores:
+            border = neighbors[p][labels[neighbors[p]] == -1]
+            labels[border] = labels[p]
+        for p in new_points:
+            if labels[p] == -1:
+                core_neighbors = neighbors[p][is_core[neighbors[p]]]
+                if len(core_neighbors):
+                    labels[p] = labels[core_neighbors[0]]
+
+        self.labels = labels
+        self.counts = counts
+        self.logger.info(f"增量聚类: 新增 {len(new_points)} 个点，新建 {created} 个簇，合并 {len(merges)} 个簇")
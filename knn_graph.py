@@ -0,0 +1,180 @@
+import os
+
+import numpy as np
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+
+from incremental_cluster import NeighborIndex, remap_to_previous
+
+METHODS = ('components', 'infomap')
+
+
+def threshold_graph(graph, threshold):
+    """只保留相似度 >= threshold 的边，并对称化（任一方向是 top-k 近邻即相连）"""
+    graph = graph.tocsr(copy=True)
+    graph.data[graph.data < threshold] = 0
+    graph.eliminate_zeros()
+    return graph.maximum(graph.T).tocsr()
+
+
+def component_labels(graph):
+    """连通分量作为簇"""
+    return connected_components(graph, directed=False)[1]
+
+
+def infomap_labels(graph):
+    """Infomap 社区发现（需要安装 infomap），没有边的孤立点各自成簇"""
+    from infomap import Infomap
+
+    im = Infomap(two_level=True, silent=True)
+    upper = sparse.triu(graph, k=1).tocoo()
+    for i, j, w in zip(upper.row, upper.col, upper.data):
+        im.add_link(int(i), int(j), float(w))
+    im.run()
+    labels = np.full(graph.shape[0], -1, dtype=np.int64)
+    for node_id, module_id in im.get_modules().items():
+        labels[node_id] = module_id
+    isolated = np.flatnonzero(labels < 0)
+    labels[isolated] = labels.max(initial=-1) + 1 + np.arange(len(isolated))
+    return labels
+
+
+class KnnGraphClusterer:
+    """
+    基于缓存 kNN 图的聚类
+
+    每个点保存余弦相似度最高的 k 个近邻，整张图以 CSR 稀疏矩阵持久化到磁盘。
+    每轮只为新增的点查询近邻并追加对应的行；旧点的近邻列表不会因新点而更新，
+    但对称化后新点指向旧点的边仍把它们连起来，对聚类结果影响很小。
+    聚类时去掉相似度低于 threshold 的边，再做连通分量或 Infomap，成员数少于
+    min_cluster_size 的簇视为陌生人（-1）。簇编号按与上一轮的重叠沿用。
+    k 变化或图与特征存储不一致时全量重建；threshold、method 或 min_cluster_size
+    变化时保留图，但即使没有新增特征也会重新聚类。
+    """
+
+    def __init__(self, graph_path, k=10, threshold=0.5, method='components', min_cluster_size=2,
+                 engine='faiss', logger=None):
+        if method not in METHODS:
+            raise ValueError(f"不支持的图聚类方法: {method}，可选 {', '.join(METHODS)}")
+        self.graph_path = graph_path
+        self.k = k
+        self.threshold = threshold
+        self.method = method
+        self.min_cluster_size = min_cluster_size
+        self.engine = engine
+        self.logger = logger
+        self.index = None
+        self.graph = sparse.csr_matrix((0, 0), dtype=np.float32)
+        self.labels = np.empty(0, dtype=np.int64)
+        # 聚类参数变化后，标签需要按新参数重新计算
+        self._stale = False
+        self._load_state()
+
+    def _load_state(self):
+        if not os.path.exists(self.graph_path):
+            return
+        state = np.load(self.graph_path)
+        self.labels = state['labels']
+        params = ('threshold', 'method', 'min_cluster_size')
+        if any(name not in state.files for name in params) or (
+                float(state['threshold']) != self.threshold or str(state['method']) != self.method
+                or int(state['min_cluster_size']) != self.min_cluster_size):
+            self.logger.info("图聚类参数已变化，下一轮将重新聚类")
+            self._stale = True
+        if int(state['k']) != self.k:
+            self.logger.info("knn_k 已变化，下一轮将全量重建 kNN 图")
+            return
+        n = int(state['n'])
+        self.graph = sparse.csr_matrix((state['data'], state['indices'], state['indptr']), shape=(n, n))
+
+    def _save_state(self):
+        os.makedirs(os.path.dirname(self.graph_path) or '.', exist_ok=True)
+        tmp_path = self.graph_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, data=self.graph.data, indices=self.graph.indices, indptr=self.graph.indptr,
+                     n=self.graph.shape[0], k=self.k, labels=self.labels,
+                     threshold=self.threshold, method=self.method, min_cluster_size=self.min_cluster_size)
+        os.replace(tmp_path, self.graph_path)
+
+    def update(self, features):
+        """为新增特征补充近邻边并重新聚类，返回全部点的标签"""
+        n_total = len(features)
+        if self.index is None:
+            self.index = NeighborIndex(features.shape[1], engine=self.engine)
+        self.index.sync(features)
+
+        n_old = self.graph.shape[0]
+        if n_old > n_total:
+            self.logger.info("kNN 图与特征存储不一致，全量重建")
+            self.graph = sparse.csr_matrix((0, 0), dtype=np.float32)
+            n_old = 0
+        if n_total > n_old:
+            if n_old == 0:
+                self.logger.info(f"构建 kNN 图，共 {n_total} 个点，k={self.k}")
+            self._add_rows(features, n_old)
+        elif len(self.labels) == n_total and not self._stale:
+            return self.labels
+
+        labels = self._cluster()
+        self.labels = remap_to_previous(labels, self.labels)
+        self._stale = False
+        self._save_state()
+        return self.labels
+
+    def _add_rows(self, features, n_old, batch_size=4096):
+        """为 features[n_old:] 查询 top-k 近邻，追加到图中"""
+        n_total = len(features)
+        rows, cols, data = [], [], []
+        for start in range(n_old, n_total, batch_size):
+            stop = min(start + batch_size, n_total)
+            # 多取一个近邻，去掉自身
+            sims, ids = self.index.search_knn(features[start:stop], self.k + 1)
+            query_ids = np.arange(start, stop)[:, None]
+            valid = (ids >= 0) & (ids != query_ids)
+            # 每行最多保留 k 个（自身不在结果中时会多出一个）
+            valid &= np.cumsum(valid, axis=1) <= self.k
+            rows.append(np.broadcast_to(query_ids, ids.shape)[valid])
+            cols.append(ids[valid])
+            data.append(sims[valid].astype(np.float32))
+
+        new_rows = sparse.csr_matrix(
+            (np.concatenate(data), (np.concatenate(rows) - n_old, np.concatenate(cols))),
+            shape=(n_total - n_old, n_total)
+        )
+        old_rows = self.graph.copy()
+        old_rows.resize((n_old, n_total))
+        self.graph = sparse.vstack([old_rows, new_rows], format='csr')
+
+    def _cluster(self):
+        graph = threshold_graph(self.graph, self.threshold)
+        if self.method == 'infomap':
+            try:
+                labels = infomap_labels(graph)
+            except ImportError:
+                self.logger.warning("未安装 infomap，改用连通分量")
+                labels = component_labels(graph)
+        else:
+            labels = component_labels(graph)
+
+        # 过小的簇视为陌生人，其余重新编号为 0..n-1
+        sizes = np.bincount(labels)
+        labels = np.where(sizes[labels] >= self.min_cluster_size, labels, -1)
+        kept = np.unique(labels[labels >= 0])
+        remapped = np.full(len(labels), -1, dtype=np.int64)
+        remapped[labels >= 0] = np.searchsorted(kept, labels[labels >= 0])
+        return remapped
+
+
+def open_knn_clusterer(config, engine, logger):
+    """根据 [Clustering] 配置创建 kNN 图聚类器"""
+    section = config['Clustering']
+    threshold = section.get('knn_threshold', '')
+    return KnnGraphClusterer(
+        config['Paths'].get('knn_graph_path', 'files/knn_graph.npz'),
+        k=section.getint('knn_k', fallback=10),
+        threshold=float(threshold) if threshold else 1.0 - section.getfloat('eps'),
+        method=section.get('knn_community', 'components'),
+        min_cluster_size=section.getint('min_samples', fallback=2),
+        engine=engine,
+        logger=logger
+    )
@@ -1,15 +1,23 @@
 
 import os
-import time
 import configparser
 
+import cluster_query
+import dedup
 import face_cluster_dbscan
+import knn_graph
+import manifest
+import metrics
+import scheduler
 import utils
 import visualize_clusters_by_dbscan
 # 从face-features.py导入需要的函数
-from face_features import process_images_incrementally
+from face_features import FaceExtractor, ParallelExtractor, StreamEmbedder, process_images_incrementally
+from feature_store import open_feature_store
+from incremental_cluster import IncrementalClusterer
+from pipeline import Pipeline
 # 从ftp-download.py导入需要的函数
-from ftp_download import download_new_images_from_ftp
+from ftp_download import FTPConnectionPool, download_new_images_from_ftp
 
 # 读取配置文件
 def load_config(config_path='config.ini'):
@@ -36,11 +44,10 @@ if __name__ == '__main__':
     
     # 获取路径配置
     img_dir = config['Paths']['image_dir']
-    feature_save_path = config['Paths']['feature_save_path']
-    path_list_file = config['Paths']['path_list_file']
     label_file_path = config['Paths']['label_file_path']
     process_file_path = config['Paths']['process_file_path']
     html_report_path = config['Paths']['html_report_path']
+    report_mode = config.get('Report', 'mode', fallback='single')
     
     # 获取FTP配置
     ftp_host = config['FTP']['host']
@@ -51,6 +58,12 @@ if __name__ == '__main__':
     timeout_sec = int(config['FTP']['timeout_sec'])
     max_retries = int(config['FTP']['max_retries'])
     retry_delay = int(config['FTP']['retry_delay'])
+    parallel_connections = config['FTP'].getint('parallel_connections', fallback=1)
+    keepalive_sec = config['FTP'].getint('keepalive_sec', fallback=30)
+    list_cursor_file = config['FTP'].get('list_cursor_file', '') or None
+    partitioned = config['FTP'].getboolean('partitioned', fallback=False)
+    ingest_mode = config['FTP'].get('ingest_mode', 'disk')
+    persist_images = config['FTP'].getboolean('persist_images', fallback=True)
 
 
     # 获取系统配置
@@ -60,54 +73,226 @@ if __name__ == '__main__':
     eps = float(config['Clustering']['eps'])
     min_samples = int(config['Clustering']['min_samples'])
     metric = config['Clustering']['metric']
+    cluster_engine = config['Clustering'].get('engine', 'sklearn')
+    incremental = config['Clustering'].getboolean('incremental', fallback=False)
+    algorithm = config['Clustering'].get('algorithm', 'dbscan')
     
-    processed_set = set()
-    if os.path.exists(process_file_path):
-        with open(process_file_path) as f:
-            processed_set = set(line.strip() for line in f)
+    # 特征存储（首次运行时导入旧版 face_features.bin / face_paths.txt）
+    feature_store = open_feature_store(config, logger)
 
-    while True:
-        # 1. 下载新图像
-        download_new_images_from_ftp(
+    # 增量聚类器：保存核心点和簇状态，簇编号跨循环保持稳定（仅支持cosine）
+    # kNN 图聚类器：缓存 top-k 近邻图，每轮只为新增人脸补边
+    clusterer = None
+    if algorithm == 'knn':
+        if metric == 'cosine':
+            clusterer = knn_graph.open_knn_clusterer(config, cluster_engine, logger)
+        else:
+            logger.warning(f"kNN 图聚类只支持 cosine 距离，metric={metric} 时使用 DBSCAN")
+    elif incremental:
+        if metric == 'cosine':
+            clusterer = IncrementalClusterer(
+                config.get('Paths', 'cluster_state_path', fallback='files/cluster_state.npz'),
+                eps=eps, min_samples=min_samples, engine=cluster_engine, logger=logger)
+        else:
+            logger.warning(f"增量聚类只支持 cosine 距离，metric={metric} 时使用全量聚类")
+
+    # 常驻特征提取器：模型只加载一次，跨循环复用
+    # num_procs > 1 时使用多进程提取，每个进程持有独立的 ONNX 会话
+    if config['FaceAnalysis'].getint('num_procs', fallback=1) > 1:
+        extractor = ParallelExtractor(config['FaceAnalysis'], logger)
+    else:
+        extractor = FaceExtractor(config['FaceAnalysis'], logger)
+
+    # 簇原型索引与"这是谁？"查询服务（复用常驻提取器）
+    prototype_path = config.get('Query', 'prototype_path', fallback='files/prototypes.npz')
+    medoids_per_cluster = config.getint('Query', 'medoids_per_cluster', fallback=0)
+    query_port = config.getint('Query', 'port', fallback=0)
+    if query_port > 0:
+        query = cluster_query.ClusterQuery(prototype_path, cluster_query.query_threshold(config))
+        cluster_query.start_query_server(query, extractor, config.get('Query', 'host', fallback='127.0.0.1'),
+                                         query_port, logger)
+
+    # 处理清单：按文件记录下载/提取状态，首次运行时导入旧版 processed_files.txt
+    processing_manifest = manifest.ProcessingManifest(
+        config.get('Paths', 'manifest_path', fallback='files/manifest.db'))
+    processing_manifest.import_processed_file(process_file_path, logger)
+    # 下载阶段跳过清单中已有的文件；提取阶段只跳过已提取/无人脸以及失败次数达到上限的文件
+    # memory 模式且不保存原图时，失败次数未达上限的文件只能重新下载
+    if ingest_mode == 'memory' and not persist_images:
+        downloaded_set = processing_manifest.view(manifest.DONE_STATUSES, manifest.DOWNLOADED,
+                                                  max_attempts=manifest.MAX_ATTEMPTS)
+    else:
+        downloaded_set = processing_manifest.view(manifest.ALL_STATUSES, manifest.DOWNLOADED)
+    processed_set = processing_manifest.view(manifest.DONE_STATUSES, manifest.EMBEDDED,
+                                             max_attempts=manifest.MAX_ATTEMPTS)
+
+    # 连拍去重：几秒内几乎相同的抓拍只保留一张代表写入特征存储
+    deduplicator = dedup.open_deduplicator(config, processing_manifest, logger)
+
+    # FTP连接池：多个连接并行下载，连接跨循环复用
+    ftp_pool = FTPConnectionPool(ftp_host, ftp_user, ftp_pass, remote_dir, port=ftp_port,
+                                 size=parallel_connections, timeout_sec=timeout_sec,
+                                 keepalive_sec=keepalive_sec, logger=logger)
+
+    # 运行指标：各阶段耗时/数量/失败、积压和峰值内存，每轮输出 JSON 行和 Prometheus 文本文件
+    run_metrics = metrics.Metrics(
+        textfile_path=config.get('Metrics', 'textfile', fallback='') or None,
+        json_path=config.get('Metrics', 'json_log', fallback='') or None,
+        logger=logger
+    )
+    run_metrics.register_gauge('feature_store_faces', lambda: feature_store.count)
+    run_metrics.register_gauge('backlog_files', lambda: processing_manifest.count(manifest.DOWNLOADED))
+    run_metrics.register_gauge('failed_files', lambda: processing_manifest.count(manifest.FAILED))
+    run_metrics.register_gauge('duplicate_faces', processing_manifest.count_duplicates)
+    run_metrics.register_gauge('rejected_files', lambda: processing_manifest.count(manifest.REJECTED))
+    metrics_port = config.getint('Metrics', 'port', fallback=0)
+    if metrics_port > 0:
+        metrics.start_metrics_server(run_metrics, config.get('Metrics', 'host', fallback='127.0.0.1'), metrics_port, logger)
+
+    def download(on_downloaded=None, should_stop=None, in_flight=None, embedder=None):
+        with run_metrics.stage('download') as stage:
+            downloaded = _download(on_downloaded, should_stop, in_flight)
+            stage.items = len(downloaded)
+            if embedder is not None:
+                # memory 模式下解码和提取在下载回调中同步执行，这部分耗时计入 extract 阶段
+                stage.excluded_seconds = embedder.seconds
+        return downloaded
+
+    def _download(on_downloaded=None, should_stop=None, in_flight=None):
+        return download_new_images_from_ftp(
             ftp_host=ftp_host,
             ftp_user=ftp_user,
             ftp_pass=ftp_pass,
             remote_dir=remote_dir,
             local_dir=img_dir,
-            processed_files=processed_set,
+            processed_files=downloaded_set,
             logger=logger,
             max_retries=max_retries,
             retry_delay=retry_delay,
-            timeout_sec=timeout_sec
+            timeout_sec=timeout_sec,
+            on_downloaded=on_downloaded,
+            should_stop=should_stop,
+            pool=ftp_pool,
+            cursor_file=list_cursor_file,
+            partitioned=partitioned,
+            ingest_mode=ingest_mode,
+            persist_images=persist_images,
+            in_flight=in_flight
         )
 
-        # 2. 增量处理
-        process_images_incrementally(
-            path_list_file=path_list_file,
+    def cluster_and_report():
+        # 3.处理聚类
+        with run_metrics.stage('cluster') as stage:
+            labels = face_cluster_dbscan.face_cluster(
+                feature_store=feature_store,
+                label_file_path=label_file_path,
+                logger=logger,
+                eps=eps,
+                min_samples=min_samples,
+                metric=metric,
+                engine=cluster_engine,
+                clusterer=clusterer
+            )
+            stage.items = len(labels) if labels is not None else 0
+        if labels is not None:
+            with run_metrics.stage('prototypes') as stage:
+                n_prototypes = cluster_query.build_prototypes(feature_store.features(), labels, prototype_path,
+                                                              medoids_per_cluster=medoids_per_cluster)
+                stage.items = n_prototypes
+            run_metrics.set_gauge('clusters', n_prototypes)
+            logger.info(f"簇原型索引已更新，共 {n_prototypes} 个簇")
+
+        # 4.生成报告（处理状态已在各阶段实时写入清单）
+        with run_metrics.stage('report') as stage:
+            stage.items = feature_store.count
+            if report_mode == 'paged':
+                # 分页报告：缩略图缓存，只重写成员变化的簇页面
+                visualize_clusters_by_dbscan.generate_paged_report(
+                    config.get('Report', 'report_dir', fallback='files/report'),
+                    label_file_path,
+                    feature_store.paths(),
+                    config.get('Report', 'thumb_dir', fallback='files/thumbs'),
+                    page_size=config.getint('Report', 'page_size', fallback=200),
+                    logger=logger,
+                    duplicates=processing_manifest.duplicates_by_representative()
+                )
+            else:
+                visualize_clusters_by_dbscan.generate_report(
+                    html_report_path,
+                    label_file_path,
+                    feature_store.paths(),
+                    duplicates=processing_manifest.duplicates_by_representative()
+                )
+
+    if config['System'].get('mode', 'sequential') == 'pipeline':
+        # 流水线模式：下载、提取、聚类/报告并发运行（本地目录只在启动时扫描，不监听）
+        pipeline_scheduler = scheduler.open_scheduler(config, img_dir, logger, watch=False)
+        Pipeline(
+            download_fn=download,
+            extractor=extractor,
+            feature_store=feature_store,
+            processed_files_set=processed_set,
+            cluster_fn=cluster_and_report,
             image_dir=img_dir,
-            feature_save_path=feature_save_path,
-            processed_files_set=processed_set,config=config,
-            logger=logger
-        )
+            logger=logger,
+            batch_size=int(config['FaceAnalysis']['batch_size']),
+            queue_size=config['System'].getint('queue_size', fallback=256),
+            poll_interval=poll_interval,
+            cluster_interval=config['System'].getint('cluster_interval', fallback=30),
+            reload_fn=lambda: extractor.reload_if_changed(load_config()['FaceAnalysis']),
+            metrics=run_metrics,
+            dedup=deduplicator,
+            poller=pipeline_scheduler.poller,
+            cluster_trigger=pipeline_scheduler.cluster_trigger
+        ).run()
+        raise SystemExit(0)
 
-        # 3.处理聚类
-        face_cluster_dbscan.face_cluster(
-            feature_save_path=feature_save_path, 
-            label_file_path=label_file_path,
-            logger=logger
-        )
-        
-        # 4. 保存处理状态
-        with open(process_file_path, 'w') as f:
-            for fname in processed_set:
-                f.write(fname + '\n')
-                
-        # 5.生成报告
-        visualize_clusters_by_dbscan.generate_report(
-            html_report_path,
-            label_file_path,
-            path_list_file
-        )
+    # 调度：FTP 自适应轮询、本地目录监听、按新增人脸数/时间触发聚类
+    cycle_scheduler = scheduler.open_scheduler(config, img_dir, logger)
+    # 启动后先做一次聚类和报告
+    first_cycle = True
+    while True:
+        # 0. [FaceAnalysis] 配置变更时重新加载模型
+        with run_metrics.stage('reload') as stage:
+            stage.items = int(extractor.reload_if_changed(load_config()['FaceAnalysis']))
+
+        # 1. 下载新图像（memory 模式下边下载边提取特征，不经过磁盘）
+        downloaded = []
+        new_faces = 0
+        if cycle_scheduler.poller.due():
+            if ingest_mode == 'memory':
+                embedder = StreamEmbedder(extractor, feature_store, processed_set,
+                                          int(config['FaceAnalysis']['batch_size']), logger, dedup=deduplicator)
+                downloaded = download(on_downloaded=embedder.add_bytes, embedder=embedder)
+                embedded = embedder.flush()
+                run_metrics.record('extract', embedder.seconds, items=embedded, failures=embedder.failures)
+                new_faces += embedded
+                logger.info(f"内存直通提取新增 {embedded} 张人脸")
+            else:
+                downloaded = download()
+            interval = cycle_scheduler.poller.record(len(downloaded))
+            logger.info(f"本轮下载 {len(downloaded)} 个文件，下次FTP轮询间隔 {interval:.0f} 秒")
+
+        # 2. 增量处理（有新下载或本地目录有变化时）
+        if cycle_scheduler.local_scan_due() or (downloaded and ingest_mode != 'memory'):
+            with run_metrics.stage('extract') as stage:
+                stage.items = process_images_incrementally(
+                    image_dir=img_dir,
+                    feature_store=feature_store,
+                    processed_files_set=processed_set,config=config,
+                    logger=logger,
+                    extractor=extractor,
+                    dedup=deduplicator
+                )
+            new_faces += stage.items
+
+        # 3-4. 聚类、生成报告（新增人脸数或时间达到阈值时）
+        cycle_scheduler.cluster_trigger.add(new_faces)
+        if first_cycle or cycle_scheduler.cluster_trigger.due():
+            cluster_and_report()
+            cycle_scheduler.cluster_trigger.record()
+            first_cycle = False
+        run_metrics.end_cycle()
 
-        logger.info(f"完成一次处理循环，等待 {poll_interval} 秒后继续...")
-        time.sleep(poll_interval)  # 使用配置的轮询间隔
+        waited = cycle_scheduler.wait()
+        logger.debug(f"调度等待 {waited:.1f} 秒")
@@ -0,0 +1,177 @@
+import os
+import sqlite3
+import threading
+import time
+
+# 文件处理状态
+DOWNLOADED = 'downloaded'
+EMBEDDED = 'embedded'
+NO_FACE = 'no_face'
+FAILED = 'failed'
+# 图片中的人脸全部是连拍重复，未写入特征存储
+DUPLICATE = 'duplicate'
+# 图片中的人脸全部未通过质量过滤，reason 中记录原因
+REJECTED = 'rejected'
+
+ALL_STATUSES = (DOWNLOADED, EMBEDDED, NO_FACE, FAILED, DUPLICATE, REJECTED)
+# 特征提取已完成、不需要再处理的状态
+DONE_STATUSES = (EMBEDDED, NO_FACE, DUPLICATE, REJECTED)
+# 提取失败超过该次数后不再重试
+MAX_ATTEMPTS = 3
+
+
+class ProcessingManifest:
+    """
+    基于 SQLite (WAL 模式) 的文件处理清单
+
+    按文件名记录每个文件当前所处的阶段（已下载、已提取、无人脸、失败、重复、质量不合格），
+    每次更新都是一个小事务，查询走主键索引，启动时不需要把所有文件名载入内存。
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS files ('
+            ' name TEXT PRIMARY KEY,'
+            ' status TEXT NOT NULL,'
+            ' reason TEXT,'
+            ' attempts INTEGER NOT NULL DEFAULT 0,'
+            ' updated_at REAL NOT NULL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_files_status ON files (status)')
+        # 连拍去重：重复人脸 -> 代表人脸
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS duplicates ('
+            ' face TEXT PRIMARY KEY,'
+            ' representative TEXT NOT NULL,'
+            ' similarity REAL,'
+            ' created_at REAL NOT NULL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_duplicates_rep ON duplicates (representative)')
+        self._conn.commit()
+
+    def mark_many(self, names, status, reason=None):
+        """在一个事务中更新多个文件的状态；失败状态累加尝试次数"""
+        names = list(names)
+        if not names:
+            return
+        now = time.time()
+        failed = 1 if status == FAILED else 0
+        with self._lock, self._conn:
+            self._conn.executemany(
+                'INSERT INTO files (name, status, reason, attempts, updated_at) VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT(name) DO UPDATE SET status = excluded.status, reason = excluded.reason, '
+                'attempts = files.attempts + excluded.attempts, updated_at = excluded.updated_at',
+                [(name, status, reason, failed, now) for name in names]
+            )
+
+    def mark(self, name, status, reason=None):
+        self.mark_many([name], status, reason)
+
+    def status(self, name):
+        with self._lock:
+            row = self._conn.execute('SELECT status FROM files WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else None
+
+    @staticmethod
+    def _status_clause(statuses, max_attempts):
+        """statuses 中的状态，或失败次数已达上限的失败状态"""
+        clause = f'status IN ({",".join("?" * len(statuses))})'
+        params = list(statuses)
+        if max_attempts is not None:
+            clause = f'({clause} OR (status = ? AND attempts >= ?))'
+            params += [FAILED, max_attempts]
+        return clause, params
+
+    def contains(self, name, statuses=ALL_STATUSES, max_attempts=None):
+        clause, params = self._status_clause(statuses, max_attempts)
+        with self._lock:
+            row = self._conn.execute(f'SELECT 1 FROM files WHERE name = ? AND {clause}',
+                                     [name] + params).fetchone()
+        return row is not None
+
+    def count(self, status=None):
+        with self._lock:
+            if status is None:
+                return self._conn.execute('SELECT COUNT(*) FROM files').fetchone()[0]
+            return self._conn.execute('SELECT COUNT(*) FROM files WHERE status = ?', (status,)).fetchone()[0]
+
+    def filter_new(self, names, statuses=ALL_STATUSES, max_attempts=None, chunk_size=500):
+        """返回 names 中不处于 statuses 任一状态的文件名（分块批量查询）"""
+        names = list(names)
+        known = set()
+        clause, params = self._status_clause(statuses, max_attempts)
+        with self._lock:
+            for start in range(0, len(names), chunk_size):
+                chunk = names[start:start + chunk_size]
+                rows = self._conn.execute(
+                    f'SELECT name FROM files WHERE name IN ({",".join("?" * len(chunk))}) AND {clause}',
+                    chunk + params
+                )
+                known.update(row[0] for row in rows)
+        return [name for name in names if name not in known]
+
+    def mark_duplicates(self, rows):
+        """记录连拍重复，rows 为 (重复人脸, 代表人脸, 相似度)"""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO duplicates (face, representative, similarity, created_at) VALUES (?, ?, ?, ?)',
+                [(face, rep, sim, now) for face, rep, sim in rows]
+            )
+
+    def duplicates_by_representative(self):
+        """返回 {代表人脸: [重复人脸, ...]}"""
+        result = {}
+        with self._lock:
+            for face, rep in self._conn.execute('SELECT face, representative FROM duplicates ORDER BY created_at'):
+                result.setdefault(rep, []).append(face)
+        return result
+
+    def count_duplicates(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM duplicates').fetchone()[0]
+
+    def view(self, statuses, add_status, max_attempts=None):
+        """返回一个类似集合的视图：in 判断文件是否处于 statuses，add 把文件标记为 add_status"""
+        return ManifestView(self, statuses, add_status, max_attempts)
+
+    def import_processed_file(self, process_file_path, logger):
+        """从旧版 processed_files.txt 导入（仅在清单为空时执行一次）"""
+        if not os.path.exists(process_file_path) or self.count() > 0:
+            return
+        with open(process_file_path) as f:
+            names = [line.strip() for line in f if line.strip()]
+        self.mark_many(names, EMBEDDED, reason='imported')
+        logger.info(f"已从 {process_file_path} 导入 {len(names)} 条处理记录")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class ManifestView:
+    """处理清单的集合式视图，可直接替代原先的 processed_files 集合"""
+
+    def __init__(self, manifest, statuses, add_status, max_attempts=None):
+        self.manifest = manifest
+        self.statuses = tuple(statuses)
+        self.add_status = add_status
+        self.max_attempts = max_attempts
+
+    def __contains__(self, name):
+        return self.manifest.contains(name, self.statuses, self.max_attempts)
+
+    def add(self, name):
+        self.manifest.mark(name, self.add_status)
+
+    def mark_many(self, names, status, reason=None):
+        self.manifest.mark_many(names, status, reason)
+
+    def filter_new(self, names):
+        return self.manifest.filter_new(names, self.statuses, self.max_attempts)
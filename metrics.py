@@ -0,0 +1,233 @@
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Prometheus 指标名前缀
+PREFIX = 'face_cluster'
+
+
+def peak_rss_bytes():
+    """进程的峰值常驻内存（字节），平台不支持时返回 None"""
+    try:
+        import resource
+    except ImportError:
+        resource = None
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux 单位为 KB，macOS 为字节
+        return peak if sys.platform == 'darwin' else peak * 1024
+    try:
+        import psutil
+    except ImportError:
+        return None
+    info = psutil.Process().memory_info()
+    return getattr(info, 'peak_wset', info.rss)
+
+
+class StageRecord:
+    """
+    一次阶段调用的记录，调用方在 with 块中填写处理数量和失败数量；
+    excluded_seconds 为 with 块中已计入其他阶段的耗时，从本阶段耗时中扣除
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.failures = 0
+        self.seconds = 0.0
+        self.excluded_seconds = 0.0
+
+
+class Metrics:
+    """
+    各阶段的运行指标
+
+    记录每个阶段的耗时、处理数量、吞吐、失败次数，以及队列长度、积压等瞬时值
+    和进程峰值内存。每轮结束时调用 end_cycle：追加一行 JSON 到 json_path，
+    并原子替换 Prometheus 文本文件（可由 node_exporter 的 textfile collector 采集），
+    也可以通过 start_metrics_server 提供 /metrics 接口。
+    """
+
+    def __init__(self, textfile_path=None, json_path=None, logger=None):
+        self.textfile_path = textfile_path
+        self.json_path = json_path
+        self.logger = logger
+        self._lock = threading.Lock()
+        # 累计值: stage -> {calls, seconds, items, failures}
+        self.totals = {}
+        # 本轮值: stage -> {calls, seconds, items, failures}
+        self.cycle = {}
+        self.gauges = {}
+        # 在输出时才求值的瞬时值: name -> 无参函数
+        self.gauge_fns = {}
+        self.cycles = 0
+        self.cycle_started = time.time()
+        self._last_cycle = None
+
+    @contextmanager
+    def stage(self, name):
+        """
+        统计一个阶段：with metrics.stage('download') as stage: stage.items = ...
+
+        with 块中抛出的异常计为一次失败并继续向上抛出。
+        """
+        record = StageRecord(name)
+        start = time.perf_counter()
+        try:
+            yield record
+        except BaseException:
+            record.failures += 1
+            raise
+        finally:
+            record.seconds = max(0.0, time.perf_counter() - start - record.excluded_seconds)
+            self._add(record)
+
+    def record(self, name, seconds, items=0, failures=0):
+        """记录一次在别处计时的阶段调用"""
+        record = StageRecord(name)
+        record.seconds = seconds
+        record.items = items
+        record.failures = failures
+        self._add(record)
+
+    def _add(self, record):
+        with self._lock:
+            for table in (self.totals, self.cycle):
+                entry = table.setdefault(record.name, {'calls': 0, 'seconds': 0.0, 'items': 0, 'failures': 0})
+                entry['calls'] += 1
+                entry['seconds'] += record.seconds
+                entry['items'] += record.items
+                entry['failures'] += record.failures
+
+    def set_gauge(self, name, value):
+        """设置瞬时值（队列长度、积压文件数等）"""
+        with self._lock:
+            self.gauges[name] = value
+
+    def register_gauge(self, name, fn):
+        """注册在输出时求值的瞬时值，如 metrics.register_gauge('queue_depth', queue.qsize)"""
+        with self._lock:
+            self.gauge_fns[name] = fn
+
+    def _current_gauges(self):
+        with self._lock:
+            gauges = dict(self.gauges)
+            gauge_fns = dict(self.gauge_fns)
+        for name, fn in gauge_fns.items():
+            try:
+                gauges[name] = fn()
+            except Exception as e:
+                gauges[name] = None
+                if self.logger is not None:
+                    self.logger.warning(f"读取指标 {name} 失败: {e}")
+        return gauges
+
+    def end_cycle(self):
+        """结束一轮：输出本轮 JSON 行并刷新 Prometheus 文本文件，返回本轮汇总"""
+        gauges = self._current_gauges()
+        now = time.time()
+        with self._lock:
+            self.cycles += 1
+            stages = {}
+            for name, entry in self.cycle.items():
+                stages[name] = dict(entry, seconds=round(entry['seconds'], 4),
+                                    throughput=round(entry['items'] / entry['seconds'], 2)
+                                    if entry['seconds'] > 0 else None)
+            summary = {
+                'timestamp': now,
+                'cycle': self.cycles,
+                'cycle_seconds': round(now - self.cycle_started, 4),
+                'stages': stages,
+                'gauges': gauges,
+                'peak_rss_bytes': peak_rss_bytes(),
+            }
+            self.cycle = {}
+            self.cycle_started = now
+            self._last_cycle = summary
+
+        try:
+            if self.json_path:
+                os.makedirs(os.path.dirname(self.json_path) or '.', exist_ok=True)
+                with open(self.json_path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(summary, ensure_ascii=False) + '\n')
+            if self.textfile_path:
+                os.makedirs(os.path.dirname(self.textfile_path) or '.', exist_ok=True)
+                tmp_path = self.textfile_path + '.tmp'
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    f.write(self.render_prometheus())
+                os.replace(tmp_path, self.textfile_path)
+        except OSError as e:
+            if self.logger is not None:
+                self.logger.error(f"写入运行指标失败: {e}")
+        return summary
+
+    def render_prometheus(self):
+        """按 Prometheus 文本格式输出全部指标"""
+        gauges = self._current_gauges()
+        with self._lock:
+            totals = {name: dict(entry) for name, entry in self.totals.items()}
+            last = self._last_cycle
+            cycles = self.cycles
+
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f'# HELP {PREFIX}_{name} {help_text}')
+            lines.append(f'# TYPE {PREFIX}_{name} {kind}')
+            for labels, value in samples:
+                label_text = ','.join(f'{k}="{v}"' for k, v in labels.items())
+                lines.append(f'{PREFIX}_{name}{{{label_text}}} {value}' if label_text
+                             else f'{PREFIX}_{name} {value}')
+
+        metric('stage_calls_total', 'counter', 'Number of stage runs.',
+               [({'stage': n}, e['calls']) for n, e in sorted(totals.items())])
+        metric('stage_seconds_total', 'counter', 'Wall time spent in each stage.',
+               [({'stage': n}, round(e['seconds'], 6)) for n, e in sorted(totals.items())])
+        metric('stage_items_total', 'counter', 'Items processed by each stage.',
+               [({'stage': n}, e['items']) for n, e in sorted(totals.items())])
+        metric('stage_failures_total', 'counter', 'Failures recorded by each stage.',
+               [({'stage': n}, e['failures']) for n, e in sorted(totals.items())])
+        if last is not None:
+            metric('stage_last_cycle_seconds', 'gauge', 'Wall time of each stage in the last cycle.',
+                   [({'stage': n}, e['seconds']) for n, e in sorted(last['stages'].items())])
+            metric('stage_last_cycle_throughput', 'gauge', 'Items per second of each stage in the last cycle.',
+                   [({'stage': n}, e['throughput']) for n, e in sorted(last['stages'].items())
+                    if e['throughput'] is not None])
+            metric('last_cycle_seconds', 'gauge', 'Wall time of the last cycle.', [({}, last['cycle_seconds'])])
+        metric('cycles_total', 'counter', 'Completed cycles.', [({}, cycles)])
+        for name, value in sorted(gauges.items()):
+            if value is not None:
+                metric(name, 'gauge', name.replace('_', ' ').capitalize() + '.', [({}, value)])
+        rss = peak_rss_bytes()
+        if rss is not None:
+            metric('peak_rss_bytes', 'gauge', 'Peak resident set size of the process.', [({}, rss)])
+        return '\n'.join(lines) + '\n'
+
+
+def start_metrics_server(metrics, host, port, logger):
+    """在后台线程启动本地指标服务：GET /metrics 返回 Prometheus 文本格式"""
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != '/metrics':
+                self.send_error(404)
+                return
+            body = metrics.render_prometheus().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True)
+    thread.start()
+    logger.info(f"指标服务已启动: http://{host}:{server.server_address[1]}/metrics")
+    return server
@@ -0,0 +1,229 @@
+import os
+import queue
+import signal
+import threading
+import time
+
+import cv2
+
+from dedup import sort_by_snapshot_time
+from checkpoint import mark_processed
+from face_features import decode_image, discover_new_images
+
+# 队列结束标记
+_STOP = object()
+
+
+class Pipeline:
+    """
+    流水线模式：下载 → 特征提取 → 聚类/报告 三个阶段在各自线程中并发运行
+
+    下载与提取之间通过有界队列连接，新下载的文件立即进入特征提取；队列满时
+    下载阻塞，形成背压。聚类和报告每隔 cluster_interval 检查一次，只在有
+    新人脸时执行。停止时先停止下载，提取阶段处理完队列中剩余的文件，最后再做
+    一次聚类和报告。
+    """
+
+    def __init__(self, download_fn, extractor, feature_store, processed_files_set, cluster_fn, image_dir, logger,
+                 batch_size=4, queue_size=256, poll_interval=10, cluster_interval=30, reload_fn=None, metrics=None,
+                 dedup=None, poller=None, cluster_trigger=None):
+        """
+        download_fn -- download_fn(on_downloaded, should_stop, in_flight)，执行一轮FTP下载，
+                       跳过 in_flight 中已在队列里、尚未写入清单的文件
+        cluster_fn -- 执行聚类、保存状态并生成报告
+        reload_fn -- 在提取批次之间调用，用于配置变更时重新加载模型
+        metrics -- metrics.Metrics，记录提取阶段指标和队列长度，每个聚类间隔输出一轮
+        dedup -- dedup.BurstDeduplicator，写入特征存储前合并连拍重复
+        poller -- scheduler.AdaptivePoller，按新文件数调整下载轮询间隔，为None时固定 poll_interval
+        cluster_trigger -- scheduler.ClusterTrigger，每个 cluster_interval 检查一次新增人脸数/时间阈值，
+                           为None时只要有新增人脸就执行
+        """
+        self.download_fn = download_fn
+        self.extractor = extractor
+        self.feature_store = feature_store
+        self.processed_files_set = processed_files_set
+        self.cluster_fn = cluster_fn
+        self.image_dir = image_dir
+        self.logger = logger
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.cluster_interval = cluster_interval
+        self.reload_fn = reload_fn
+        self.metrics = metrics
+        self.dedup = dedup
+        self.poller = poller
+        self.cluster_trigger = cluster_trigger
+
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.stop_event = threading.Event()
+        self.extract_done = threading.Event()
+        self.pending_faces = 0
+        self._lock = threading.Lock()
+        # 已入队、尚未写入清单的文件名
+        self.in_flight = set()
+        if metrics is not None:
+            metrics.register_gauge('queue_depth', self.queue.qsize)
+            metrics.register_gauge('pending_faces', lambda: self.pending_faces)
+
+    def _enqueue(self, path, data=None):
+        # 阻塞直到队列有空位（背压）；停止时提取阶段仍会继续消费直到结束标记
+        # data 为内存直通模式下的图像字节，为None时从磁盘读取
+        with self._lock:
+            self.in_flight.add(os.path.basename(path))
+        self.queue.put((path, data))
+
+    def _in_flight_snapshot(self):
+        with self._lock:
+            return set(self.in_flight)
+
+    def _download_stage(self):
+        # 先把本地已存在但尚未处理的文件送入队列
+        backlog = discover_new_images(self.image_dir, self.processed_files_set)
+        if self.dedup is not None:
+            backlog = sort_by_snapshot_time(backlog)
+        for path in backlog:
+            if self.stop_event.is_set():
+                break
+            self._enqueue(path)
+
+        while not self.stop_event.is_set():
+            downloaded = []
+            try:
+                downloaded = self.download_fn(self._enqueue, self.stop_event.is_set,
+                                              self._in_flight_snapshot()) or []
+            except Exception as e:
+                self.logger.error(f"下载阶段出错: {e}", exc_info=True)
+            wait = self.poll_interval if self.poller is None else self.poller.record(len(downloaded))
+            self.stop_event.wait(wait)
+
+    def _next_batch(self):
+        """取一批路径：阻塞等待第一个，其余在短时间内凑满 batch_size"""
+        batch = [self.queue.get()]
+        deadline = time.time() + 0.2
+        while batch[-1] is not _STOP and len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get(timeout=max(0.0, deadline - time.time())))
+            except queue.Empty:
+                break
+        return batch
+
+    def _extract_stage(self):
+        last_reload = time.time()
+        finished = False
+        while not finished:
+            batch = self._next_batch()
+            if batch[-1] is _STOP:
+                batch.pop()
+                finished = True
+            if not batch:
+                continue
+
+            if self.reload_fn is not None and time.time() - last_reload >= self.poll_interval:
+                last_reload = time.time()
+                try:
+                    self.reload_fn()
+                except Exception as e:
+                    self.logger.error(f"重新加载配置失败: {e}")
+
+            try:
+                self._extract(batch)
+            except Exception as e:
+                self.logger.error(f"提取阶段出错: {e}", exc_info=True)
+        self.extract_done.set()
+
+    def _extract(self, batch):
+        if self.metrics is None:
+            self._extract_batch(batch)
+            return
+        with self.metrics.stage('extract') as stage:
+            stage.items = len(batch)
+            stage.failures = self._extract_batch(batch)
+
+    def _extract_batch(self, batch):
+        """提取一批图像并写入特征存储，返回失败的图像数"""
+        try:
+            return self._extract_and_mark(batch)
+        finally:
+            with self._lock:
+                self.in_flight.difference_update(os.path.basename(path) for path, _ in batch)
+
+    def _extract_and_mark(self, batch):
+        paths = [path for path, _ in batch]
+        images = [cv2.imread(path) if data is None else decode_image(data) for path, data in batch]
+        features, face_paths, no_face_paths, failed_paths, rejected = self.extractor.extract_batch(images, paths)
+        duplicate_paths = []
+        if self.dedup is not None:
+            features, face_paths, duplicate_paths = self.dedup.filter(features, face_paths)
+        # 特征写入后再标记清单，中途崩溃时这批图片会重新提取
+        if face_paths:
+            self.feature_store.append(features, face_paths)
+            with self._lock:
+                self.pending_faces += len(face_paths)
+                if self.cluster_trigger is not None:
+                    self.cluster_trigger.add(len(face_paths))
+        if self.dedup is not None:
+            self.dedup.commit()
+        mark_processed(self.processed_files_set, face_paths, no_face_paths, self.logger, failed_paths,
+                       duplicate_paths, rejected)
+        return len(failed_paths)
+
+    def _run_cluster(self):
+        with self._lock:
+            pending, self.pending_faces = self.pending_faces, 0
+        if pending == 0:
+            return
+        self.logger.info(f"新增 {pending} 张人脸，执行聚类 (队列积压 {self.queue.qsize()})")
+        try:
+            self.cluster_fn()
+        except Exception as e:
+            self.logger.error(f"聚类阶段出错: {e}", exc_info=True)
+
+    def _cluster_due(self):
+        if self.cluster_trigger is None:
+            return True
+        with self._lock:
+            if not self.cluster_trigger.due():
+                return False
+            self.cluster_trigger.record()
+        return True
+
+    def _cluster_stage(self):
+        while not self.extract_done.wait(self.cluster_interval):
+            if not self._cluster_due():
+                continue
+            self._run_cluster()
+            if self.metrics is not None:
+                self.metrics.end_cycle()
+        # 提取阶段结束后做最后一次聚类
+        self._run_cluster()
+        if self.metrics is not None:
+            self.metrics.end_cycle()
+
+    def stop(self, *args):
+        if not self.stop_event.is_set():
+            self.logger.info("收到停止信号，流水线正在退出...")
+        self.stop_event.set()
+
+    def run(self):
+        """启动各阶段并阻塞直到收到停止信号，随后按顺序干净退出"""
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, self.stop)
+
+        download = threading.Thread(target=self._download_stage, name='download')
+        extract = threading.Thread(target=self._extract_stage, name='extract')
+        cluster = threading.Thread(target=self._cluster_stage, name='cluster')
+        for thread in (download, extract, cluster):
+            thread.start()
+        self.logger.info("流水线模式已启动")
+
+        try:
+            while not self.stop_event.wait(1.0):
+                pass
+        except KeyboardInterrupt:
+            self.stop()
+
+        download.join()
+        self.queue.put(_STOP)
+        extract.join()
+        cluster.join()
+        self.logger.info("流水线已停止")
@@ -0,0 +1,184 @@
+import threading
+import time
+
+from utils import is_face_snap
+
+
+class AdaptivePoller:
+    """
+    FTP 轮询间隔自适应
+
+    一轮下载到新文件时间隔回到 min_interval；连续空轮询时按 backoff 倍数增长，
+    最长 max_interval。空闲时不再每隔几秒做一次完整的目录列举。
+    """
+
+    def __init__(self, min_interval=2.0, max_interval=60.0, backoff=2.0):
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.backoff = max(1.0, backoff)
+        self.interval = min_interval
+        self.last_poll = None
+
+    def due(self, now=None):
+        now = time.time() if now is None else now
+        return self.last_poll is None or now - self.last_poll >= self.interval
+
+    def next_time(self):
+        return time.time() if self.last_poll is None else self.last_poll + self.interval
+
+    def record(self, n_new, now=None):
+        """记录一次轮询的新文件数，返回下一次轮询的间隔"""
+        self.last_poll = time.time() if now is None else now
+        if n_new > 0:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.max_interval, self.interval * self.backoff)
+        return self.interval
+
+
+class ClusterTrigger:
+    """
+    聚类触发条件：累计新增人脸数达到 min_new_faces，或距上次聚类已超过
+    max_interval 秒且有新增人脸
+    """
+
+    def __init__(self, min_new_faces=50, max_interval=300.0):
+        self.min_new_faces = max(1, min_new_faces)
+        self.max_interval = max_interval
+        self.pending = 0
+        self.last_run = time.time()
+
+    def add(self, n_faces):
+        self.pending += n_faces
+
+    def due(self, now=None):
+        now = time.time() if now is None else now
+        if self.pending == 0:
+            return False
+        return self.pending >= self.min_new_faces or now - self.last_run >= self.max_interval
+
+    def next_time(self):
+        """有新增人脸时最迟的聚类时刻，没有时为 None"""
+        return self.last_run + self.max_interval if self.pending else None
+
+    def record(self, now=None):
+        self.pending = 0
+        self.last_run = time.time() if now is None else now
+
+
+class DirectoryWatcher:
+    """
+    监听 image_dir 下新写入或移入的抓拍图片（watchdog，Linux 上使用 inotify）
+
+    只设置一个变化标志，由主循环唤醒后再按清单扫描目录。未安装 watchdog 时
+    start 返回 False，调用方退回定时扫描。
+    """
+
+    def __init__(self, image_dir, logger):
+        self.image_dir = image_dir
+        self.logger = logger
+        self.changed = threading.Event()
+        self.observer = None
+
+    def start(self):
+        try:
+            from watchdog.events import FileSystemEventHandler
+            from watchdog.observers import Observer
+        except ImportError:
+            self.logger.warning("未安装 watchdog，本地目录改为定时扫描")
+            return False
+
+        changed = self.changed
+
+        class SnapHandler(FileSystemEventHandler):
+            def _notify(self, path):
+                if is_face_snap(path):
+                    changed.set()
+
+            # 写入完成（inotify IN_CLOSE_WRITE）或移入目录时才通知，避免读到写了一半的文件
+            def on_closed(self, event):
+                if not event.is_directory:
+                    self._notify(event.src_path)
+
+            def on_moved(self, event):
+                if not event.is_directory:
+                    self._notify(event.dest_path)
+
+        self.observer = Observer()
+        self.observer.schedule(SnapHandler(), self.image_dir, recursive=True)
+        self.observer.daemon = True
+        self.observer.start()
+        self.logger.info(f"正在监听本地目录: {self.image_dir}")
+        return True
+
+    def consume(self):
+        """返回上次调用以来是否有新文件，并清除标志"""
+        changed = self.changed.is_set()
+        self.changed.clear()
+        return changed
+
+    def stop(self):
+        if self.observer is not None:
+            self.observer.stop()
+            self.observer.join(timeout=5)
+            self.observer = None
+
+
+class Scheduler:
+    """
+    顺序模式的事件驱动调度
+
+    替代每轮固定 sleep(poll_interval)：FTP 按 AdaptivePoller 的间隔轮询；本地
+    目录有新文件时（DirectoryWatcher）立即唤醒提取；聚类和报告按 ClusterTrigger
+    的人脸数/时间阈值执行，而不是每轮都执行。
+    """
+
+    # 收到本地文件事件后再等一小段时间，把同一批推送的文件合并处理
+    SETTLE_SEC = 0.5
+
+    def __init__(self, poller, cluster_trigger, watcher=None):
+        self.poller = poller
+        self.cluster_trigger = cluster_trigger
+        self.watcher = watcher if watcher is not None and watcher.start() else None
+        # 第一轮总是扫描一次本地目录
+        self._scan_pending = True
+
+    def local_scan_due(self):
+        """本地目录是否需要扫描：没有监听时每次唤醒都扫描"""
+        if self.watcher is None:
+            return True
+        due = self._scan_pending or self.watcher.consume()
+        self._scan_pending = False
+        return due
+
+    def wait(self):
+        """阻塞到下一次 FTP 轮询、聚类截止时刻或本地新文件事件，返回等待的秒数"""
+        deadline = self.poller.next_time()
+        cluster_time = self.cluster_trigger.next_time()
+        if cluster_time is not None:
+            deadline = min(deadline, cluster_time)
+        timeout = max(0.0, deadline - time.time())
+        start = time.time()
+        if self.watcher is None:
+            time.sleep(timeout)
+        elif self.watcher.changed.wait(timeout):
+            time.sleep(self.SETTLE_SEC)
+        return time.time() - start
+
+    def close(self):
+        if self.watcher is not None:
+            self.watcher.stop()
+
+
+def open_scheduler(config, image_dir, logger, watch=True):
+    """根据 [Scheduler] 配置创建调度器，watch 为 False 时不监听本地目录"""
+    # 没有 [Scheduler] 节的旧配置按固定 poll_interval 轮询、每轮都聚类
+    poll_interval = config.getfloat('System', 'poll_interval', fallback=10)
+    poller = AdaptivePoller(min_interval=config.getfloat('Scheduler', 'poll_min_interval', fallback=poll_interval),
+                            max_interval=config.getfloat('Scheduler', 'poll_max_interval', fallback=poll_interval),
+                            backoff=config.getfloat('Scheduler', 'poll_backoff', fallback=2.0))
+    trigger = ClusterTrigger(min_new_faces=config.getint('Scheduler', 'cluster_min_faces', fallback=1),
+                             max_interval=config.getfloat('Scheduler', 'cluster_max_interval', fallback=0))
+    watcher = DirectoryWatcher(image_dir, logger) \
+        if watch and config.getboolean('Scheduler', 'watch_local', fallback=False) else None
+    return Scheduler(poller, trigger, watcher)
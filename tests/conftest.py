@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 各模块以脚本方式放在仓库根目录，测试时把根目录加入导入路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
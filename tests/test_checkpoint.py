@@ -0,0 +1,100 @@
+import logging
+
+import numpy as np
+import pytest
+
+from checkpoint import CheckpointWriter
+from feature_store import FeatureStore
+from manifest import DONE_STATUSES, EMBEDDED, FAILED, MAX_ATTEMPTS, NO_FACE, ProcessingManifest
+
+logger = logging.getLogger('test')
+
+DIM = 8
+
+
+def batch(names):
+    """一批提取结果：每张图片一张人脸"""
+    features = np.ones((len(names), DIM), dtype=np.float32) / np.sqrt(DIM)
+    return features, [f'/img/{name}#0' for name in names], [], [], []
+
+
+@pytest.fixture
+def store(tmp_path):
+    return FeatureStore(str(tmp_path / 'store'), dim=DIM)
+
+
+@pytest.fixture
+def mf(tmp_path):
+    return ProcessingManifest(str(tmp_path / 'manifest.db'))
+
+
+def test_commits_every_checkpoint(store, mf):
+    writer = CheckpointWriter(store, mf.view(DONE_STATUSES, EMBEDDED, MAX_ATTEMPTS), logger, checkpoint_every=4)
+    writer.add(*batch(['a.jpg', 'b.jpg', 'c.jpg']))
+    assert store.count == 0
+    assert mf.count() == 0
+
+    writer.add(*batch(['d.jpg']))
+    assert store.count == 4
+    assert mf.count(EMBEDDED) == 4
+
+    writer.add(*batch(['e.jpg']))
+    writer.flush()
+    assert store.count == 5
+    assert writer.committed == 5
+
+
+def test_no_face_and_failed_are_marked(store, mf):
+    writer = CheckpointWriter(store, mf.view(DONE_STATUSES, EMBEDDED, MAX_ATTEMPTS), logger, checkpoint_every=4)
+    features, face_paths, _, _, _ = batch(['a.jpg'])
+    writer.add(features, face_paths, ['/img/b.jpg'], ['/img/c.jpg'], [])
+    writer.flush()
+    assert mf.status('a.jpg') == EMBEDDED
+    assert mf.status('b.jpg') == NO_FACE
+    assert mf.status('c.jpg') == FAILED
+
+
+def test_skip_committed_after_crash(store, mf):
+    processed = mf.view(DONE_STATUSES, EMBEDDED, MAX_ATTEMPTS)
+    # 模拟写入特征存储之后、标记清单之前崩溃
+    store.append(*batch(['a.jpg', 'b.jpg'])[:2])
+    assert mf.count() == 0
+
+    writer = CheckpointWriter(store, processed, logger, checkpoint_every=4)
+    remaining = writer.skip_committed(['/img/a.jpg', '/img/b.jpg', '/img/c.jpg'])
+    assert remaining == ['/img/c.jpg']
+    assert 'a.jpg' in processed and 'b.jpg' in processed
+    assert store.count == 2
+
+
+def test_resume_does_not_duplicate_features(store, mf):
+    processed = mf.view(DONE_STATUSES, EMBEDDED, MAX_ATTEMPTS)
+    names = [f'{i}.jpg' for i in range(10)]
+    writer = CheckpointWriter(store, processed, logger, checkpoint_every=4)
+    for name in names[:6]:
+        writer.add(*batch([name]))
+    # 第二块未提交时崩溃：只有前 4 张写入并标记
+    assert store.count == 4
+
+    resumed = CheckpointWriter(store, processed, logger, checkpoint_every=4)
+    todo = resumed.skip_committed([f'/img/{name}' for name in mf.filter_new(names, DONE_STATUSES, MAX_ATTEMPTS)])
+    assert todo == [f'/img/{name}' for name in names[4:]]
+    for path in todo:
+        resumed.add(*batch([path.rsplit('/', 1)[-1]]))
+    resumed.flush()
+
+    assert store.count == len(names)
+    assert [p.split('#')[0] for p in store.paths()] == [f'/img/{name}' for name in names]
+
+
+def test_skip_committed_reads_only_the_tail(store, mf):
+    processed = mf.view(DONE_STATUSES, EMBEDDED, MAX_ATTEMPTS)
+    names = [f'{i}.jpg' for i in range(40)]
+    store.append(*batch(names)[:2])
+    # 重新打开，路径缓存为空
+    store = FeatureStore(store.store_dir)
+
+    writer = CheckpointWriter(store, processed, logger, checkpoint_every=4)
+    remaining = writer.skip_committed([f'/img/{name}' for name in names])
+    assert remaining == [f'/img/{name}' for name in names[:32]]
+    assert store._paths_cache is None
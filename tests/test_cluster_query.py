@@ -0,0 +1,65 @@
+import os
+
+import numpy as np
+import pytest
+
+from cluster_query import ClusterQuery, build_prototypes
+
+
+def load(path):
+    data = np.load(path)
+    return {key: data[key] for key in ('vectors', 'cluster_ids', 'sizes', 'clusters')}
+
+
+def random_features(n, dim=16, seed=0):
+    features = np.random.default_rng(seed).normal(size=(n, dim)).astype(np.float32)
+    return features / np.linalg.norm(features, axis=1, keepdims=True)
+
+
+@pytest.mark.parametrize('medoids', [0, 2])
+def test_incremental_update_matches_full_build(tmp_path, medoids):
+    rng = np.random.default_rng(1)
+    features = random_features(400)
+    incremental = str(tmp_path / 'incremental.npz')
+    full = str(tmp_path / 'full.npz')
+
+    labels = rng.integers(-1, 8, size=200)
+    for n in (200, 260, 260, 400):
+        labels = np.concatenate([labels, rng.integers(-1, 10, size=n - len(labels))])
+        # 一部分旧点换簇，其中一个簇整体并入另一个簇
+        labels = labels.copy()
+        labels[rng.choice(len(labels), size=10, replace=False)] = rng.integers(-1, 10, size=10)
+        labels[labels == 3] = 4
+        build_prototypes(features[:n], labels, incremental, medoids, chunk_size=64)
+        if os.path.exists(full):
+            os.remove(full)
+        build_prototypes(features[:n], labels, full, medoids, chunk_size=64)
+
+        got, expected = load(incremental), load(full)
+        np.testing.assert_array_equal(got['clusters'], expected['clusters'])
+        np.testing.assert_array_equal(got['sizes'], expected['sizes'])
+        np.testing.assert_array_equal(got['cluster_ids'], expected['cluster_ids'])
+        np.testing.assert_allclose(got['vectors'], expected['vectors'], atol=1e-5)
+
+
+def test_unchanged_labels_do_not_rewrite(tmp_path):
+    features = random_features(50)
+    labels = np.arange(50) % 5
+    path = str(tmp_path / 'prototypes.npz')
+    assert build_prototypes(features, labels, path) == 5
+    mtime = os.stat(path).st_mtime_ns
+    assert build_prototypes(features, labels, path) == 5
+    assert os.stat(path).st_mtime_ns == mtime
+
+
+def test_query(tmp_path):
+    features = random_features(30)
+    labels = np.repeat([0, 1, -1], 10)
+    path = str(tmp_path / 'prototypes.npz')
+    build_prototypes(features, labels, path, medoids_per_cluster=1)
+
+    query = ClusterQuery(path, threshold=-1.0)
+    result = query.query(features[0])[0]
+    assert result['cluster'] in (0, 1)
+    assert result['cluster_size'] == 10
+    assert ClusterQuery(path, threshold=1.1).query(features[0])[0]['cluster'] == -1
@@ -0,0 +1,60 @@
+import numpy as np
+
+from dedup import BurstDeduplicator, snapshot_time, sort_by_snapshot_time
+from manifest import ProcessingManifest
+
+
+def face(seed, dim=8):
+    feature = np.random.default_rng(seed).normal(size=dim).astype(np.float32)
+    return feature / np.linalg.norm(feature)
+
+
+def deduplicator(tmp_path):
+    return BurstDeduplicator(ProcessingManifest(str(tmp_path / 'manifest.db')), threshold=0.9, window_sec=10)
+
+
+def run_one_by_one(dedup, paths, features):
+    kept = []
+    for path, feature in zip(paths, features):
+        _, kept_paths, _ = dedup.filter(feature[None, :], [path])
+        kept.extend(kept_paths)
+    return kept
+
+
+def test_snapshot_time_from_name():
+    assert snapshot_time('/img/20240101120001_0_FACE_SNAP.jpg') - \
+        snapshot_time('/img/20240101120000_0_FACE_SNAP.jpg') == 1
+
+
+def test_out_of_order_backlog_is_sorted_before_dedup(tmp_path):
+    # 同一个人 12:00:00 起的连拍，以及 12:05:00 的另一个人，目录遍历顺序打乱
+    paths = ['/img/20240101120000_a_FACE_SNAP.jpg', '/img/20240101120500_b_FACE_SNAP.jpg',
+             '/img/20240101120001_c_FACE_SNAP.jpg', '/img/20240101120002_d_FACE_SNAP.jpg']
+    features = {paths[0]: face(0), paths[1]: face(1), paths[2]: face(0), paths[3]: face(0)}
+
+    ordered = sort_by_snapshot_time(paths)
+    assert ordered == [paths[0], paths[2], paths[3], paths[1]]
+    kept = run_one_by_one(deduplicator(tmp_path), ordered, [features[p] for p in ordered])
+    assert kept == [paths[0], paths[1]]
+
+
+def test_mapping_is_written_on_commit(tmp_path):
+    dedup = deduplicator(tmp_path)
+    paths = ['/img/20240101120000_a_FACE_SNAP.jpg', '/img/20240101120001_b_FACE_SNAP.jpg']
+    features, kept, duplicates = dedup.filter(np.stack([face(0), face(0)]), paths)
+    assert kept == paths[:1]
+    assert duplicates == paths[1:]
+    assert len(features) == 1
+    # 代表写入特征存储之前清单中没有映射
+    assert dedup.manifest.count_duplicates() == 0
+
+    dedup.commit()
+    assert dedup.manifest.duplicates_by_representative() == {paths[0]: [paths[1]]}
+    dedup.commit()
+    assert dedup.manifest.count_duplicates() == 1
+
+
+def test_window_expires(tmp_path):
+    dedup = deduplicator(tmp_path)
+    paths = ['/img/20240101120000_a_FACE_SNAP.jpg', '/img/20240101120030_b_FACE_SNAP.jpg']
+    assert run_one_by_one(dedup, paths, [face(0), face(0)]) == paths
@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+from face_quality import QualityGate, blur_score, estimate_pose
+
+# ArcFace 112x112 对齐模板（左眼、右眼、鼻尖、左嘴角、右嘴角）
+ARCFACE_TEMPLATE = np.array([
+    [38.2946, 51.6963],
+    [73.5318, 51.5014],
+    [56.0252, 71.7366],
+    [41.5493, 92.3655],
+    [70.7299, 92.2041],
+], dtype=np.float32)
+
+FRONTAL_BBOX = (0, 0, 112, 112, 0.9)
+
+
+def shifted_nose(dx=0.0, dy=0.0):
+    kps = ARCFACE_TEMPLATE.copy()
+    kps[2] += (dx, dy)
+    return kps
+
+
+def make_gate(**thresholds):
+    return QualityGate({key: str(value) for key, value in thresholds.items()})
+
+
+def test_template_is_frontal():
+    yaw, pitch = estimate_pose(ARCFACE_TEMPLATE)
+    assert abs(yaw) < 2
+    assert abs(pitch) < 2
+
+
+def test_pose_sign_follows_nose_offset():
+    yaw, _ = estimate_pose(shifted_nose(dx=10))
+    assert yaw > 20
+    _, pitch = estimate_pose(shifted_nose(dy=-10))
+    assert pitch < -20
+
+
+def test_disabled_gate_accepts_everything():
+    gate = make_gate()
+    assert gate.check_detection((0, 0, 5, 5, 0.01), shifted_nose(dx=30)) is None
+    assert gate.check_size(np.zeros((5, 5, 3), dtype=np.uint8)) is None
+    assert gate.check_crop(np.zeros((112, 112, 3), dtype=np.uint8)) is None
+
+
+def test_frontal_face_passes():
+    gate = make_gate(min_face_size=40, min_det_score=0.5, max_yaw=30, max_pitch=30)
+    assert gate.check_detection(FRONTAL_BBOX, ARCFACE_TEMPLATE) is None
+
+
+@pytest.mark.parametrize('thresholds, bbox, kps, reason', [
+    ({'min_face_size': 40}, (0, 0, 30, 112, 0.9), ARCFACE_TEMPLATE, 'size'),
+    ({'min_det_score': 0.5}, (0, 0, 112, 112, 0.3), ARCFACE_TEMPLATE, 'det_score'),
+    ({'max_yaw': 30}, FRONTAL_BBOX, shifted_nose(dx=12), 'yaw'),
+    ({'max_pitch': 30}, FRONTAL_BBOX, shifted_nose(dy=15), 'pitch'),
+])
+def test_detection_rejections(thresholds, bbox, kps, reason):
+    rejected = make_gate(**thresholds).check_detection(bbox, kps)
+    assert rejected is not None and rejected.startswith(reason + ' ')
+
+
+def test_direct_mode_checks_size_only():
+    gate = make_gate(min_face_size=40)
+    assert gate.check_size(np.zeros((30, 80, 3), dtype=np.uint8)).startswith('size ')
+    assert gate.check_size(np.zeros((40, 80, 3), dtype=np.uint8)) is None
+
+
+def test_blurry_crop_is_rejected():
+    rng = np.random.default_rng(0)
+    sharp = rng.integers(0, 256, size=(112, 112, 3), dtype=np.uint8)
+    flat = np.full((112, 112, 3), 128, dtype=np.uint8)
+    gate = make_gate(min_blur=100)
+
+    assert blur_score(flat) < 100 < blur_score(sharp)
+    assert gate.check_crop(flat).startswith('blur ')
+    assert gate.check_crop(sharp) is None
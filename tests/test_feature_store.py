@@ -0,0 +1,105 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from feature_store import FeatureStore, dequantize
+
+
+def random_features(n, dim=8, seed=0):
+    features = np.random.default_rng(seed).normal(size=(n, dim)).astype(np.float32)
+    return features / np.linalg.norm(features, axis=1, keepdims=True)
+
+
+def test_append_and_reopen(tmp_path):
+    store = FeatureStore(str(tmp_path), dim=8)
+    features = random_features(5)
+    store.append(features[:3], ['a.jpg', 'b.jpg', 'c.jpg'])
+    store.append(features[3:], ['d.jpg', 'e.jpg'])
+
+    reopened = FeatureStore(str(tmp_path), dim=8)
+    assert reopened.count == 5
+    assert reopened.paths() == ['a.jpg', 'b.jpg', 'c.jpg', 'd.jpg', 'e.jpg']
+    np.testing.assert_array_equal(reopened.features(), features)
+
+
+def test_uncommitted_tail_is_truncated(tmp_path):
+    store = FeatureStore(str(tmp_path), dim=8)
+    features = random_features(3)
+    store.append(features[:2], ['a.jpg', 'b.jpg'])
+    data_size = os.path.getsize(store.data_path)
+    paths_size = os.path.getsize(store.paths_path)
+
+    # 模拟写入数据后、提交 header 前崩溃
+    with open(store.data_path, 'ab') as f:
+        f.write(features[2:].tobytes())
+    with open(store.paths_path, 'ab') as f:
+        f.write(b'c.jpg\n')
+
+    reopened = FeatureStore(str(tmp_path), dim=8)
+    assert reopened.count == 2
+    assert reopened.paths() == ['a.jpg', 'b.jpg']
+    assert os.path.getsize(reopened.data_path) == data_size
+    assert os.path.getsize(reopened.paths_path) == paths_size
+
+    reopened.append(features[2:], ['c.jpg'])
+    assert FeatureStore(str(tmp_path), dim=8).paths() == ['a.jpg', 'b.jpg', 'c.jpg']
+
+
+def test_partial_write_inside_header_fails(tmp_path):
+    store = FeatureStore(str(tmp_path), dim=8)
+    store.append(random_features(2), ['a.jpg', 'b.jpg'])
+    with open(store.data_path, 'r+b') as f:
+        f.truncate(8 * 4)
+
+    with pytest.raises(IOError):
+        FeatureStore(str(tmp_path), dim=8)
+
+
+def test_unknown_version_is_rejected(tmp_path):
+    store = FeatureStore(str(tmp_path), dim=8)
+    with open(store.header_path, encoding='utf-8') as f:
+        header = json.load(f)
+    header['version'] = 999
+    with open(store.header_path, 'w', encoding='utf-8') as f:
+        json.dump(header, f)
+
+    with pytest.raises(ValueError):
+        FeatureStore(str(tmp_path), dim=8)
+
+
+def test_dimension_and_count_mismatch(tmp_path):
+    store = FeatureStore(str(tmp_path), dim=8)
+    with pytest.raises(ValueError):
+        store.append(random_features(2, dim=4), ['a.jpg', 'b.jpg'])
+    with pytest.raises(ValueError):
+        store.append(random_features(2), ['a.jpg'])
+    assert store.count == 0
+
+
+@pytest.mark.parametrize('dtype', ['float16', 'int8'])
+def test_compact_dtypes(tmp_path, dtype):
+    store = FeatureStore(str(tmp_path), dim=8, dtype=dtype)
+    features = random_features(4)
+    store.append(features, ['a.jpg', 'b.jpg', 'c.jpg', 'd.jpg'])
+
+    reopened = FeatureStore(str(tmp_path))
+    assert reopened.dtype == np.dtype(dtype)
+    np.testing.assert_allclose(dequantize(reopened.features()), features, atol=1e-2)
+
+
+def test_tail_paths(tmp_path):
+    store = FeatureStore(str(tmp_path), dim=8)
+    paths = [f'/img/{i}_人脸.jpg' for i in range(100)]
+    store.append(random_features(100), paths)
+    # 未提交的尾部不应被读到
+    with open(store.paths_path, 'ab') as f:
+        f.write(b'uncommitted.jpg\n')
+
+    for block_size in (7, 64, 65536):
+        assert store.tail_paths(10, block_size=block_size) == paths[-10:]
+        assert store.tail_paths(1000, block_size=block_size) == paths
+    assert store.tail_paths(0) == []
+    store.paths()
+    assert store.tail_paths(3) == paths[-3:]
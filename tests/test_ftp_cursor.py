@@ -0,0 +1,138 @@
+import ftplib
+import logging
+
+from ftp_download import RemoteEntry, RemoteListingCursor, list_remote_files
+
+logger = logging.getLogger('test')
+
+
+class FakeFTP:
+    """内存中的 FTP 目录树：{目录: {文件名: 修改时间}}，'' 为 remote_dir"""
+
+    def __init__(self, tree, mlsd=True):
+        self.tree = tree
+        self.supports_mlsd = mlsd
+        self.cwd_path = ''
+
+    def mlsd(self, path='', facts=()):
+        if not self.supports_mlsd:
+            raise ftplib.error_perm('500 Unknown command')
+        for name in self._children(path):
+            child = f'{path}/{name}' if path else name
+            if child in self.tree:
+                yield name, {'type': 'dir'}
+            else:
+                yield name, {'type': 'file', 'size': '1', 'modify': self.tree[path][name]}
+
+    def nlst(self, path=''):
+        return [f'{path}/{name}' if path else name for name in self._children(path)]
+
+    def _children(self, path):
+        subdirs = [d.rsplit('/', 1)[-1] for d in self.tree
+                   if d and (d.rsplit('/', 1)[0] if '/' in d else '') == path]
+        return sorted(self.tree.get(path, {})) + sorted(subdirs)
+
+    def pwd(self):
+        return self.cwd_path
+
+    def cwd(self, path):
+        if path not in self.tree:
+            raise ftplib.error_perm('550 No such directory')
+        self.cwd_path = path
+
+
+def paths(entries):
+    return sorted(e.path for e in entries)
+
+
+def test_only_new_files_after_done():
+    ftp = FakeFTP({'': {'a_FACE_SNAP.jpg': '20240101000001', 'b_FACE_SNAP.jpg': '20240101000002',
+                        'readme.txt': '20240101000003'}})
+    cursor = RemoteListingCursor()
+    entries = list_remote_files(ftp, cursor, logger=logger)
+    assert paths(entries) == ['a_FACE_SNAP.jpg', 'b_FACE_SNAP.jpg']
+
+    for entry in entries:
+        cursor.done(entry)
+    assert list_remote_files(ftp, cursor, logger=logger) == []
+
+    # 同一秒写入的新文件不会被高水位漏掉
+    ftp.tree['']['c_FACE_SNAP.jpg'] = '20240101000002'
+    ftp.tree['']['d_FACE_SNAP.jpg'] = '20240101000009'
+    assert paths(list_remote_files(ftp, cursor, logger=logger)) == ['c_FACE_SNAP.jpg', 'd_FACE_SNAP.jpg']
+
+
+def test_failed_and_deferred_are_retried():
+    ftp = FakeFTP({'': {'a_FACE_SNAP.jpg': '20240101000001', 'b_FACE_SNAP.jpg': '20240101000002'}})
+    cursor = RemoteListingCursor()
+    a, b = sorted(list_remote_files(ftp, cursor, logger=logger), key=lambda e: e.path)
+    cursor.failed(a)
+    cursor.defer(b)
+    assert paths(cursor.pending_entries()) == ['a_FACE_SNAP.jpg', 'b_FACE_SNAP.jpg']
+
+    # 远程文件已被删除时仍从 pending 中重试
+    del ftp.tree['']['a_FACE_SNAP.jpg']
+    assert paths(list_remote_files(ftp, cursor, logger=logger)) == ['a_FACE_SNAP.jpg', 'b_FACE_SNAP.jpg']
+
+    cursor.done(a)
+    cursor.done(b)
+    assert cursor.pending_entries() == []
+    assert list_remote_files(ftp, cursor, logger=logger) == []
+
+
+def test_save_and_reload(tmp_path):
+    cursor_file = str(tmp_path / 'cursor.json')
+    cursor = RemoteListingCursor(cursor_file)
+    cursor.done(RemoteEntry('20240101/a_FACE_SNAP.jpg', '20240101', 1, '20240101000001'))
+    cursor.failed(RemoteEntry('20240101/b_FACE_SNAP.jpg', '20240101', 1, '20240101000002'))
+    cursor.save()
+
+    reloaded = RemoteListingCursor(cursor_file)
+    assert not reloaded.is_new(RemoteEntry('20240101/a_FACE_SNAP.jpg', '20240101', 1, '20240101000001'))
+    assert reloaded.is_new(RemoteEntry('20240101/c_FACE_SNAP.jpg', '20240101', 1, '20240101000003'))
+    assert paths(reloaded.pending_entries()) == ['20240101/b_FACE_SNAP.jpg']
+
+
+def test_previous_partition_stays_open():
+    ftp = FakeFTP({
+        '': {},
+        '20240101': {'a_FACE_SNAP.jpg': '20240101000001'},
+        '20240102': {'b_FACE_SNAP.jpg': '20240102000001'},
+        '20240103': {'c_FACE_SNAP.jpg': '20240103000001'},
+    })
+    cursor = RemoteListingCursor()
+    for entry in list_remote_files(ftp, cursor, partitioned=True, logger=logger):
+        cursor.done(entry)
+
+    # 前一天最后一秒的抓拍晚于新分区的第一个文件写入
+    ftp.tree['20240102']['late_FACE_SNAP.jpg'] = '20240102235959'
+    ftp.tree['20240103']['d_FACE_SNAP.jpg'] = '20240103000005'
+    ftp.tree['20240104'] = {'e_FACE_SNAP.jpg': '20240104000001'}
+    assert paths(list_remote_files(ftp, cursor, partitioned=True, logger=logger)) == \
+        ['20240102/late_FACE_SNAP.jpg', '20240103/d_FACE_SNAP.jpg', '20240104/e_FACE_SNAP.jpg']
+
+
+def test_older_partitions_are_closed():
+    cursor = RemoteListingCursor()
+    cursor.done(RemoteEntry('20240103/a_FACE_SNAP.jpg', '20240103', 1, '20240103000001'))
+    assert cursor.partitions_to_list(['20240101', '20240102', '20240103', '20240104']) == \
+        ['20240102', '20240103', '20240104']
+
+
+def test_nlst_fallback_detects_partitions():
+    ftp = FakeFTP({
+        '': {},
+        '20240101': {'a_FACE_SNAP.jpg': None},
+        '20240102': {'b_FACE_SNAP.jpg': None},
+    }, mlsd=False)
+    cursor = RemoteListingCursor()
+    entries = list_remote_files(ftp, cursor, partitioned=True, logger=logger)
+    assert paths(entries) == ['20240101/a_FACE_SNAP.jpg', '20240102/b_FACE_SNAP.jpg']
+    assert all(e.modify is None for e in entries)
+    assert ftp.pwd() == ''
+
+
+def test_partitioned_without_partitions_falls_back():
+    ftp = FakeFTP({'': {'a_FACE_SNAP.jpg': '20240101000001'}})
+    entries = list_remote_files(ftp, RemoteListingCursor(), partitioned=True, logger=logger)
+    assert paths(entries) == ['a_FACE_SNAP.jpg']
@@ -0,0 +1,153 @@
+import ftplib
+import logging
+
+from ftp_download import download_file_with_retry, fetch_file_with_retry
+
+logger = logging.getLogger('test')
+
+
+class FakeSock:
+    def settimeout(self, timeout):
+        pass
+
+
+class FakeFTP:
+    """只支持 RETR 的 FTP 连接：files 为 {路径: 内容}，errors 为按顺序在 RETR 时抛出的异常"""
+
+    def __init__(self, files, errors=()):
+        self.files = files
+        self.errors = list(errors)
+        self.sock = FakeSock()
+        self.retr_calls = 0
+
+    def retrbinary(self, cmd, callback, blocksize=8192, rest=None):
+        self.retr_calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        path = cmd.split(' ', 1)[1]
+        if path not in self.files:
+            raise ftplib.error_perm('550 No such file')
+        data = self.files[path]
+        callback(data[int(rest or 0):])
+
+    def size(self, path):
+        return len(self.files[path])
+
+
+def download(ftp, tmp_path, remote_size=None, max_retries=3):
+    local_path = str(tmp_path / 'a_FACE_SNAP.jpg')
+    ok, _ = download_file_with_retry(ftp, 'a_FACE_SNAP.jpg', local_path, max_retries=max_retries, retry_delay=0,
+                                     logger=logger, remote_size=remote_size)
+    return ok, local_path
+
+
+def test_download_success(tmp_path):
+    ok, local_path = download(FakeFTP({'a_FACE_SNAP.jpg': b'0123456789'}), tmp_path, remote_size=10)
+    assert ok
+    with open(local_path, 'rb') as f:
+        assert f.read() == b'0123456789'
+
+
+def test_size_mismatch_is_retried_and_cleaned_up(tmp_path):
+    ftp = FakeFTP({'a_FACE_SNAP.jpg': b'0123456789'})
+    ok, local_path = download(ftp, tmp_path, remote_size=20)
+    assert not ok
+    assert ftp.retr_calls == 3
+    assert not (tmp_path / 'a_FACE_SNAP.jpg').exists()
+
+
+def test_missing_file_returns_failure(tmp_path):
+    ok, _ = download(FakeFTP({}), tmp_path, remote_size=10, max_retries=2)
+    assert not ok
+
+
+def test_dropped_connection_is_retried(tmp_path):
+    ftp = FakeFTP({'a_FACE_SNAP.jpg': b'0123456789'}, errors=[ConnectionResetError('reset')])
+    ok, local_path = download(ftp, tmp_path, remote_size=10)
+    assert ok
+    assert ftp.retr_calls == 2
+
+
+def fetch(ftp, remote_size=None, max_retries=3):
+    data, _ = fetch_file_with_retry(ftp, 'a_FACE_SNAP.jpg', max_retries=max_retries, retry_delay=0, logger=logger,
+                                    remote_size=remote_size)
+    return data
+
+
+def test_fetch_success():
+    assert fetch(FakeFTP({'a_FACE_SNAP.jpg': b'0123456789'}), remote_size=10) == b'0123456789'
+
+
+def test_fetch_size_mismatch_returns_none():
+    ftp = FakeFTP({'a_FACE_SNAP.jpg': b'0123456789'})
+    assert fetch(ftp, remote_size=20) is None
+    assert ftp.retr_calls == 3
+
+
+def test_fetch_missing_file_returns_none():
+    assert fetch(FakeFTP({}), remote_size=10, max_retries=2) is None
+
+
+def test_fetch_resumes_after_dropped_connection():
+    class DroppingFTP(FakeFTP):
+        """第一次传输到一半时连接断开"""
+
+        def retrbinary(self, cmd, callback, blocksize=8192, rest=None):
+            if self.retr_calls == 0:
+                self.retr_calls += 1
+                callback(b'01234')
+                raise ConnectionResetError('reset')
+            return super().retrbinary(cmd, callback, blocksize, rest)
+
+    ftp = DroppingFTP({'a_FACE_SNAP.jpg': b'0123456789'})
+    assert fetch(ftp, remote_size=10) == b'0123456789'
+    assert ftp.retr_calls == 2
+
+
+class ListingFTP(FakeFTP):
+    """在 FakeFTP 基础上支持 MLSD，所有文件的修改时间取自 modify"""
+
+    def __init__(self, files, modify):
+        super().__init__(files)
+        self.modify = modify
+
+    def mlsd(self, path='', facts=()):
+        for name, data in sorted(self.files.items()):
+            yield name, {'type': 'file', 'size': str(len(data)), 'modify': self.modify[name]}
+
+
+class FlakyPool:
+    """连接池替身：fail_every > 0 时每 fail_every 次 acquire 抛出一次 421"""
+
+    size = 2
+
+    def __init__(self, ftp, fail_every=0):
+        self.ftp = ftp
+        self.fail_every = fail_every
+        self.calls = 0
+
+    def acquire(self):
+        self.calls += 1
+        if self.fail_every and self.calls % self.fail_every == 0:
+            raise ftplib.error_temp('421 Too many connections')
+        return self.ftp
+
+    def release(self, ftp, broken=False):
+        pass
+
+
+def test_failed_acquire_keeps_file_pending(tmp_path):
+    from ftp_download import download_new_images_from_ftp
+    from manifest import ALL_STATUSES, DOWNLOADED, ProcessingManifest
+
+    files = {f'{i:02d}_FACE_SNAP.jpg': b'x' * (i + 1) for i in range(20)}
+    modify = {name: f'2024010112{i:04d}' for i, name in enumerate(sorted(files))}
+    ftp = ListingFTP(files, modify)
+    downloaded_set = ProcessingManifest(str(tmp_path / 'manifest.db')).view(ALL_STATUSES, DOWNLOADED)
+    kwargs = dict(local_dir=str(tmp_path / 'local'), processed_files=downloaded_set, logger=logger, retry_delay=0,
+                  cursor_file=str(tmp_path / 'cursor.json'))
+
+    first = download_new_images_from_ftp('host', 'u', 'p', '/', pool=FlakyPool(ftp, fail_every=3), **kwargs)
+    assert 0 < len(first) < len(files)
+    second = download_new_images_from_ftp('host', 'u', 'p', '/', pool=FlakyPool(ftp), **kwargs)
+    assert sorted(first + second) == sorted(files)
@@ -0,0 +1,87 @@
+import logging
+
+import numpy as np
+import pytest
+from sklearn.cluster import DBSCAN
+from sklearn.metrics import adjusted_rand_score
+
+from incremental_cluster import IncrementalClusterer, remap_to_previous
+
+logger = logging.getLogger('test')
+
+EPS = 0.3
+MIN_SAMPLES = 3
+
+
+def blobs(n_clusters=6, per_cluster=20, n_noise=10, dim=16, seed=0):
+    """彼此正交的几团特征加少量离散噪声点，打乱顺序"""
+    rng = np.random.default_rng(seed)
+    centers = np.eye(dim)[:n_clusters]
+    points = [c + rng.normal(scale=0.05, size=(per_cluster, dim)) for c in centers]
+    points.append(rng.normal(size=(n_noise, dim)))
+    features = np.concatenate(points).astype(np.float32)
+    features /= np.linalg.norm(features, axis=1, keepdims=True)
+    return features[rng.permutation(len(features))]
+
+
+def full_dbscan(features):
+    return DBSCAN(eps=EPS, min_samples=MIN_SAMPLES, metric='cosine').fit(features).labels_
+
+
+def make_clusterer(tmp_path, engine):
+    if engine == 'faiss':
+        pytest.importorskip('faiss')
+    return IncrementalClusterer(str(tmp_path / 'state.npz'), eps=EPS, min_samples=MIN_SAMPLES,
+                                engine=engine, logger=logger)
+
+
+@pytest.mark.parametrize('engine', ['numpy', 'faiss'])
+@pytest.mark.parametrize('step', [1, 7, 40])
+def test_incremental_matches_full_recluster(tmp_path, engine, step):
+    features = blobs()
+    clusterer = make_clusterer(tmp_path, engine)
+    for stop in range(step, len(features) + step, step):
+        labels = clusterer.update(features[:stop])
+
+    expected = full_dbscan(features)
+    assert adjusted_rand_score(expected, labels) == 1.0
+    np.testing.assert_array_equal(labels < 0, expected < 0)
+
+
+@pytest.mark.parametrize('engine', ['numpy', 'faiss'])
+def test_cluster_ids_are_stable(tmp_path, engine):
+    features = blobs()
+    clusterer = make_clusterer(tmp_path, engine)
+    first = clusterer.update(features[:100]).copy()
+    second = clusterer.update(features)
+
+    clustered = first >= 0
+    np.testing.assert_array_equal(second[:100][clustered], first[clustered])
+
+
+def test_state_is_resumed(tmp_path):
+    features = blobs()
+    make_clusterer(tmp_path, 'numpy').update(features[:80])
+    resumed = make_clusterer(tmp_path, 'numpy')
+    assert len(resumed.labels) == 80
+
+    labels = resumed.update(features)
+    assert adjusted_rand_score(full_dbscan(features), labels) == 1.0
+
+
+def test_parameter_change_rebuilds_with_previous_ids(tmp_path):
+    features = blobs()
+    old = make_clusterer(tmp_path, 'numpy').update(features).copy()
+
+    changed = IncrementalClusterer(str(tmp_path / 'state.npz'), eps=EPS * 0.9, min_samples=MIN_SAMPLES,
+                                   engine='numpy', logger=logger)
+    assert len(changed.labels) == 0
+    labels = changed.update(features)
+    both = (old >= 0) & (labels >= 0)
+    np.testing.assert_array_equal(labels[both], old[both])
+
+
+def test_remap_to_previous():
+    previous = np.array([5, 5, 2, 2, -1])
+    labels = np.array([0, 0, 1, 1, 1, 2])
+    np.testing.assert_array_equal(remap_to_previous(labels, previous), [5, 5, 2, 2, 2, 6])
@@ -0,0 +1,70 @@
+import logging
+
+import numpy as np
+import pytest
+from sklearn.metrics import adjusted_rand_score
+
+from knn_graph import KnnGraphClusterer
+
+logger = logging.getLogger('test')
+
+K = 10
+THRESHOLD = 0.7
+MIN_CLUSTER_SIZE = 3
+
+
+def blobs(n_clusters=6, per_cluster=20, n_noise=10, dim=16, seed=0):
+    """彼此正交的几团特征加少量离散噪声点，打乱顺序"""
+    rng = np.random.default_rng(seed)
+    centers = np.eye(dim)[:n_clusters]
+    points = [c + rng.normal(scale=0.05, size=(per_cluster, dim)) for c in centers]
+    points.append(rng.normal(size=(n_noise, dim)))
+    features = np.concatenate(points).astype(np.float32)
+    features /= np.linalg.norm(features, axis=1, keepdims=True)
+    return features[rng.permutation(len(features))]
+
+
+def make_clusterer(path, engine='numpy', **kwargs):
+    if engine == 'faiss':
+        pytest.importorskip('faiss')
+    params = dict(k=K, threshold=THRESHOLD, min_cluster_size=MIN_CLUSTER_SIZE)
+    params.update(kwargs)
+    return KnnGraphClusterer(str(path), engine=engine, logger=logger, **params)
+
+
+@pytest.mark.parametrize('engine', ['numpy', 'faiss'])
+@pytest.mark.parametrize('step', [1, 7, 40])
+def test_incremental_matches_full_build(tmp_path, engine, step):
+    features = blobs()
+    clusterer = make_clusterer(tmp_path / 'graph.npz', engine)
+    for stop in range(step, len(features) + step, step):
+        labels = clusterer.update(features[:stop])
+
+    expected = make_clusterer(tmp_path / 'full.npz', engine).update(features)
+    assert adjusted_rand_score(expected, labels) == 1.0
+    np.testing.assert_array_equal(labels < 0, expected < 0)
+
+
+def test_state_is_resumed(tmp_path):
+    features = blobs()
+    make_clusterer(tmp_path / 'graph.npz').update(features[:80])
+    resumed = make_clusterer(tmp_path / 'graph.npz')
+    assert resumed.graph.shape == (80, 80)
+
+    labels = resumed.update(features)
+    expected = make_clusterer(tmp_path / 'full.npz').update(features)
+    assert adjusted_rand_score(expected, labels) == 1.0
+
+
+def test_parameter_change_reclusters_without_new_faces(tmp_path):
+    features = blobs()
+    old = make_clusterer(tmp_path / 'graph.npz').update(features).copy()
+    assert (old >= 0).any()
+
+    # 簇最小规模超过每团的点数，所有点都应变成陌生人
+    changed = make_clusterer(tmp_path / 'graph.npz', min_cluster_size=1000)
+    labels = changed.update(features)
+    assert (labels == -1).all()
+
+    # 参数已写回状态文件，再次打开不会重复聚类
+    assert not make_clusterer(tmp_path / 'graph.npz', min_cluster_size=1000)._stale
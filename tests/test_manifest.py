@@ -0,0 +1,92 @@
+import logging
+
+from manifest import (ALL_STATUSES, DONE_STATUSES, DOWNLOADED, DUPLICATE, EMBEDDED, FAILED, MAX_ATTEMPTS, NO_FACE,
+                      ProcessingManifest)
+
+logger = logging.getLogger('test')
+
+
+def open_manifest(tmp_path):
+    return ProcessingManifest(str(tmp_path / 'manifest.db'))
+
+
+def test_status_transitions(tmp_path):
+    mf = open_manifest(tmp_path)
+    assert mf.status('a.jpg') is None
+
+    mf.mark('a.jpg', DOWNLOADED)
+    assert mf.status('a.jpg') == DOWNLOADED
+    assert mf.contains('a.jpg')
+    assert not mf.contains('a.jpg', DONE_STATUSES)
+
+    mf.mark('a.jpg', EMBEDDED)
+    assert mf.status('a.jpg') == EMBEDDED
+    assert mf.contains('a.jpg', DONE_STATUSES)
+    assert mf.count(EMBEDDED) == 1
+    assert mf.count(DOWNLOADED) == 0
+
+
+def test_failed_is_retried_until_max_attempts(tmp_path):
+    mf = open_manifest(tmp_path)
+    for _ in range(MAX_ATTEMPTS):
+        assert not mf.contains('a.jpg', DONE_STATUSES, MAX_ATTEMPTS)
+        mf.mark('a.jpg', FAILED, reason='decode')
+        assert mf.status('a.jpg') == FAILED
+    assert mf.contains('a.jpg', DONE_STATUSES, MAX_ATTEMPTS)
+    # 不带重试上限的查询仍把失败视为未完成
+    assert not mf.contains('a.jpg', DONE_STATUSES)
+
+
+def test_success_after_failure_is_done(tmp_path):
+    mf = open_manifest(tmp_path)
+    mf.mark('a.jpg', FAILED)
+    mf.mark('a.jpg', NO_FACE)
+    assert mf.contains('a.jpg', DONE_STATUSES, MAX_ATTEMPTS)
+
+
+def test_filter_new(tmp_path):
+    mf = open_manifest(tmp_path)
+    mf.mark_many(['a.jpg', 'b.jpg'], EMBEDDED)
+    mf.mark('c.jpg', DOWNLOADED)
+    mf.mark('d.jpg', FAILED)
+    names = ['a.jpg', 'b.jpg', 'c.jpg', 'd.jpg', 'e.jpg']
+
+    assert mf.filter_new(names) == ['e.jpg']
+    assert mf.filter_new(names, DONE_STATUSES, MAX_ATTEMPTS) == ['c.jpg', 'd.jpg', 'e.jpg']
+    assert mf.filter_new(names, DONE_STATUSES, MAX_ATTEMPTS, chunk_size=2) == ['c.jpg', 'd.jpg', 'e.jpg']
+
+
+def test_view(tmp_path):
+    mf = open_manifest(tmp_path)
+    downloaded = mf.view(ALL_STATUSES, DOWNLOADED)
+    processed = mf.view(DONE_STATUSES, EMBEDDED, MAX_ATTEMPTS)
+
+    downloaded.add('a.jpg')
+    assert 'a.jpg' in downloaded
+    assert 'a.jpg' not in processed
+    processed.add('a.jpg')
+    assert 'a.jpg' in processed
+    assert mf.status('a.jpg') == EMBEDDED
+
+
+def test_duplicates(tmp_path):
+    mf = open_manifest(tmp_path)
+    mf.mark_duplicates([('b.jpg#0', 'a.jpg#0', 0.97), ('c.jpg#0', 'a.jpg#0', 0.95)])
+    mf.mark('b.jpg', DUPLICATE)
+    assert mf.duplicates_by_representative() == {'a.jpg#0': ['b.jpg#0', 'c.jpg#0']}
+    assert mf.count_duplicates() == 2
+
+
+def test_persistence_and_import(tmp_path):
+    legacy = tmp_path / 'processed_files.txt'
+    legacy.write_text('a.jpg\nb.jpg\n\n')
+    mf = open_manifest(tmp_path)
+    mf.import_processed_file(str(legacy), logger)
+    mf.close()
+
+    reopened = open_manifest(tmp_path)
+    assert reopened.count(EMBEDDED) == 2
+    # 清单非空时不再重复导入
+    legacy.write_text('c.jpg\n')
+    reopened.import_processed_file(str(legacy), logger)
+    assert reopened.count() == 2
@@ -0,0 +1,73 @@
+import configparser
+import logging
+
+import pytest
+
+from scheduler import AdaptivePoller, ClusterTrigger, open_scheduler
+
+logger = logging.getLogger('test')
+
+
+def test_poller_backs_off_when_idle():
+    poller = AdaptivePoller(min_interval=2, max_interval=20, backoff=2)
+    assert poller.due(now=0)
+    assert poller.record(0, now=0) == 4
+    assert not poller.due(now=3)
+    assert poller.due(now=4)
+    assert poller.next_time() == 4
+
+    intervals = [poller.record(0, now=t) for t in range(1, 5)]
+    assert intervals == [8, 16, 20, 20]
+
+
+def test_poller_resets_on_new_files():
+    poller = AdaptivePoller(min_interval=2, max_interval=20, backoff=2)
+    for t in range(4):
+        poller.record(0, now=t)
+    assert poller.interval == 20
+
+    assert poller.record(5, now=10) == 2
+    assert poller.due(now=12)
+
+
+def test_poller_without_backoff_keeps_fixed_interval():
+    poller = AdaptivePoller(min_interval=10, max_interval=10, backoff=2)
+    assert [poller.record(0, now=t) for t in range(3)] == [10, 10, 10]
+
+
+def test_trigger_fires_on_face_count():
+    trigger = ClusterTrigger(min_new_faces=5, max_interval=300)
+    trigger.record(now=0)
+    assert not trigger.due(now=1)
+    assert trigger.next_time() is None
+
+    trigger.add(4)
+    assert not trigger.due(now=1)
+    trigger.add(1)
+    assert trigger.due(now=1)
+
+    trigger.record(now=1)
+    assert trigger.pending == 0
+    assert not trigger.due(now=2)
+
+
+def test_trigger_fires_on_interval_only_with_new_faces():
+    trigger = ClusterTrigger(min_new_faces=50, max_interval=300)
+    trigger.record(now=0)
+    assert not trigger.due(now=1000)
+
+    trigger.add(1)
+    assert trigger.next_time() == 300
+    assert not trigger.due(now=299)
+    assert trigger.due(now=300)
+
+
+@pytest.mark.parametrize('sections', ['', '[Scheduler]\ncluster_min_faces = 10\n'])
+def test_open_scheduler_defaults(sections):
+    config = configparser.ConfigParser()
+    config.read_string('[System]\npoll_interval = 5\n' + sections)
+    scheduler = open_scheduler(config, '.', logger)
+    assert scheduler.watcher is None
+    assert scheduler.poller.interval == 5
+    assert scheduler.poller.record(0, now=0) == 5
+    assert scheduler.local_scan_due()
@@ -0,0 +1,42 @@
+import os
+
+import cv2
+import numpy as np
+
+from visualize_clusters_by_dbscan import ThumbnailCache
+
+
+def write_image(path, seed=0):
+    image = np.random.default_rng(seed).integers(0, 256, size=(40, 60, 3), dtype=np.uint8)
+    cv2.imwrite(str(path), image)
+
+
+def test_thumbnail_is_created_once(tmp_path):
+    src = tmp_path / 'a.jpg'
+    write_image(src)
+    cache = ThumbnailCache(str(tmp_path / 'thumbs'), size=16)
+
+    thumb = cache.ensure([str(src)])[str(src)]
+    assert thumb.endswith('.jpg')
+    assert os.path.exists(os.path.join(cache.thumb_dir, thumb[:2], thumb))
+    assert cache.lookup([str(src)]) == {str(src): thumb}
+    cache.close()
+
+
+def test_failed_thumbnail_is_retried(tmp_path):
+    src = tmp_path / 'late.jpg'
+    broken = tmp_path / 'broken.jpg'
+    broken.write_bytes(b'not an image')
+    cache = ThumbnailCache(str(tmp_path / 'thumbs'), size=16)
+
+    # 原图缺失或无法解码时不写入映射
+    assert cache.ensure([str(src), str(broken)]) == {str(src): '', str(broken): ''}
+    assert cache.lookup([str(src), str(broken)]) == {}
+
+    # 原图补齐后下一次生成报告时重试
+    write_image(src)
+    write_image(broken, seed=1)
+    found = cache.ensure([str(src), str(broken)])
+    assert found[str(src)] and found[str(broken)]
+    assert cache.lookup([str(src), str(broken)]) == found
+    cache.close()
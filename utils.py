@@ -1,7 +1,7 @@
 import logging
 import os
 import time
-from logging.handlers import RotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 
 
 class TextColors:
@@ -19,18 +19,27 @@ class Timer():
     def __init__(self, name='task', verbose=True):
         self.name = name
         self.verbose = verbose
+        self.elapsed = 0.0
 
     def __enter__(self):
-        self.start = time.time()
+        self.start = time.perf_counter()
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
+        self.elapsed = time.perf_counter() - self.start
         if self.verbose:
             print('[Time] {} consumes {:.4f} s'.format(
                 self.name,
-                time.time() - self.start))
+                self.elapsed))
         return exc_type is None
 
+
+IMAGE_EXTS = ('.png', '.jpg', '.jpeg')
+
+
+def is_face_snap(fname):
+    return fname.lower().endswith(IMAGE_EXTS) and '_FACE_SNAP' in fname
+
 LOG_FILE = 'files/face-cluster.log'
 
 # 配置日志 - 解决中文乱码问题
@@ -64,4 +73,23 @@ def setup_logger(name):
     logger.addHandler(console_handler)
     logger.addHandler(file_handler)
 
-    return logger
\ No newline at end of file
+    return logger
+
+
+def setup_worker_logger(name, log_queue):
+    """
+    子进程日志：记录放入 log_queue，由主进程的 start_log_listener 交给主日志的处理器输出，
+    避免多个进程各自打开并轮转同一个日志文件
+    """
+    logger = logging.getLogger(name)
+    logger.setLevel(logging.INFO)
+    logger.addHandler(QueueHandler(log_queue))
+    return logger
+
+
+def start_log_listener(log_queue, logger):
+    """在主进程中把 log_queue 中子进程的日志记录交给 logger 的处理器，返回需在结束时 stop 的监听器"""
+    handlers = logger.handlers or logging.getLogger().handlers
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    return listener
@@ -2,12 +2,19 @@ import os
 import cv2
 import numpy as np
 import base64
+import hashlib
+import html
+import json
+import sqlite3
 from collections import defaultdict
 
-def generate_report(HTML_REPORT_PATH,LABELS_PATH,FACE_PATHS_TXT):
-
-    with open(FACE_PATHS_TXT, 'r') as f:
-        face_paths = [line.strip() for line in f]
+def generate_report(HTML_REPORT_PATH,LABELS_PATH,FACE_PATHS,duplicates=None):
+    # FACE_PATHS 为与标签逐行对应的图片路径列表（来自特征存储）
+    # duplicates 为连拍去重的映射 {代表人脸: [重复人脸, ...]}
+    face_paths = FACE_PATHS
+    duplicates = duplicates or {}
+    if not os.path.exists(LABELS_PATH):
+        return
 
     labels = np.load(LABELS_PATH)
 
@@ -15,37 +22,256 @@ def generate_report(HTML_REPORT_PATH,LABELS_PATH,FACE_PATHS_TXT):
     for path, label in zip(face_paths, labels):
         cluster_dict[label].append(path)
 
-    html = []
-    html.append("<html><head><meta charset='utf-8'><title>人脸聚类报告</title>")
-    html.append("<style>")
-    html.append("body { font-family: Arial, sans-serif; }")
-    html.append(".cluster { margin-bottom: 40px; }")
-    html.append(".cluster-title { font-size: 20px; margin-bottom: 10px; }")
-    html.append(".thumb { margin: 5px; border: 1px solid #ccc; display: inline-block; }")
-    html.append(".thumb img { display: block; width: 112px; height: 112px; object-fit: cover; }")
-    html.append(".thumb-caption { font-size: 10px; text-align: center; width: 112px; word-break: break-word; }")
-    html.append("</style></head><body>")
-    html.append("<h1>人脸聚类报告</h1>")
-    html.append(f"<p>共聚类出 {len(cluster_dict) - (1 if -1 in cluster_dict else 0)} 个簇，陌生人（噪声点）数量：{len(cluster_dict.get(-1, []))}</p>")
+    lines = []
+    lines.append("<html><head><meta charset='utf-8'><title>人脸聚类报告</title>")
+    lines.append("<style>")
+    lines.append("body { font-family: Arial, sans-serif; }")
+    lines.append(".cluster { margin-bottom: 40px; }")
+    lines.append(".cluster-title { font-size: 20px; margin-bottom: 10px; }")
+    lines.append(".thumb { margin: 5px; border: 1px solid #ccc; display: inline-block; }")
+    lines.append(".thumb img { display: block; width: 112px; height: 112px; object-fit: cover; }")
+    lines.append(".thumb-caption { font-size: 10px; text-align: center; width: 112px; word-break: break-word; }")
+    lines.append("</style></head><body>")
+    lines.append("<h1>人脸聚类报告</h1>")
+    lines.append(f"<p>共聚类出 {len(cluster_dict) - (1 if -1 in cluster_dict else 0)} 个簇，陌生人（噪声点）数量：{len(cluster_dict.get(-1, []))}</p>")
 
     for label, paths in sorted(cluster_dict.items()):
         label_name = "陌生人 (-1)" if label == -1 else f"聚类 {label}"
-        html.append(f"<div class='cluster'>")
-        html.append(f"<div class='cluster-title'>{label_name} - 共 {len(paths)} 张图片</div>")
+        lines.append(f"<div class='cluster'>")
+        n_duplicates = sum(len(duplicates.get(p, ())) for p in paths)
+        lines.append(f"<div class='cluster-title'>{label_name} - 共 {len(paths)} 张图片"
+                    f"{f'（另有连拍重复 {n_duplicates} 张）' if n_duplicates else ''}</div>")
         for p in paths:
             img_path = p.split('#')[0]
             # 直接用绝对路径作为img src
             if os.path.exists(img_path):
-                html.append("<div class='thumb'>")
-                html.append(
+                lines.append(f"<div class='thumb'{_duplicate_title(duplicates.get(p))}>")
+                lines.append(
                     f"<img src='file:///{img_path}' alt='{os.path.basename(p)}' style='width:112px;height:112px;object-fit:cover;'/>")
-                html.append(f"<div class='thumb-caption'>{os.path.basename(p)}</div>")
-                html.append("</div>")
-        html.append("</div>")
+                lines.append(f"<div class='thumb-caption'>{os.path.basename(p)}{_multiplicity(duplicates.get(p))}</div>")
+                lines.append("</div>")
+        lines.append("</div>")
 
-    html.append("</body></html>")
+    lines.append("</body></html>")
 
     with open(HTML_REPORT_PATH, 'w', encoding='utf-8') as f:
-        f.write('\n'.join(html))
+        f.write('\n'.join(lines))
 
     print(f"聚类报告已生成：{HTML_REPORT_PATH}")
+
+
+REPORT_STYLE = """<style>
+body { font-family: Arial, sans-serif; }
+.cluster-title { font-size: 20px; margin-bottom: 10px; }
+.thumb { margin: 5px; border: 1px solid #ccc; display: inline-block; vertical-align: top; }
+.thumb img { display: block; width: 112px; height: 112px; object-fit: cover; }
+.thumb-caption { font-size: 10px; text-align: center; width: 112px; word-break: break-word; }
+.pager a, .pager span { margin: 0 4px; }
+table { border-collapse: collapse; }
+td, th { border: 1px solid #ccc; padding: 4px 8px; }
+</style>"""
+
+
+class ThumbnailCache:
+    """
+    按内容寻址的缩略图缓存
+
+    缩略图以原图内容的 sha1 命名，每张原图只解码、缩放一次；
+    原图路径到缩略图的映射记录在 SQLite 中，之后的报告直接查表。
+    生成失败（原图缺失或无法解码）不写入映射，下次生成报告时重试。
+    """
+
+    def __init__(self, thumb_dir, size=112):
+        self.thumb_dir = thumb_dir
+        self.size = size
+        os.makedirs(thumb_dir, exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(thumb_dir, 'thumbs.db'))
+        self._conn.execute('CREATE TABLE IF NOT EXISTS thumbs (path TEXT PRIMARY KEY, thumb TEXT NOT NULL)')
+        self._conn.commit()
+
+    def lookup(self, img_paths, chunk_size=500):
+        """批量查询已有缩略图，返回 {原图路径: 缩略图文件名}"""
+        img_paths = list(img_paths)
+        found = {}
+        for start in range(0, len(img_paths), chunk_size):
+            chunk = img_paths[start:start + chunk_size]
+            rows = self._conn.execute(
+                f'SELECT path, thumb FROM thumbs WHERE thumb != \'\' AND path IN ({",".join("?" * len(chunk))})',
+                chunk)
+            found.update(rows)
+        return found
+
+    def ensure(self, img_paths):
+        """为尚无缩略图的原图生成缩略图，返回全部映射（生成失败的为空字符串）"""
+        img_paths = list(dict.fromkeys(img_paths))
+        found = self.lookup(img_paths)
+        created = []
+        for img_path in img_paths:
+            if img_path in found:
+                continue
+            thumb = self._create(img_path)
+            found[img_path] = thumb
+            if thumb:
+                created.append((img_path, thumb))
+        if created:
+            with self._conn:
+                self._conn.executemany('INSERT OR REPLACE INTO thumbs (path, thumb) VALUES (?, ?)', created)
+        return found
+
+    def _create(self, img_path):
+        try:
+            with open(img_path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return ''
+        thumb = hashlib.sha1(data).hexdigest() + '.jpg'
+        thumb_path = os.path.join(self.thumb_dir, thumb[:2], thumb)
+        if os.path.exists(thumb_path):
+            return thumb
+        image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            return ''
+        # 居中裁成正方形后缩放
+        h, w = image.shape[:2]
+        side = min(h, w)
+        top, left = (h - side) // 2, (w - side) // 2
+        image = cv2.resize(image[top:top + side, left:left + side], (self.size, self.size),
+                           interpolation=cv2.INTER_AREA)
+        os.makedirs(os.path.dirname(thumb_path), exist_ok=True)
+        cv2.imwrite(thumb_path, image, [cv2.IMWRITE_JPEG_QUALITY, 85])
+        return thumb
+
+    def close(self):
+        self._conn.close()
+
+    def url(self, thumb, page_dir):
+        """缩略图相对于报告页面的地址"""
+        return os.path.relpath(os.path.join(self.thumb_dir, thumb[:2], thumb), page_dir).replace(os.sep, '/')
+
+
+def _multiplicity(dups):
+    """代表人脸的连拍次数标记，如 ×3"""
+    return f" <b>×{len(dups) + 1}</b>" if dups else ''
+
+
+def _duplicate_title(dups):
+    """鼠标悬停时显示被合并的重复抓拍"""
+    if not dups:
+        return ''
+    return f" title='{html.escape(chr(10).join(os.path.basename(d) for d in dups), quote=True)}'"
+
+
+def _cluster_page_name(label, page):
+    return f"cluster_{'noise' if label == -1 else label}_p{page}.html"
+
+
+def _write_page(path, title, body):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(f"<html><head><meta charset='utf-8'><title>{html.escape(title)}</title>{REPORT_STYLE}</head><body>")
+        f.write(''.join(body))
+        f.write("</body></html>")
+    os.replace(tmp_path, path)
+
+
+def generate_paged_report(REPORT_DIR, LABELS_PATH, FACE_PATHS, THUMB_DIR, page_size=200, logger=None,
+                          duplicates=None):
+    """
+    分页的增量聚类报告
+
+    生成 index.html 以及每个簇的分页页面，图片使用 112px 缩略图缓存。
+    只重写成员（或成员的连拍重复次数）发生变化的簇页面，已消失的簇页面会被删除。
+    """
+    if not os.path.exists(LABELS_PATH):
+        return
+    labels = np.load(LABELS_PATH)
+    face_paths = FACE_PATHS
+    duplicates = duplicates or {}
+
+    cluster_dict = defaultdict(list)
+    for path, label in zip(face_paths, labels):
+        cluster_dict[int(label)].append(path)
+
+    os.makedirs(REPORT_DIR, exist_ok=True)
+    state_path = os.path.join(REPORT_DIR, 'report_state.json')
+    state = {}
+    if os.path.exists(state_path):
+        with open(state_path, encoding='utf-8') as f:
+            state = json.load(f)
+
+    # 按成员列表计算每个簇的签名，与上次比较找出变化的簇
+    signatures = {str(label): hashlib.sha1('\n'.join(f"{p}\t{len(duplicates.get(p, ()))}" for p in paths)
+                                           .encode('utf-8')).hexdigest()
+                  for label, paths in cluster_dict.items()}
+    changed = [label for label in cluster_dict if state.get(str(label), {}).get('sig') != signatures[str(label)]]
+
+    thumbs = ThumbnailCache(THUMB_DIR)
+    for label in changed:
+        paths = cluster_dict[label]
+        thumb_map = thumbs.ensure(p.split('#')[0] for p in paths)
+        n_pages = max(1, (len(paths) + page_size - 1) // page_size)
+        label_name = "陌生人 (-1)" if label == -1 else f"聚类 {label}"
+        n_duplicates = sum(len(duplicates.get(p, ())) for p in paths)
+        for page in range(n_pages):
+            body = ["<p><a href='index.html'>返回目录</a></p>",
+                    f"<div class='cluster-title'>{label_name} - 共 {len(paths)} 张图片"
+                    f"{f'（另有连拍重复 {n_duplicates} 张）' if n_duplicates else ''}"
+                    f"（第 {page + 1}/{n_pages} 页）</div>"]
+            for p in paths[page * page_size:(page + 1) * page_size]:
+                thumb = thumb_map.get(p.split('#')[0])
+                if not thumb:
+                    continue
+                caption = html.escape(os.path.basename(p))
+                body.append(f"<div class='thumb'{_duplicate_title(duplicates.get(p))}><img loading='lazy' "
+                            f"src='{thumbs.url(thumb, REPORT_DIR)}' alt='{caption}'/>"
+                            f"<div class='thumb-caption'>{caption}{_multiplicity(duplicates.get(p))}</div></div>")
+            pager = [f"<a href='{_cluster_page_name(label, i)}'>{i + 1}</a>" if i != page else f"<span>{i + 1}</span>"
+                     for i in range(n_pages)]
+            body.append(f"<div class='pager'>{''.join(pager)}</div>")
+            _write_page(os.path.join(REPORT_DIR, _cluster_page_name(label, page)), label_name, body)
+
+        # 删除页数减少后多余的旧页面
+        for page in range(n_pages, state.get(str(label), {}).get('pages', 0)):
+            _remove_quietly(os.path.join(REPORT_DIR, _cluster_page_name(label, page)))
+        state[str(label)] = {'sig': signatures[str(label)], 'pages': n_pages,
+                             'cover': thumb_map.get(paths[0].split('#')[0], '')}
+
+    # 删除已消失（如被合并）的簇页面
+    for key in [key for key in state if int(key) not in cluster_dict]:
+        for page in range(state[key].get('pages', 0)):
+            _remove_quietly(os.path.join(REPORT_DIR, _cluster_page_name(int(key), page)))
+        del state[key]
+
+    # 目录页：每个簇一行
+    n_clusters = len(cluster_dict) - (1 if -1 in cluster_dict else 0)
+    body = ["<h1>人脸聚类报告</h1>",
+            f"<p>共聚类出 {n_clusters} 个簇，陌生人（噪声点）数量：{len(cluster_dict.get(-1, []))}</p>",
+            "<table><tr><th>封面</th><th>簇</th><th>图片数</th></tr>"]
+    for label in sorted(cluster_dict, key=lambda l: (l == -1, -len(cluster_dict[l]), l)):
+        entry = state[str(label)]
+        cover = f"<img loading='lazy' width='56' height='56' src='{thumbs.url(entry['cover'], REPORT_DIR)}'/>" \
+            if entry['cover'] else ''
+        label_name = "陌生人 (-1)" if label == -1 else f"聚类 {label}"
+        body.append(f"<tr><td>{cover}</td><td><a href='{_cluster_page_name(label, 0)}'>{label_name}</a></td>"
+                    f"<td>{len(cluster_dict[label])}</td></tr>")
+    body.append("</table>")
+    _write_page(os.path.join(REPORT_DIR, 'index.html'), '人脸聚类报告', body)
+    thumbs.close()
+
+    tmp_path = state_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, state_path)
+
+    message = f"聚类报告已更新：{os.path.join(REPORT_DIR, 'index.html')}，重写 {len(changed)} 个簇页面"
+    if logger is not None:
+        logger.info(message)
+    else:
+        print(message)
+
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass